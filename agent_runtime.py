@@ -0,0 +1,406 @@
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional
+from urllib.parse import urlparse
+
+from browser_use import ActionResult, Agent, SystemPrompt
+from browser_use.agent.views import StepMetadata
+from browser_use.browser.context import BrowserContext
+from browser_use.controller.service import Controller
+from browser_use.dom.history_tree_processor.view import DOMHistoryElement
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import HumanMessage
+
+import metrics
+from conversation_log import ConversationLog
+from dom_diff import DomDiffMessageManager
+from login_detector import RENDERED_FORMS_SCRIPT, detect_rendered_login_form, form_fingerprint
+from macros import Macro, same_location
+from network_profile import NetworkProfile, NetworkStats, get_network_profile
+from page_context import same_page
+from parallel_tabs import ExploreTabsAction, explore_tabs, format_tab_results
+
+logger = logging.getLogger(__name__)
+
+# Local login-form detection on every page; LOGIN_DETECTOR=off leaves it to the LLM and its longer rules
+LOGIN_DETECTOR_ENABLED = os.getenv('LOGIN_DETECTOR', 'on').lower() != 'off'
+
+# Links one "Explore Tabs" call may open; a call with more explores the first ones and lists the rest
+EXPLORE_TABS_MAX_URLS = int(os.getenv('EXPLORE_TABS_MAX_URLS', '12'))
+EXPLORE_TABS_TIMEOUT = float(os.getenv('EXPLORE_TABS_TIMEOUT', '30'))
+EXPLORE_TABS_MAX_CHARS = int(os.getenv('EXPLORE_TABS_MAX_CHARS', '20000'))
+
+class CustomSystemPrompt(SystemPrompt):
+    def get_system_message(self):
+        # browser-use builds the message from its template only; append SiteGuide's rules to it
+        message = super().get_system_message()
+        message.content += f"\n\nIMPORTANT RULES:\n{self.important_rules().strip()}\n{self.additional_context().strip()}\n"
+        return message
+
+    def important_rules(self) -> str:
+        return """
+1. INPUT FIELD DETECTION:
+   - Carefully analyze the current webpage for any input fields (e.g., text inputs, password fields, select boxes) that require user-provided information, such as usernames, email addresses, passwords, one-time passwords (OTPs), phone numbers, or other personal details.
+   - Look for indicators of input fields, including:
+     - HTML input types: `text`, `email`, `password`, `tel`, `number`.
+     - Attributes: `type`, `name`, `id`, `placeholder`, `aria-label`, `aria-describedby`, `title`, `role`, or `class` containing keywords like "username", "email", "password", "otp", "phone", "login", "signin", "register", "authentication", "verify", or "code".
+     - Labels or surrounding text suggesting user input is required (e.g., "Enter your email", "Password", "Phone Number", "Verification Code").
+     - Fields marked as required (`required` attribute) or visually highlighted as mandatory.
+   - Detect multi-step forms (e.g., login pages with separate email/username and password fields, or OTP verification after login).
+   - If an input field requiring user information is detected, immediately call the "Handle Login" action with the current domain (e.g., "Handle Login" with domain "example.com") and pause execution to wait for user input or credentials.
+
+2. LOGIN HANDLING:
+   - When calling "Handle Login", pause the agent and wait for user instructions via the chat interface. The user can either:
+     - Provide credentials manually (e.g., "email password" for automatic login).
+     - Manually log in and type 'continue' to resume.
+     - Type 'exit' to stop the agent.
+   - Do not attempt to guess, generate, or autofill credentials unless explicitly provided by the user.
+   - If the page requires multiple inputs (e.g., username and password), ensure the "Handle Login" action is called once for the domain, and the user provides all necessary credentials in the format specified.
+
+3. ERROR HANDLING AND CONTEXT:
+   - If unsure whether an input field requires user information, err on the side of caution and call "Handle Login" to prompt the user.
+   - Ignore non-sensitive input fields like search bars, comments, or optional form fields unless they clearly relate to authentication or personal data.
+   - Use the browser context (e.g., URLs, DOM structure, and previous actions) to determine if the input field is part of a login, registration, or verification process.
+
+4. PERFORMANCE AND PRECISION:
+   - Avoid unnecessary calls to "Handle Login" for non-authentication fields (e.g., address, preferences, or non-required fields).
+   - Prioritize accuracy over speed, ensuring you only pause for fields that genuinely require user intervention for security or access.
+   - If multiple input fields are detected on the same page, analyze their relationship (e.g., grouped in a form with a "Login" or "Submit" button) and call "Handle Login" once, providing the domain.
+
+5. EXAMPLES:
+   - For a login page with fields labeled "Email" and "Password", call "Handle Login" with the domain and pause for user input.
+   - For an OTP field labeled "Verification Code" after login, call "Handle Login" and wait for credentials or 'continue'.
+   - For a phone number field in a registration form, call "Handle Login" if it’s part of authentication, but skip if it’s optional or unrelated to login.
+"""
+    def additional_context(self) -> str:
+        return """
+- Use the browser’s DOM structure, ARIA attributes, and surrounding text to identify input fields.
+- Leverage the history of actions and page states to determine if the current page is part of an authentication flow.
+- Ensure all sensitive data (e.g., usernames, passwords, OTPs) is handled securely by pausing and deferring to user input via the chat interface.
+"""
+
+class DetectorSystemPrompt(CustomSystemPrompt):
+    """Short login rules for when the local detector spots login forms before the LLM sees them."""
+
+    def important_rules(self) -> str:
+        return """
+1. LOGIN HANDLING:
+   - Login, sign-up and one-time-code forms are detected automatically and the task pauses for the user; don't look for them yourself.
+   - If a page still asks for credentials, a code or personal details only the user has, call "Handle Login" once with the current domain and wait.
+   - Never guess, generate or autofill credentials. Search bars, newsletters and other non-authentication fields need no login.
+"""
+
+    def additional_context(self) -> str:
+        return ""
+
+class SiteGuideAgent(Agent):
+    """browser-use Agent that reports how each step splits into DOM extraction, LLM and actions.
+
+    With `dom_diff`, page state after the first snapshot of a page is sent as changes only.
+    With `detect_logins`, each step first checks the page with the local login-form
+    detector and, on a hit, pauses through the login handler without an LLM call.
+    Each model call is recorded in the process's conversation log under `task_id`.
+    With `parallel_tabs` (a fan-out limit) the agent can explore several links at once.
+    With `network_profile`, the browser context's requests go through its block rules.
+    With `macro`, the run starts by replaying its recorded steps without the LLM and
+    hands over to the normal loop at the first step that no longer matches the page.
+    """
+
+    def __init__(self, *args, dom_diff: bool = False, detect_logins: bool = False, task_id: Optional[str] = None,
+                 parallel_tabs: int = 0, network_profile: Optional[NetworkProfile] = None, macro: Optional[Macro] = None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detect_logins = detect_logins
+        self.task_id = task_id
+        self.network_profile = network_profile
+        self._network_stats: Optional[NetworkStats] = None
+        self.macro = macro
+        self.macro_replay: Optional[dict] = None  # How the replay went, for MacroStore.complete()
+        self._handled_login_forms = set()
+        if parallel_tabs:
+            # Handed to the "Explore Tabs" action by the controller
+            self.context = {'fan_out': parallel_tabs, 'handled_login_forms': self._handled_login_forms}
+        if dom_diff:
+            manager = self._message_manager
+            self._message_manager = DomDiffMessageManager(
+                task=manager.task, system_message=manager.system_prompt, settings=manager.settings, state=manager.state,
+            )
+
+    def dom_diff_stats(self) -> Optional[dict]:
+        if isinstance(self._message_manager, DomDiffMessageManager):
+            return self._message_manager.stats()
+        return None
+
+    def network_stats(self) -> Optional[dict]:
+        if self._network_stats is not None:
+            return self._network_stats.summary()
+        return None
+
+    async def run(self, max_steps: int = 100):
+        if self.network_profile and self._network_stats is None:
+            try:
+                self._network_stats = await self.network_profile.attach(self.browser_context, metrics.current_timeline.get())
+            except Exception as e:
+                logger.warning(f"Network profile not attached, loading pages in full: {str(e)}")
+        replayed = await self._replay_macro() if self.macro and self.macro_replay is None else 0
+        return await super().run(max(max_steps - replayed, 1))
+
+    async def _replay_macro(self) -> int:
+        """Replay the macro's steps until one diverges from the recording; returns how many were replayed."""
+        steps = self.macro.steps
+        report = self.macro_replay = {
+            'macro_id': self.macro.macro_id, 'steps': len(steps), 'replayed': 0, 'divergence': None,
+            'step_seconds': [step['seconds'] for step in steps], 'seconds_saved': 0.0,
+        }
+        start = time.perf_counter()
+        with metrics.span('macro_replay', steps=len(steps)):
+            for step in steps:
+                if self.state.stopped or self.state.paused:
+                    report['divergence'] = 'stopped'
+                    break
+                try:
+                    with metrics.span('macro_step', step=report['replayed'] + 1):
+                        report['divergence'] = await self._replay_step(step)
+                except Exception as e:
+                    report['divergence'] = f"replay failed: {str(e)}"
+                if report['divergence']:
+                    break
+                report['replayed'] += 1
+        elapsed = time.perf_counter() - start
+        report['seconds_saved'] = round(sum(report['step_seconds'][:report['replayed']]) - elapsed, 3)
+
+        replayed = report['replayed']
+        if report['divergence']:
+            logger.info(f"Macro {self.macro.macro_id} diverged at step {replayed + 1} of {len(steps)}: {report['divergence']}")
+            message = (f"Replayed {replayed} of {len(steps)} recorded steps from an earlier run of this task; step "
+                       f"{replayed + 1} no longer matched the page ({report['divergence']}). Continue the task from the current page.")
+        else:
+            logger.info(f"Macro {self.macro.macro_id} replayed all {len(steps)} steps, saving {report['seconds_saved']:.1f}s.")
+            message = (f"Replayed the {len(steps)} recorded steps from an earlier run of this task. "
+                       f"Check the current page and finish the task.")
+        self.state.last_result = [result for result in self.state.last_result or [] if result.error] + [
+            ActionResult(extracted_content=message, include_in_memory=True)]
+        return replayed
+
+    async def _replay_step(self, step: dict) -> Optional[str]:
+        """Run one recorded step if the page still matches it; why it did not match (or failed), else None."""
+        started = time.time()
+        state = await self.browser_context.get_state()
+        if not same_location(state.url, step['url']):
+            return f"expected {step['url']}, found {state.url}"
+        recorded_actions = step['model_output'].get('action', [])
+        model_output = self.AgentOutput.model_validate(step['model_output'])
+        if len(model_output.action) != len(recorded_actions) or not all(action.model_dump(exclude_unset=True)
+                                                                        for action in model_output.action):
+            return "a recorded action is not available to this agent"
+        for action, element in zip(model_output.action, step['elements']):
+            if element is not None and await self._update_action_indices(DOMHistoryElement(**element), action, state) is None:
+                return f"<{element['tag_name']}> element {element['xpath']} not found"
+
+        self.state.n_steps += 1
+        result = await self.multi_act(model_output.action)
+        # Into the conversation as if the LLM had chosen these actions, so it can carry on from them
+        self._message_manager.add_model_output(model_output)
+        for item in result:
+            if item.include_in_memory and item.extracted_content:
+                self._message_manager._add_message_with_tokens(HumanMessage(content='Action result: ' + str(item.extracted_content)))
+        self._make_history_item(model_output, state, result, StepMetadata(
+            step_start_time=started, step_end_time=time.time(), input_tokens=0, step_number=self.state.n_steps))
+        self.state.last_result = result
+        errors = [item.error for item in result if item.error]
+        return f"action failed: {errors[0].strip().splitlines()[-1]}" if errors else None
+
+    async def step(self, step_info=None):
+        self._decide_seconds = self._act_seconds = 0.0
+        start = time.perf_counter()
+        try:
+            if not (self.detect_logins and await self._pause_for_login_form()):
+                await super().step(step_info)
+        finally:
+            total = time.perf_counter() - start
+            metrics.STEPS_TOTAL.inc()
+            metrics.observe('step', total, start=start, step=self.state.n_steps)
+            # What is left is reading the page: DOM tree, screenshot and building the prompt
+            metrics.observe('dom_extraction', max(total - self._decide_seconds - self._act_seconds, 0.0), start=start)
+
+    async def _pause_for_login_form(self) -> bool:
+        """Hand a detected login form straight to the login handler; True if the step is used up by it."""
+        if _login_handler is None:
+            return False
+        try:
+            page = await self.browser_context.get_current_page()
+            with metrics.span('login_detect'):
+                # Judged in the page, so forms hidden by stylesheets don't count; only the form groups come back
+                form = detect_rendered_login_form(await page.evaluate(RENDERED_FORMS_SCRIPT))
+        except Exception as e:
+            logger.debug(f"Login detection skipped: {str(e)}")
+            return False
+        if not form:
+            return False
+        domain = urlparse(page.url).hostname or page.url
+        key = login_form_key(domain, form)
+        if key in self._handled_login_forms:
+            return False  # Already paused for this form once; e.g. a failed login is the LLM's to handle
+        self._handled_login_forms.add(key)
+        logger.info(f"Login form detected on {domain} ({form['reason']}). Pausing task.")
+        message = await _login_handler(domain, f"Detected {form['reason']}", self.browser_context)
+        self.state.last_result = [ActionResult(
+            extracted_content=message or f"A login form on {domain} was detected and the user was asked to log in.",
+            include_in_memory=True,
+        )]
+        return True
+
+    async def get_next_action(self, input_messages):
+        # The LLM span itself is recorded by MemoizingLLM; this only feeds the split above
+        start = time.perf_counter()
+        try:
+            output = await super().get_next_action(input_messages)
+        finally:
+            self._decide_seconds += time.perf_counter() - start
+        if _conversation_log and self.task_id:
+            _conversation_log.record(self.task_id, self.state.n_steps + 1, input_messages, output)
+        return output
+
+    async def multi_act(self, actions, check_for_new_elements: bool = True):
+        with metrics.span('actions', actions=len(actions)):
+            start = time.perf_counter()
+            try:
+                return await super().multi_act(actions, check_for_new_elements)
+            finally:
+                self._act_seconds += time.perf_counter() - start
+
+def login_form_key(domain: str, form: dict) -> str:
+    return f"{domain}|{form_fingerprint(form)}"
+
+class TabReusingContext(BrowserContext):
+    """BrowserContext that keeps working in the tab it was pointed at, not always the newest one.
+
+    browser-use treats the last opened tab as the current one (unless it is attached
+    over CDP), so an agent could not start in a tab that was already open. This
+    context remembers the tab chosen by open_tab() - or by the agent's own tab
+    actions - and hands that one out as the current page while it stays open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active_page = None
+
+    async def open_tab(self, url: str) -> bool:
+        """Make the tab showing `url` current, opening it if no tab has it; True if a tab was reused."""
+        session = await self.get_session()
+        for page in session.context.pages:
+            if not page.is_closed() and same_page(page.url, url):
+                await page.bring_to_front()
+                self.active_page = page
+                return True
+        await self.create_new_tab(url)
+        return False
+
+    async def switch_to_tab(self, page_id: int) -> None:
+        await super().switch_to_tab(page_id)
+        session = await self.get_session()
+        self.active_page = session.context.pages[page_id]
+
+    async def create_new_tab(self, url: Optional[str] = None) -> None:
+        await super().create_new_tab(url)
+        session = await self.get_session()
+        self.active_page = session.context.pages[-1]
+
+    async def _get_current_page(self, session):
+        page = self.active_page
+        if page is not None and not page.is_closed() and page in session.context.pages:
+            return page
+        return await super()._get_current_page(session)
+
+# Initialize controller
+controller = Controller()
+# The same actions plus "Explore Tabs", for agents running with parallel_tabs
+tab_controller = Controller()
+
+# What to do when the agent hits a login: server.py pauses the chat session, worker.py ends the job
+LoginHandler = Callable[[str, str, BrowserContext], Awaitable[None]]
+_login_handler: Optional[LoginHandler] = None
+
+def set_login_handler(handler: Optional[LoginHandler]):
+    """Register the process's reaction to the 'Handle Login' action."""
+    global _login_handler
+    _login_handler = handler
+
+# Where agents of this process record their conversations (replaces browser-use's shared output.txt)
+_conversation_log: Optional[ConversationLog] = None
+
+def set_conversation_log(log: Optional[ConversationLog]):
+    global _conversation_log
+    _conversation_log = log
+
+@tab_controller.action('Handle Login')
+@controller.action('Handle Login')
+async def handle_login_action(domain: str, reason: str, browser: BrowserContext):
+    logger.info(f"Login detected for {domain}. Pausing task.")
+    if _login_handler is None:
+        logger.error("No login handler registered. Cannot pause task.")
+        return
+    return await _login_handler(domain, reason, browser)
+
+@tab_controller.action(
+    'Explore Tabs: open several URLs at once, each in its own tab, and extract what the goal asks for from all of them. '
+    'Use it instead of visiting candidate pages one by one, e.g. to compare products or read several search results.',
+    param_model=ExploreTabsAction,
+)
+async def explore_tabs_action(params: ExploreTabsAction, browser: BrowserContext, page_extraction_llm: BaseChatModel, context: dict):
+    urls, skipped = params.urls[:EXPLORE_TABS_MAX_URLS], params.urls[EXPLORE_TABS_MAX_URLS:]
+    results = await explore_tabs(browser, urls, params.goal, llm=page_extraction_llm, fan_out=context['fan_out'],
+                                 timeout=EXPLORE_TABS_TIMEOUT, max_chars=EXPLORE_TABS_MAX_CHARS)
+    message = format_tab_results(params.goal, results, skipped)
+
+    # Tabs behind a login stay open: the first becomes the current tab and goes through the
+    # login flow like any other login page, the rest are closed to be explored again afterwards
+    logins = [result for result in results if result.get('login')]
+    for result in logins[1:]:
+        await result.pop('page').close()
+    if logins:
+        login = logins[0]
+        page = login.pop('page')
+        session = await browser.get_session()
+        await browser.switch_to_tab(session.context.pages.index(page))
+        domain = urlparse(login['url']).hostname or login['url']
+        # The agent's own detector would otherwise pause a second time for this form on its next step
+        context['handled_login_forms'].add(login_form_key(domain, login['login']))
+        logger.info(f"Login form detected on {domain} while exploring tabs ({login['login']['reason']}). Pausing task.")
+        message += f"\n\n{login['url']} is now the current tab and needs a login; explore the other login pages again once logged in."
+        if _login_handler is not None:
+            reply = await _login_handler(domain, f"Detected {login['login']['reason']}", browser)
+            if reply:
+                message += f"\n{reply}"
+    logger.info(f"Explored {len(results)} tabs ({len(logins)} behind a login).")
+    return ActionResult(extracted_content=message, include_in_memory=True)
+
+def format_result(final_result: str, urls: List[str]) -> str:
+    return f"Final Result:\n{final_result}\n" + "\nURLs visited:\n" + "\n".join(urls)
+
+def build_agent(task: str, llm, browser, browser_context: BrowserContext, use_vision: bool = True,
+                dom_diff: bool = False, task_id: Optional[str] = None, parallel_tabs: int = 0,
+                block_resources: Optional[List[str]] = None, macro: Optional[Macro] = None) -> SiteGuideAgent:
+    """Create the agent for one run, with SiteGuide's prompt and controller.
+
+    `parallel_tabs` > 0 adds the "Explore Tabs" action, opening at most that many tabs at once.
+    `block_resources` (resource types, see network_profile) turns on request blocking in the browser.
+    `macro` (from MacroStore.find) is replayed before the LLM takes over.
+    """
+    return SiteGuideAgent(
+        task=task,
+        llm=llm,
+        browser=browser,
+        browser_context=browser_context,
+        controller=tab_controller if parallel_tabs > 0 else controller,
+        use_vision=use_vision,
+        dom_diff=dom_diff,
+        detect_logins=LOGIN_DETECTOR_ENABLED,
+        task_id=task_id,
+        parallel_tabs=max(parallel_tabs, 0),
+        network_profile=get_network_profile(block_resources),
+        macro=macro,
+        generate_gif=False,  # Replays are rendered by ReplayArtifactStore in the background
+        system_prompt_class=DetectorSystemPrompt if LOGIN_DETECTOR_ENABLED else CustomSystemPrompt,
+    )
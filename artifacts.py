@@ -0,0 +1,237 @@
+import asyncio
+import base64
+import io
+import logging
+import os
+import re
+import time
+import zipfile
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TASK_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+REPLAY_FORMATS = {
+    'gif': ('gif', 'image/gif'),
+    'webp': ('webp', 'image/webp'),
+    'zip': ('zip', 'application/zip'),
+}
+
+
+def sample_frames(frames: List[str], max_frames: int) -> List[str]:
+    """Pick at most `max_frames` evenly spaced frames, always keeping the first and last."""
+    if len(frames) <= max_frames:
+        return list(frames)
+    if max_frames == 1:
+        return [frames[-1]]
+    step = (len(frames) - 1) / (max_frames - 1)
+    return [frames[round(i * step)] for i in range(max_frames)]
+
+
+class ReplayArtifactStore:
+    """Renders run replays from history screenshots in the background and keeps them on disk.
+
+    submit() only grabs references to the screenshots and queues the job, so the run
+    finishes without waiting on image encoding. Workers decode, downsample and encode
+    the frames in a thread, within a frame cap and a byte cap (halving the frames and
+    width until the file fits), and write `<task_id>.<ext>` atomically. Only the newest
+    `keep` artifacts are kept, and only the newest `keep` finished records in memory.
+    """
+
+    def __init__(self, directory: str, fmt: str = 'gif', max_frames: int = 20, max_bytes: int = 5 * 1024 * 1024,
+                 frame_width: int = 640, frame_duration: int = 1500, keep: int = 200, workers: int = 1):
+        if fmt not in REPLAY_FORMATS:
+            raise ValueError(f"Unknown replay format: {fmt}")
+        self.directory = directory
+        self.format = fmt
+        self.max_frames = max(1, max_frames)
+        self.max_bytes = max_bytes
+        self.frame_width = frame_width
+        self.frame_duration = frame_duration
+        self.keep = keep
+        self.workers = workers
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, task_id: str, history, on_ready: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> bool:
+        """Queue a replay for `task_id`; returns False when the history has no screenshots."""
+        frames = [item.state.screenshot for item in history.history if item.state and item.state.screenshot]
+        if not frames:
+            self._remember(task_id, {'status': 'skipped', 'reason': 'no screenshots'})
+            return False
+        self._ensure_workers()
+        self._remember(task_id, {'status': 'pending', 'queued_at': time.time()})
+        # Cap before queueing so a long run doesn't pin every screenshot in memory
+        self._queue.put_nowait((task_id, sample_frames(frames, self.max_frames), on_ready))
+        return True
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Return the artifact record, also finding files written before a restart."""
+        if not TASK_ID_PATTERN.match(task_id or ''):
+            return None
+        record = self.records.get(task_id)
+        if record is None:
+            for extension, media_type in REPLAY_FORMATS.values():
+                path = os.path.join(self.directory, f"{task_id}.{extension}")
+                if os.path.exists(path):
+                    record = {'status': 'ready', 'path': path, 'media_type': media_type, 'bytes': os.path.getsize(path)}
+                    break
+        return record
+
+    async def close(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+
+    def _remember(self, task_id: str, record: Dict[str, Any]):
+        """Store a record, forgetting the oldest finished ones past `keep`.
+
+        Skipped and failed replays have no file for _prune() to remove, so without this
+        their records would pile up. get() still finds forgotten ready replays on disk.
+        """
+        self.records.pop(task_id, None)
+        self.records[task_id] = record
+        excess = len(self.records) - self.keep
+        if excess > 0:
+            finished = [key for key, value in self.records.items() if value['status'] != 'pending']
+            for key in finished[:excess]:
+                del self.records[key]
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._work()))
+
+    async def _work(self):
+        while True:
+            task_id, frames, on_ready = await self._queue.get()
+            start = time.perf_counter()
+            try:
+                record = await asyncio.to_thread(self._render, task_id, frames)
+                record['encode_seconds'] = round(time.perf_counter() - start, 3)
+                self._remember(task_id, record)
+                if record['status'] == 'ready':
+                    logger.info(f"Replay for task {task_id} written: {record['frames']} frames, {record['bytes']} bytes.")
+                    self._prune()
+                else:
+                    logger.warning(f"Replay for task {task_id} not written: {record.get('reason')}")
+                if on_ready:
+                    on_ready(task_id, record)
+            except Exception as e:
+                logger.error(f"Replay generation failed for task {task_id}: {str(e)}")
+                self._remember(task_id, {'status': 'failed', 'reason': str(e)})
+            finally:
+                self._queue.task_done()
+
+    def _render(self, task_id: str, frames: List[str]) -> Dict[str, Any]:
+        fmt = self.format
+        if fmt != 'zip' and not _has_pillow():
+            logger.warning("Pillow is not installed; storing replay frames as a zip of screenshots.")
+            fmt = 'zip'
+
+        extension, media_type = REPLAY_FORMATS[fmt]
+        width = self.frame_width
+        while True:
+            data = self._encode(fmt, frames, width)
+            if len(data) <= self.max_bytes:
+                break
+            # Over budget: drop half the frames (down to the first and last), then shrink
+            # the frames down to 160px, then keep only the last frame
+            if len(frames) > 2:
+                frames = sample_frames(frames, (len(frames) + 1) // 2)
+            elif width > 160:
+                width = max(160, width // 2)
+            elif len(frames) > 1:
+                frames = sample_frames(frames, 1)
+            else:
+                return {'status': 'failed', 'reason': f"replay exceeds {self.max_bytes} bytes"}
+
+        path = os.path.join(self.directory, f"{task_id}.{extension}")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return {'status': 'ready', 'path': path, 'media_type': media_type, 'bytes': len(data), 'frames': len(frames), 'format': fmt}
+
+    def _encode(self, fmt: str, frames: List[str], width: int) -> bytes:
+        buffer = io.BytesIO()
+        if fmt == 'zip':
+            images = self._load_frames(frames, width) if _has_pillow() else None
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+                for index, frame in enumerate(frames):
+                    if images:
+                        # Downsampled JPEGs are a fraction of the raw PNG screenshots
+                        image_buffer = io.BytesIO()
+                        images[index].save(image_buffer, format='JPEG', quality=70)
+                        archive.writestr(f"frame_{index:03d}.jpg", image_buffer.getvalue())
+                    else:
+                        archive.writestr(f"frame_{index:03d}.png", base64.b64decode(frame))
+            return buffer.getvalue()
+
+        images = self._load_frames(frames, width)
+        if fmt == 'gif':
+            images = [image.convert('P', palette=1, colors=128) for image in images]  # 1 = Image.ADAPTIVE
+            images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:],
+                           duration=self.frame_duration, loop=0, optimize=True)
+        else:
+            images[0].save(buffer, format='WEBP', save_all=True, append_images=images[1:],
+                           duration=self.frame_duration, loop=0, quality=60, method=4)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _load_frames(frames: List[str], width: int) -> list:
+        from PIL import Image
+
+        images = []
+        for frame in frames:
+            image = Image.open(io.BytesIO(base64.b64decode(frame))).convert('RGB')
+            if image.width > width:
+                image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            images.append(image)
+        return images
+
+    def _prune(self):
+        try:
+            entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if not name.endswith('.tmp')]
+        except OSError:
+            return
+        if len(entries) <= self.keep:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - self.keep]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Failed to remove old replay {path}: {str(e)}")
+            task_id = os.path.splitext(os.path.basename(path))[0]
+            self.records.pop(task_id, None)
+
+
+def _has_pillow() -> bool:
+    try:
+        import PIL  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_replay_store(default_directory: str) -> Optional[ReplayArtifactStore]:
+    """Build the store from REPLAY_* settings; None when REPLAY_FORMAT=off."""
+    fmt = os.getenv('REPLAY_FORMAT', 'gif').lower()
+    if fmt == 'off':
+        return None
+    return ReplayArtifactStore(
+        directory=os.getenv('REPLAY_DIR') or default_directory,
+        fmt=fmt,
+        max_frames=int(os.getenv('REPLAY_MAX_FRAMES', '20')),
+        max_bytes=int(os.getenv('REPLAY_MAX_BYTES', str(5 * 1024 * 1024))),
+        frame_width=int(os.getenv('REPLAY_FRAME_WIDTH', '640')),
+        keep=int(os.getenv('REPLAY_KEEP', '200')),
+    )
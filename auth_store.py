@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from urllib.parse import urlparse
+
+from caching import SQLiteCache
+
+if TYPE_CHECKING:
+    from browser_use.browser.context import BrowserContext
+
+logger = logging.getLogger(__name__)
+
+# Sets each saved localStorage entry when a page of its origin loads
+LOCAL_STORAGE_SCRIPT = """
+(() => {
+    const origins = %s;
+    const items = origins[window.location.origin];
+    if (!items) return;
+    for (const [name, value] of Object.entries(items)) {
+        try { window.localStorage.setItem(name, value); } catch (e) {}
+    }
+})();
+"""
+
+
+def normalize_domain(value: str) -> str:
+    """'https://www.Example.com/login' -> 'example.com'."""
+    value = (value or '').strip().lower()
+    host = urlparse(value).hostname if '://' in value else value.split('/')[0].split(':')[0]
+    return re.sub(r'^www\.', '', host or '')
+
+
+def matches_domain(host: str, domain: str) -> bool:
+    """True when `host` (a cookie domain or origin host) belongs to `domain`, or the other way round."""
+    host = host.lstrip('.').lower()
+    return host == domain or host.endswith('.' + domain) or domain.endswith('.' + host)
+
+
+def filter_state(state: Dict[str, Any], domain: str) -> Dict[str, Any]:
+    """Keep only the cookies and localStorage origins of `domain` from a Playwright storage state."""
+    return {
+        'cookies': [cookie for cookie in state.get('cookies', []) if matches_domain(cookie.get('domain', ''), domain)],
+        'origins': [origin for origin in state.get('origins', [])
+                    if matches_domain(urlparse(origin.get('origin', '')).hostname or '', domain)],
+    }
+
+
+class AuthStateStore:
+    """Encrypted, expiring cache of logged-in browser storage state (cookies + localStorage) per domain.
+
+    States are Fernet-encrypted before they reach disk and expire after `ttl`
+    seconds. Entries are keyed by profile, owner and domain. The server passes the
+    chat session ID as the owner, so a session only gets back logins it saved
+    itself; other users' sessions naming the same domain never see them. The
+    owner is hashed into the key, so session IDs are not written to disk.
+    """
+
+    def __init__(self, path: str, secret: str, ttl: float = 12 * 3600.0, max_entries: int = 256, profile: str = 'default'):
+        from cryptography.fernet import Fernet
+
+        # Any passphrase works; it is stretched into the 32-byte key Fernet expects
+        self._fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode('utf-8')).digest()))
+        self.backend = SQLiteCache(path, max_entries, ttl)
+        self.profile = profile
+        self.saves = 0
+        self.restores = 0
+        self.invalidations = 0
+
+    def _key(self, owner: str, domain: str) -> str:
+        owner_digest = hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32]
+        return f"{self.profile}:{owner_digest}:{normalize_domain(domain)}"
+
+    def save(self, owner: str, domain: str, state: Dict[str, Any]):
+        token = self._fernet.encrypt(json.dumps(state).encode('utf-8')).decode('ascii')
+        self.backend.set(self._key(owner, domain), token)
+        self.saves += 1
+
+    def load(self, owner: str, domain: str) -> Optional[Dict[str, Any]]:
+        token = self.backend.get(self._key(owner, domain))
+        if token is None:
+            return None
+        try:
+            state = json.loads(self._fernet.decrypt(token.encode('ascii')))
+        except Exception as e:
+            # Written with another key, or tampered with; it is of no use either way
+            logger.warning(f"Discarding unreadable saved login for {domain}: {str(e)}")
+            self.invalidate(owner, domain)
+            return None
+        self.restores += 1
+        return state
+
+    def invalidate(self, owner: str, domain: str):
+        self.backend.delete(self._key(owner, domain))
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'entries': len(self.backend),
+            'saves': self.saves,
+            'restores': self.restores,
+            'invalidations': self.invalidations,
+        }
+
+
+async def capture_state(browser_context: 'BrowserContext', domain: str) -> Optional[Dict[str, Any]]:
+    """Read the context's storage state for `domain`; None if it holds nothing for it."""
+    session = await browser_context.get_session()
+    state = filter_state(await session.context.storage_state(), normalize_domain(domain))
+    return state if state['cookies'] or state['origins'] else None
+
+
+async def apply_state(browser_context: 'BrowserContext', state: Dict[str, Any]):
+    """Load a saved storage state into a running context (cookies now, localStorage on next page load)."""
+    session = await browser_context.get_session()
+    if state.get('cookies'):
+        await session.context.add_cookies(state['cookies'])
+    origins = {
+        origin['origin']: {item['name']: item['value'] for item in origin.get('localStorage', [])}
+        for origin in state.get('origins', []) if origin.get('localStorage')
+    }
+    if origins:
+        await session.context.add_init_script(LOCAL_STORAGE_SCRIPT % json.dumps(origins))
+
+
+def get_auth_store(default_path: str) -> Optional[AuthStateStore]:
+    """Build the store when AUTH_STATE_KEY is set; without a key nothing is saved."""
+    secret = os.getenv('AUTH_STATE_KEY')
+    if not secret:
+        return None
+    try:
+        return AuthStateStore(
+            path=os.getenv('AUTH_STATE_PATH') or default_path,
+            secret=secret,
+            ttl=float(os.getenv('AUTH_STATE_TTL', str(12 * 3600))),
+            profile=os.getenv('AUTH_STATE_PROFILE', 'default'),
+        )
+    except ImportError:
+        logger.warning("AUTH_STATE_KEY is set but the cryptography package is missing; saved logins are disabled.")
+        return None
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Placeholder a batch template uses for each URL, e.g. "extract the contact email from {url}"
+URL_PLACEHOLDER = '{url}'
+
+
+def expand_tasks(data: Dict[str, Any], max_items: int) -> List[str]:
+    """Turn a /run_batch body into task strings: an explicit `tasks` list, or `template` applied to `urls`."""
+    tasks = data.get('tasks')
+    if tasks is None and data.get('template'):
+        template = data['template']
+        urls = data.get('urls') or []
+        if URL_PLACEHOLDER in template:
+            tasks = [template.replace(URL_PLACEHOLDER, url) for url in urls]
+        else:
+            tasks = [f"{template} {url}" for url in urls]
+    if not isinstance(tasks, list) or not tasks:
+        raise ValueError("Provide a non-empty 'tasks' list, or a 'template' with 'urls'.")
+    tasks = [str(task).strip() for task in tasks]
+    if not all(tasks):
+        raise ValueError("Tasks must not be empty.")
+    if len(tasks) > max_items:
+        raise ValueError(f"A batch can hold at most {max_items} tasks.")
+    return tasks
+
+
+async def fan_out(tasks: List[str], run_item: Callable[[int, str], Awaitable[Dict[str, Any]]], parallelism: int) -> AsyncIterator[Dict[str, Any]]:
+    """Run `run_item(index, task)` for every task, at most `parallelism` at once, yielding results as they finish.
+
+    If the consumer stops early (e.g. the client disconnected), items still running
+    are cancelled.
+    """
+    slots = asyncio.Semaphore(max(1, parallelism))
+    finished: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int, task: str):
+        async with slots:
+            start = time.perf_counter()
+            try:
+                result = await run_item(index, task)
+            except Exception as e:
+                logger.error(f"Batch item {index} failed: {str(e)}")
+                result = {'status': 'error', 'error': str(e)}
+            result.setdefault('seconds', round(time.perf_counter() - start, 3))
+        result.update(index=index, task=task)
+        await finished.put(result)
+
+    pending = [asyncio.create_task(run(index, task)) for index, task in enumerate(tasks)]
+    try:
+        for _ in range(len(pending)):
+            yield await finished.get()
+    finally:
+        for item in pending:
+            item.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def summarize(results: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Aggregate per-item results: status counts, timing spread and the speed-up over running them one by one."""
+    by_status: Dict[str, int] = {}
+    for result in results:
+        by_status[result['status']] = by_status.get(result['status'], 0) + 1
+    seconds = sorted(result['seconds'] for result in results)
+    total = sum(seconds)
+
+    def percentile(fraction: float) -> float:
+        return seconds[min(int(fraction * len(seconds)), len(seconds) - 1)] if seconds else 0.0
+
+    return {
+        'items': len(results),
+        'by_status': by_status,
+        'wall_seconds': round(wall_seconds, 3),
+        'item_seconds_total': round(total, 3),
+        'item_seconds_p50': percentile(0.5),
+        'item_seconds_p95': percentile(0.95),
+        'item_seconds_max': seconds[-1] if seconds else 0.0,
+        'speedup': round(total / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        'timings': [{'index': result['index'], 'status': result['status'], 'seconds': result['seconds']}
+                    for result in sorted(results, key=lambda result: result['index'])],
+    }
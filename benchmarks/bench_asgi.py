@@ -0,0 +1,120 @@
+"""Compare request latency/throughput of the native Starlette app against the old
+Flask-behind-WsgiToAsgi setup.
+
+Both apps serve the same session manager in-process through httpx's ASGI transport,
+so the numbers isolate framework and bridge overhead from network noise.
+
+    python benchmarks/bench_asgi.py --requests 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# The server builds its LLM and transcription clients on first use, and neither route used here needs them
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask, jsonify, request
+
+import server
+
+
+def build_legacy_app(loop: asyncio.AbstractEventLoop):
+    """The pre-migration shape: Flask views served through the WSGI bridge.
+
+    Sync Flask views run in the bridge's worker threads, while sessions and their
+    message channels (asyncio.Event) belong to the event loop, so those views hand
+    session work to the loop with call_soon_threadsafe and wait for it. Async views
+    are already run on the loop by asgiref and call the session directly.
+    """
+    flask_app = Flask(__name__)
+
+    def on_loop(func, *args):
+        future = concurrent.futures.Future()
+
+        def call():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        loop.call_soon_threadsafe(call)
+        return future.result()
+
+    def drain(session_id: str):
+        return server.session_manager.get(session_id).drain_messages()
+
+    def send(session_id: str, message: str):
+        return server.session_manager.get(session_id).send_message(message)
+
+    @flask_app.route('/get_agent_messages', methods=['GET'])
+    def get_agent_messages():
+        messages = on_loop(drain, request.args.get('session_id') or server.DEFAULT_SESSION_ID)
+        return jsonify({'messages': messages})
+
+    @flask_app.route('/run_task', methods=['POST'])
+    async def run_task():
+        send(request.form.get('session_id') or server.DEFAULT_SESSION_ID, "No active agent to exit.")
+        return '', 400
+
+    return WsgiToAsgi(flask_app)
+
+
+async def run_load(app, method: str, url: str, total: int, concurrency: int, data=None) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                payload = dict(data or {}, session_id=f'bench-{i % concurrency}')
+                if method == 'GET':
+                    await client.get(url, params=payload)
+                else:
+                    await client.post(url, data=payload)
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    apps = {'flask_wsgi_to_asgi': build_legacy_app(asyncio.get_running_loop()), 'starlette_native': server.app}
+    scenarios = [
+        ('poll', 'GET', '/get_agent_messages', None),
+        ('run_task_exit', 'POST', '/run_task', {'task': 'exit'}),
+    ]
+    results = {}
+    for app_name, app in apps.items():
+        for scenario, method, url, data in scenarios:
+            # Warm up imports, thread pools and routing caches before measuring
+            await run_load(app, method, url, 50, args.concurrency, data)
+            results[f'{app_name}/{scenario}'] = await run_load(app, method, url, args.requests, args.concurrency, data)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,371 @@
+"""Offline end-to-end benchmark: run scripted agent tasks against local fixture sites.
+
+The fixture pages in benchmarks/fixtures are served from a local HTTP server, the
+agent's model is a ScriptedLLM following a fixed plan per scenario, and voice input
+goes through the stub transcriber, so no API keys or network access are needed (only
+Playwright's Chromium). Tasks go through the server app in-process, so the numbers
+cover the routes, session handling, browser setup and the agent loop.
+
+Per run it reports time to first chat message, agent steps, wall time, peak RSS of
+the process tree (server + browsers) and the peak number of browser processes, as
+JSON. With --baseline, runs that got slower, heavier or longer than a previous result
+are listed under "regressions" and the exit code is 1.
+
+    python benchmarks/bench_e2e.py --repeat 3 --output bench.json
+    python benchmarks/bench_e2e.py --baseline bench.json
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+sys.path.insert(0, str(ROOT))
+
+# Everything offline: scripted model, canned transcripts, no telemetry, replays, macros or queue
+os.environ['LLM_BACKEND'] = 'scripted'
+os.environ['TRANSCRIBER'] = 'stub'
+os.environ['TASK_EXECUTION'] = 'inline'
+os.environ['JOB_WORKERS'] = '0'
+os.environ.setdefault('REPLAY_FORMAT', 'off')
+# Repeats would otherwise replay the first run's macro and drift from the scripted plan
+os.environ.setdefault('MACROS', 'off')
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'false')
+os.environ.setdefault('STUB_TRANSCRIPT', 'Open the fixture shop|and list the product prices')
+
+import httpx
+
+LOGIN_EMAIL = 'bench@example.com'
+LOGIN_PASSWORD = 'fixture-password'
+
+# A plan step is either a ready AgentOutput dict or a function of the current page state text
+PlanStep = Union[dict, Callable[[str], dict]]
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server() -> ThreadingHTTPServer:
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(FixtureHandler, directory=str(FIXTURES)))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def output(goal: str, *actions: dict) -> dict:
+    return {
+        'current_state': {'evaluation_previous_goal': 'Success', 'memory': '', 'next_goal': goal},
+        'action': list(actions),
+    }
+
+
+def element_index(page: str, tag: str, text: str) -> int:
+    """Highlight index of the first `tag` element whose listing mentions `text`."""
+    match = re.search(rf'^\[(\d+)\]<{tag} [^\n]*{re.escape(text)}', page, re.MULTILINE | re.IGNORECASE)
+    if not match:
+        raise LookupError(f"No <{tag}> matching {text!r} on the page")
+    return int(match.group(1))
+
+
+def last_page_state(messages: list) -> str:
+    for message in reversed(messages):
+        content = getattr(message, 'content', '')
+        if isinstance(content, list):
+            content = '\n'.join(part.get('text', '') for part in content if isinstance(part, dict))
+        if 'Interactive elements' in content or 'Current url' in content:
+            return content
+    return ''
+
+
+def scripted_responder(plan: List[PlanStep]):
+    def respond(messages: list, index: int) -> dict:
+        if index >= len(plan):
+            return output('Finish', {'done': {'text': 'Plan exhausted.', 'success': False}})
+        step = plan[index]
+        return step(last_page_state(messages)) if callable(step) else step
+    return respond
+
+
+def build_scenarios(base_url: str) -> Dict[str, dict]:
+    """Task, plan and input kind of each scenario, against the fixture server at `base_url`."""
+    from agent_runtime import LOGIN_DETECTOR_ENABLED
+
+    secret_domain = '127.0.0.1'
+    # With the local detector the login pause comes before the model is asked; otherwise the model asks for it
+    ask_for_login = [] if LOGIN_DETECTOR_ENABLED else [
+        output('Ask the user to log in', {'handle_login_action': {'domain': secret_domain, 'reason': 'Sign-in form'}}),
+    ]
+    return {
+        'browse_extract': {
+            'task': f"Open {base_url}/index.html, go to the products page and list the prices.",
+            'plan': [
+                output('Open the shop', {'go_to_url': {'url': f'{base_url}/index.html'}}),
+                lambda page: output('Open the products page', {'click_element': {'index': element_index(page, 'a', 'Products')}}),
+                output('Read the prices', {'extract_content': {'goal': 'product names and prices'}}),
+                output('Report', {'done': {'text': 'Blue kettle $24.00, Cast iron pan $39.50, Chef\'s knife $58.00', 'success': True}}),
+            ],
+        },
+        'login_form': {
+            'task': f"Open {base_url}/login.html and tell me the status of my latest order.",
+            'plan': [
+                output('Open the sign-in page', {'go_to_url': {'url': f'{base_url}/login.html'}}),
+                *ask_for_login,
+                lambda page: output('Enter the email', {'input_text': {
+                    'index': element_index(page, 'input', 'email'), 'text': f'<secret>{secret_domain}_email</secret>'}}),
+                lambda page: output('Enter the password', {'input_text': {
+                    'index': element_index(page, 'input', 'password'), 'text': f'<secret>{secret_domain}_password</secret>'}}),
+                lambda page: output('Submit', {'click_element': {'index': element_index(page, 'button', 'Sign in')}}),
+                output('Report', {'done': {'text': 'Order #1042 (Blue kettle) has shipped.', 'success': True}}),
+            ],
+            # Chat replies the "user" gives when the agent asks for them
+            'replies': [
+                ('Would you like to provide your credentials', 'yes'),
+                ('Please provide your email/username and password', f'{LOGIN_EMAIL} {LOGIN_PASSWORD}'),
+            ],
+        },
+        'voice_task': {
+            'audio_segments': 2,
+            'plan': [
+                output('Open the products page', {'go_to_url': {'url': f'{base_url}/products.html'}}),
+                output('Read the prices', {'extract_content': {'goal': 'product names and prices'}}),
+                output('Report', {'done': {'text': 'Three products, from $24.00 to $58.00.', 'success': True}}),
+            ],
+        },
+    }
+
+
+class ProcessSampler:
+    """Samples RSS of this process and its descendants, and counts browser processes, in a thread.
+
+    Uses /proc, so tree-wide numbers are Linux only; elsewhere only this process's
+    peak RSS is reported and the browser count is None.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_browsers: Optional[int] = 0 if os.path.isdir('/proc') else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        if self.peak_browsers is None:
+            import resource
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak_rss = max(self.peak_rss, rss if sys.platform == 'darwin' else rss * 1024)
+            return
+        rss = browsers = 0
+        for pid in self._tree(os.getpid()):
+            try:
+                with open(f'/proc/{pid}/statm') as statm:
+                    rss += int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+                with open(f'/proc/{pid}/cmdline', 'rb') as cmdline:
+                    args = cmdline.read()
+            except (OSError, ValueError, IndexError):
+                continue  # Exited while we were looking
+            # A browser's main process; its renderer/GPU/utility children carry --type=
+            if b'chrom' in args.split(b'\0')[0].lower() and b'--type=' not in args:
+                browsers += 1
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_browsers = max(self.peak_browsers, browsers)
+
+    @staticmethod
+    def _tree(root: int) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as stat:
+                    ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        pids, stack = [], [root]
+        while stack:
+            pid = stack.pop()
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+        return pids
+
+
+async def run_scenario(server, client: httpx.AsyncClient, name: str, scenario: dict, session_id: str,
+                       llm_delay: float, timeout: float) -> dict:
+    from llm import MemoizingLLM, ScriptedLLM
+
+    # A fresh model per run so no run is answered from an earlier run's memo cache
+    server.lazy_llm.set(MemoizingLLM(
+        ScriptedLLM(responder=scripted_responder(scenario['plan']), delay=llm_delay),
+        cache_size=int(os.getenv('LLM_CACHE_SIZE', '256')),
+        ttl=float(os.getenv('LLM_CACHE_TTL', '600')),
+    ))
+    session = server.session_manager.get(session_id)
+    replies = list(scenario.get('replies', []))
+    messages = []
+    first_message_at = None
+
+    with ProcessSampler() as sampler:
+        started = time.perf_counter()
+        if 'audio_segments' in scenario:
+            files = [('audio', (f'segment-{i}.webm', os.urandom(2048), 'audio/webm')) for i in range(scenario['audio_segments'])]
+            response = await client.post('/upload_audio', params={'session_id': session_id, 'headless': 'true'}, files=files)
+        else:
+            response = await client.post('/run_task', data={'task': scenario['task'], 'headless': 'true', 'session_id': session_id})
+        if response.status_code >= 400:
+            raise RuntimeError(f"{name}: the server refused the task ({response.status_code})")
+
+        run = session.run
+        cursor = 0
+        deadline = started + timeout
+        timed_out = False
+        while True:
+            poll = await client.get('/get_agent_messages', params={'session_id': session_id, 'after': cursor, 'wait': 0.5})
+            body = poll.json()
+            cursor = body['last_event_id']
+            for message in body['messages']:
+                if first_message_at is None:
+                    first_message_at = time.perf_counter()
+                messages.append(message)
+                # Play the user's side of the login conversation
+                if replies and replies[0][0] in message:
+                    await client.post('/run_task', data={'task': replies.pop(0)[1], 'session_id': session_id})
+            if run is None or (run.done() and not body['messages']):
+                break
+            if time.perf_counter() > deadline and not timed_out:
+                timed_out = True
+                await client.post('/run_task', data={'task': 'exit', 'session_id': session_id})
+            elif timed_out and time.perf_counter() > deadline + 30:
+                run.cancel()  # The agent ignored the stop request; don't let it hold up the other runs
+                break
+        wall = time.perf_counter() - started
+
+    timeline = server.metrics.timelines.get(session.task_id) if session.task_id else None
+    spans = timeline.spans if timeline else []
+    return {
+        'outcome': 'timeout' if timed_out else (timeline.outcome if timeline else 'not_started'),
+        'ttfm_seconds': round(first_message_at - started, 4) if first_message_at else None,
+        'wall_seconds': round(wall, 4),
+        'steps': sum(1 for span in spans if span['name'] == 'step'),
+        'llm_calls': sum(1 for span in spans if span['name'] == 'llm'),
+        'peak_rss_mb': round(sampler.peak_rss / (1024 * 1024), 1),
+        'browsers': sampler.peak_browsers,
+        'messages': len(messages),
+        'phase_seconds': timeline.to_dict()['totals'] if timeline else {},
+        'final_message': messages[-1] if messages else None,
+    }
+
+
+def median_of(runs: List[dict]) -> dict:
+    summary = {}
+    for key in ('ttfm_seconds', 'wall_seconds', 'steps', 'llm_calls', 'peak_rss_mb', 'browsers'):
+        values = [run[key] for run in runs if run.get(key) is not None]
+        summary[key] = round(statistics.median(values), 4) if values else None
+    summary['completed'] = sum(1 for run in runs if run['outcome'] == 'completed')
+    return summary
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> List[dict]:
+    """Compare scenario medians with a previous result; timings and memory get `tolerance` slack."""
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name, {}).get('median')
+        if not before:
+            continue
+        now = scenario['median']
+        for key in ('ttfm_seconds', 'wall_seconds', 'peak_rss_mb', 'steps', 'llm_calls', 'browsers'):
+            if now.get(key) is None or before.get(key) is None:
+                continue
+            limit = before[key] * (1 + tolerance) if key in ('ttfm_seconds', 'wall_seconds', 'peak_rss_mb') else before[key]
+            if now[key] > limit:
+                regressions.append({'scenario': name, 'metric': key, 'baseline': before[key], 'current': now[key]})
+        if now['completed'] < before.get('completed', 0):
+            regressions.append({'scenario': name, 'metric': 'completed', 'baseline': before['completed'], 'current': now['completed']})
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', help='run only these scenarios (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--pool', type=int, default=0, help='BROWSER_POOL_SIZE for the run (0 launches a browser per task)')
+    parser.add_argument('--llm-delay', type=float, default=0.0, help='simulated model latency per call, in seconds')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds before a run is stopped')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    parser.add_argument('--baseline', help='earlier result to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slow-down/growth over the baseline')
+    args = parser.parse_args()
+
+    os.environ['BROWSER_POOL_SIZE'] = str(args.pool)
+    import server
+
+    httpd = start_fixture_server()
+    base_url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    scenarios = build_scenarios(base_url)
+    selected = args.scenario or list(scenarios)
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'browser_pool': args.pool,
+            'llm_delay': args.llm_delay,
+            'repeat': args.repeat,
+        },
+        'scenarios': {},
+    }
+
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with server.lifespan(server.app):
+            # Runs are compared warm; cold start is what bench_startup.py measures
+            if server.warmup_task:
+                await server.warmup_task
+            if args.pool > 0:
+                await server.browser_pool.start()
+            async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=args.timeout) as client:
+                for name in selected:
+                    runs = []
+                    for attempt in range(args.repeat):
+                        runs.append(await run_scenario(server, client, name, scenarios[name], f'bench-{name}-{attempt}',
+                                                       args.llm_delay, args.timeout))
+                    results['scenarios'][name] = {'median': median_of(runs), 'runs': runs}
+    finally:
+        httpd.shutdown()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['regressions'] = find_regressions(results, json.load(f), args.tolerance)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,95 @@
+"""Measure the local login-form detector against the labelled HTML corpus.
+
+Pages under fixtures/login_forms/positive must be detected as login forms and pages
+under fixtures/login_forms/negative must not. Prints precision, recall, per-page
+detection time and every misclassified page as JSON; with --min-precision or
+--min-recall the exit code is 1 when the detector falls below them.
+
+By default the detector reads the HTML as a file. With --rendered each page is loaded
+in headless Chromium and checked the way agents check live pages (RENDERED_FORMS_SCRIPT),
+so visibility from stylesheets counts; that needs Playwright's Chromium.
+
+    python benchmarks/bench_login_detector.py
+    python benchmarks/bench_login_detector.py --min-precision 0.95 --min-recall 0.9
+    python benchmarks/bench_login_detector.py --rendered --repeat 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from login_detector import RENDERED_FORMS_SCRIPT, detect_login_form, detect_rendered_login_form
+
+CORPUS = Path(__file__).resolve().parent / 'fixtures' / 'login_forms'
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=str(CORPUS))
+    parser.add_argument('--repeat', type=int, default=50, help='detections per page for the timing figures')
+    parser.add_argument('--rendered', action='store_true', help='check each page loaded in headless Chromium')
+    parser.add_argument('--min-precision', type=float, default=0.0)
+    parser.add_argument('--min-recall', type=float, default=0.0)
+    args = parser.parse_args()
+
+    page = browser = None
+    if args.rendered:
+        from playwright.async_api import async_playwright
+
+        playwright = await async_playwright().start()
+        browser = await playwright.chromium.launch(headless=True)
+        page = await browser.new_page()
+
+    counts = {'tp': 0, 'fp': 0, 'tn': 0, 'fn': 0}
+    misclassified = []
+    timings = []
+    try:
+        pages = [(label, path) for label in ('positive', 'negative')
+                 for path in sorted((Path(args.corpus) / label).glob('*.html'))]
+        for label, path in pages:
+            html = path.read_text(encoding='utf-8')
+            if page:
+                await page.set_content(html)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                if page:
+                    result = detect_rendered_login_form(await page.evaluate(RENDERED_FORMS_SCRIPT))
+                else:
+                    result = detect_login_form(html)
+            timings.append((time.perf_counter() - start) / args.repeat)
+            detected = result is not None
+            key = ('tp' if detected else 'fn') if label == 'positive' else ('fp' if detected else 'tn')
+            counts[key] += 1
+            if key in ('fp', 'fn'):
+                misclassified.append({'page': f'{label}/{path.name}', 'detected': detected,
+                                      'reason': result['reason'] if result else None})
+    finally:
+        if browser:
+            await browser.close()
+            await playwright.stop()
+
+    precision = counts['tp'] / (counts['tp'] + counts['fp']) if counts['tp'] + counts['fp'] else 0.0
+    recall = counts['tp'] / (counts['tp'] + counts['fn']) if counts['tp'] + counts['fn'] else 0.0
+    timings.sort()
+    report = {
+        'mode': 'rendered' if args.rendered else 'html',
+        'pages': sum(counts.values()),
+        **counts,
+        'precision': round(precision, 4),
+        'recall': round(recall, 4),
+        'f1': round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+        'detect_ms_p50': round(statistics.median(timings) * 1000, 3) if timings else None,
+        'detect_ms_max': round(timings[-1] * 1000, 3) if timings else None,
+        'misclassified': misclassified,
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if precision < args.min_precision or recall < args.min_recall else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
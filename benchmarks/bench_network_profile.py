@@ -0,0 +1,89 @@
+"""Compare loading pages with and without the resource-blocking network profile.
+
+Each URL is loaded --repeat times in a fresh headless browser context, once plain and
+once with the profile attached (the same way agents get it), alternating the order.
+Reports, per mode, the median page-load time (navigation start to the load event),
+bytes loaded and the browser's JS heap afterwards, plus the requests the profile
+blocked and the bytes it saved, as JSON. Needs Playwright's Chromium and network
+access to the URLs.
+
+    python benchmarks/bench_network_profile.py https://news.ycombinator.com https://en.wikipedia.org/wiki/Web_browser
+    python benchmarks/bench_network_profile.py --types image,media,font,stylesheet --repeat 5 URL...
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from network_profile import NetworkProfile, TRACKER_DOMAINS, resolve_blocked_types
+
+
+async def load(browser, url: str, profile, timeout: float) -> dict:
+    from browser_use.browser.context import BrowserContext, BrowserContextConfig
+
+    context = BrowserContext(browser=browser, config=BrowserContextConfig())
+    try:
+        # A profile that blocks nothing still measures, so both modes pay for the interception alike
+        stats = await (profile or NetworkProfile([], [])).attach(context)
+        page = await context.get_current_page()
+        await page.goto(url, wait_until='load', timeout=timeout * 1000)
+        await asyncio.sleep(1.0)  # Let late requests finish so their bytes are counted
+        heap = await page.evaluate('performance.memory ? performance.memory.usedJSHeapSize : null')
+        return dict(stats.summary(), js_heap_bytes=heap)
+    finally:
+        await context.close()
+
+
+def median(values: list):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 4) if values else None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--types', default='true', help="resource types to block, as for block_resources (default: the server's)")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    from browser_use import Browser, BrowserConfig
+
+    profile = NetworkProfile(resolve_blocked_types(args.types, use_vision=False), TRACKER_DOMAINS)
+    browser = Browser(config=BrowserConfig(headless=True, disable_security=True))
+    report = []
+    try:
+        for url in args.urls:
+            runs = {'full': [], 'blocking': []}
+            for index in range(args.repeat):
+                modes = [('full', None), ('blocking', profile)]
+                for mode, mode_profile in (modes if index % 2 == 0 else modes[::-1]):
+                    runs[mode].append(await load(browser, url, mode_profile, args.timeout))
+            result = {'url': url}
+            for mode, mode_runs in runs.items():
+                result[mode] = {
+                    'page_load_seconds': median([run['avg_page_load_seconds'] for run in mode_runs]),
+                    'bytes_loaded': median([run['bytes_loaded'] for run in mode_runs]),
+                    'js_heap_bytes': median([run['js_heap_bytes'] for run in mode_runs]),
+                }
+            result['blocking'].update(
+                blocked=median([run['blocked'] for run in runs['blocking']]),
+                bytes_saved_estimate=median([run['bytes_saved_estimate'] for run in runs['blocking']]),
+            )
+            full, blocking = result['full'], result['blocking']
+            if full['page_load_seconds'] and blocking['page_load_seconds']:
+                result['load_speedup'] = round(full['page_load_seconds'] / blocking['page_load_seconds'], 2)
+            if full['bytes_loaded'] is not None and blocking['bytes_loaded'] is not None:
+                result['bytes_saved_measured'] = full['bytes_loaded'] - blocking['bytes_loaded']
+            report.append(result)
+    finally:
+        await browser.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+"""Measure how fast the server imports, starts answering and becomes ready.
+
+Each repeat runs in fresh processes: one that only imports server.py, and one that
+serves it with uvicorn. Reported, as medians over --repeat runs:
+
+  import_seconds          `import server` in a fresh interpreter
+  first_request_seconds   process spawn until /healthz answers 200
+  first_generate_seconds  /generate (the LLM on a cold path) right after that
+  ready_seconds           process spawn until /readyz answers 200 (warm-up done)
+
+plus the server's own startup milestones from /readyz and, with --top, the slowest
+imports under server.py. Runs offline (scripted LLM, stub transcriber) unless --live.
+With --max-import / --max-first-request the exit code is 1 when a median is over them.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --warmup off --top 15
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def server_env(args) -> dict:
+    env = dict(os.environ, WARMUP=args.warmup, BROWSER_POOL_SIZE=str(args.pool), CONVERSATION_LOG='off')
+    if not args.live:
+        env.update(LLM_BACKEND='scripted', TRANSCRIBER='stub')
+    return env
+
+
+def measure_import(env: dict) -> float:
+    code = 'import time; start = time.perf_counter(); import server; print(time.perf_counter() - start)'
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, top: int) -> list:
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import server'], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only modules imported directly by server.py (or by Python itself) are listed
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append({'module': name.strip(), 'seconds': int(cumulative) / 1e6})
+    return sorted(rows, key=lambda row: row['seconds'], reverse=True)[:top]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(url: str, data: dict = None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'} if body else {})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'null')
+    except (urllib.error.URLError, ConnectionError):
+        return None, None
+
+
+def measure_serving(env: dict, timeout: float) -> dict:
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    code = f"import uvicorn, server; uvicorn.run(server.app, host='127.0.0.1', port={port}, log_level='warning')"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        while request(f'{base}/healthz')[0] != 200:
+            if process.poll() is not None or time.perf_counter() - started > timeout:
+                raise RuntimeError('server did not come up')
+            time.sleep(0.01)
+        result['first_request_seconds'] = time.perf_counter() - started
+
+        start = time.perf_counter()
+        status, _ = request(f'{base}/generate', {'prompt': 'List the product prices', 'link': ''})
+        result['first_generate_seconds'] = time.perf_counter() - start
+        result['first_generate_status'] = status
+
+        while True:
+            status, body = request(f'{base}/readyz')
+            if status == 200 or (body and not body['warming_up']):
+                break
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError('server did not become ready')
+            time.sleep(0.02)
+        result['ready_seconds'] = time.perf_counter() - started if status == 200 else None
+        result['readyz'] = body
+    finally:
+        process.terminate()
+        process.wait(10)
+    return result
+
+
+def median(values: list):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values), 4) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--warmup', default='runtime,llm,transcriber', help='WARMUP for the server (or off)')
+    parser.add_argument('--pool', type=int, default=0, help='BROWSER_POOL_SIZE (warmed with --warmup ...,browsers)')
+    parser.add_argument('--live', action='store_true', help='use the configured LLM and transcriber instead of offline stand-ins')
+    parser.add_argument('--top', type=int, default=0, help='also list the N slowest imports under server.py')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--max-import', type=float)
+    parser.add_argument('--max-first-request', type=float)
+    args = parser.parse_args()
+
+    env = server_env(args)
+    imports = [measure_import(env) for _ in range(args.repeat)]
+    runs = [measure_serving(env, args.timeout) for _ in range(args.repeat)]
+    report = {
+        'warmup': args.warmup,
+        'import_seconds': median(imports),
+        'first_request_seconds': median([run['first_request_seconds'] for run in runs]),
+        'first_generate_seconds': median([run['first_generate_seconds'] for run in runs]),
+        'ready_seconds': median([run['ready_seconds'] for run in runs]),
+        'server_milestones': runs[-1]['readyz']['startup_seconds'],
+        'components': runs[-1]['readyz']['components'],
+    }
+    if args.top:
+        report['slowest_imports'] = slowest_imports(env, args.top)
+    print(json.dumps(report, indent=2))
+
+    failed = (args.max_import is not None and report['import_seconds'] > args.max_import) or \
+             (args.max_first_request is not None and report['first_request_seconds'] > args.max_first_request)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+if TYPE_CHECKING:
+    # browser-use is imported when the first browser launches, not when the pool is configured
+    from browser_use import Browser
+    from browser_use.browser.context import BrowserContextConfig, BrowserContext
+
+logger = logging.getLogger(__name__)
+
+
+class PooledBrowser:
+    """A launched browser plus the bookkeeping the pool needs to recycle it."""
+
+    def __init__(self, browser: 'Browser'):
+        self.browser = browser
+        self.tasks_run = 0
+        self.active = 0
+        self.retiring = False
+        self.spare_context: Optional['BrowserContext'] = None
+        self.spare_task: Optional[asyncio.Task] = None
+
+    def is_healthy(self) -> bool:
+        playwright_browser = self.browser.playwright_browser
+        return playwright_browser is not None and playwright_browser.is_connected()
+
+
+class BrowserLease:
+    """A browser checked out of the pool together with a context owned by one task."""
+
+    def __init__(self, pooled: PooledBrowser, context: 'BrowserContext'):
+        self.pooled = pooled
+        self.browser = pooled.browser
+        self.context = context
+        self.failed = False
+
+
+class BrowserPool:
+    """Keeps warm headless browsers (and a pre-created context per browser) ready for tasks.
+
+    Each task gets its own BrowserContext, so cookies and storage never leak between
+    tasks, while the Chromium process itself is reused. Browsers are recycled after
+    `max_tasks_per_browser` tasks, or as soon as they are found disconnected.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_tasks_per_browser: int = 20,
+        contexts_per_browser: int = 4,
+        headless: bool = True,
+        health_check_interval: float = 30.0,
+        context_config_factory: Optional[Callable[[], 'BrowserContextConfig']] = None,
+    ):
+        self.size = size
+        self.max_tasks_per_browser = max_tasks_per_browser
+        self.contexts_per_browser = contexts_per_browser
+        self.headless = headless
+        self.health_check_interval = health_check_interval
+        self.context_config_factory = context_config_factory
+        self._browsers: List[PooledBrowser] = []
+        self._condition = asyncio.Condition()
+        self._started = False
+        self._closed = False
+        self._pending_launches = 0
+        self._launch_failures = 0  # Consecutive failed launches; acquire() gives up once every slot failed
+        self._last_launch_error: Optional[Exception] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Launch the pool's browsers. Safe to call more than once."""
+        if self._started:
+            return
+        self._started = True
+        self._closed = False
+        # Counted as pending right away, so tasks arriving while these launch wait for them instead of launching more
+        await asyncio.gather(*(self._schedule_launch() for _ in range(self.size)))
+        self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Browser pool started with {len(self._browsers)}/{self.size} warm browsers.")
+
+    async def close(self):
+        """Close every browser in the pool."""
+        self._closed = True
+        self._started = False
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        async with self._condition:
+            browsers, self._browsers = self._browsers, []
+            self._condition.notify_all()
+        await asyncio.gather(*(self._close_browser(pooled) for pooled in browsers), return_exceptions=True)
+
+    async def acquire(self) -> BrowserLease:
+        """Check out a warm browser and a fresh context for one task."""
+        await self.start()
+        async with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed.")
+                pooled = self._pick_browser()
+                if pooled is not None:
+                    pooled.active += 1
+                    break
+                if len(self._browsers) + self._pending_launches < self.size:
+                    if self._launch_failures >= self.size:
+                        raise RuntimeError(f"Could not launch a browser: {str(self._last_launch_error)}")
+                    # A browser was dropped after a crash; replace it outside the wait loop
+                    self._schedule_launch()
+                await self._condition.wait()
+
+        try:
+            context = await self._take_context(pooled)
+        except BaseException as e:
+            # Also on cancellation, or the slot stays taken for good
+            async with self._condition:
+                pooled.active -= 1
+                if not isinstance(e, asyncio.CancelledError):
+                    pooled.retiring = True
+                self._condition.notify_all()
+            await self._maybe_recycle(pooled)
+            raise
+        return BrowserLease(pooled, context)
+
+    async def release(self, lease: BrowserLease):
+        """Return a leased browser to the pool, closing the task's context."""
+        pooled = lease.pooled
+        try:
+            await lease.context.close()
+        except Exception as e:
+            logger.error(f"Failed to close pooled browser context: {str(e)}")
+            lease.failed = True
+
+        async with self._condition:
+            pooled.active -= 1
+            pooled.tasks_run += 1
+            if lease.failed or not pooled.is_healthy() or pooled.tasks_run >= self.max_tasks_per_browser:
+                pooled.retiring = True
+            self._condition.notify_all()
+        await self._maybe_recycle(pooled)
+
+    @asynccontextmanager
+    async def lease(self):
+        """Async context manager wrapper around acquire()/release()."""
+        lease = await self.acquire()
+        try:
+            yield lease
+        except Exception:
+            lease.failed = not lease.pooled.is_healthy()
+            raise
+        finally:
+            await self.release(lease)
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'browsers': len(self._browsers),
+            'active': sum(pooled.active for pooled in self._browsers),
+            'tasks_run': sum(pooled.tasks_run for pooled in self._browsers),
+        }
+
+    def _pick_browser(self) -> Optional[PooledBrowser]:
+        candidates = [
+            pooled for pooled in self._browsers
+            if not pooled.retiring and pooled.active < self.contexts_per_browser and pooled.is_healthy()
+        ]
+        if not candidates:
+            return None
+        # Prefer a browser with a warm context ready, then the least busy one
+        return min(candidates, key=lambda pooled: (pooled.spare_context is None, pooled.active))
+
+    async def _launch(self) -> PooledBrowser:
+        from browser_use import Browser, BrowserConfig
+
+        browser = Browser(config=BrowserConfig(headless=self.headless, disable_security=True))
+        await browser.get_playwright_browser()
+        pooled = PooledBrowser(browser)
+        self._launch_failures = 0
+        self._ensure_spare(pooled)
+        async with self._condition:
+            self._browsers.append(pooled)
+            self._condition.notify_all()
+        return pooled
+
+    def _schedule_launch(self) -> asyncio.Task:
+        """Launch a browser in the background, counted in `_pending_launches` before this returns.
+
+        Waiters re-check `len(self._browsers) + self._pending_launches` as soon as they
+        wake, so counting the launch only once it starts would let every waiter
+        schedule its own launch for the same free slot.
+        """
+        self._pending_launches += 1
+        return asyncio.create_task(self._launch_pending())
+
+    async def _launch_pending(self):
+        try:
+            await self._launch()
+        except Exception as e:
+            logger.error(f"Failed to launch pooled browser: {str(e)}")
+            self._launch_failures += 1
+            self._last_launch_error = e
+        finally:
+            self._pending_launches -= 1
+            async with self._condition:
+                self._condition.notify_all()
+
+    def _ensure_spare(self, pooled: PooledBrowser):
+        """Start preparing a spare context unless one is ready or still being prepared."""
+        if pooled.retiring or self._closed or pooled.spare_context is not None:
+            return
+        if pooled.spare_task is None or pooled.spare_task.done():
+            pooled.spare_task = asyncio.create_task(self._prepare_spare(pooled))
+
+    async def _prepare_spare(self, pooled: PooledBrowser):
+        """Create a context (and its first page) ahead of time so tasks skip that cost."""
+        context = self._new_context(pooled)
+        try:
+            await context.get_session()
+        except Exception as e:
+            logger.warning(f"Failed to pre-create browser context: {str(e)}")
+            return
+        if pooled.retiring or self._closed:
+            await context.close()
+            return
+        pooled.spare_context = context
+
+    def _new_context(self, pooled: PooledBrowser) -> 'BrowserContext':
+        from browser_use.browser.context import BrowserContext, BrowserContextConfig
+
+        return BrowserContext(browser=pooled.browser, config=(self.context_config_factory or BrowserContextConfig)())
+
+    async def _take_context(self, pooled: PooledBrowser) -> 'BrowserContext':
+        if pooled.spare_task and not pooled.spare_task.done():
+            # wait() rather than await: the spare task is cancelled when its browser closes, which must not cancel us
+            await asyncio.wait([pooled.spare_task])
+        context, pooled.spare_context = pooled.spare_context, None
+        if context is None:
+            context = self._new_context(pooled)
+            await context.get_session()
+        self._ensure_spare(pooled)
+        return context
+
+    async def _maybe_recycle(self, pooled: PooledBrowser):
+        async with self._condition:
+            if not pooled.retiring or pooled.active > 0 or pooled not in self._browsers:
+                return
+            self._browsers.remove(pooled)
+        logger.info(f"Recycling pooled browser after {pooled.tasks_run} tasks.")
+        await self._close_browser(pooled)
+        if not self._closed:
+            # Not awaited: the task handing the browser back shouldn't wait for a new Chromium to start
+            self._schedule_launch()
+
+    async def _close_browser(self, pooled: PooledBrowser):
+        if pooled.spare_task and not pooled.spare_task.done():
+            pooled.spare_task.cancel()
+        if pooled.spare_context:
+            try:
+                await pooled.spare_context.close()
+            except Exception as e:
+                logger.debug(f"Failed to close spare context: {str(e)}")
+            pooled.spare_context = None
+        await pooled.browser.close()
+
+    async def _health_loop(self):
+        """Periodically replace crashed browsers so the pool stays at full size."""
+        while not self._closed:
+            await asyncio.sleep(self.health_check_interval)
+            for pooled in list(self._browsers):
+                if not pooled.is_healthy():
+                    logger.warning("Pooled browser failed health check; recycling.")
+                    pooled.retiring = True
+                    await self._maybe_recycle(pooled)
+            missing = self.size - len(self._browsers) - self._pending_launches
+            for _ in range(max(missing, 0)):
+                self._schedule_launch()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Build the pool from the BROWSER_POOL_* settings."""
+    return BrowserPool(
+        size=int(os.getenv('BROWSER_POOL_SIZE', '2')),
+        max_tasks_per_browser=int(os.getenv('BROWSER_POOL_MAX_TASKS', '20')),
+        contexts_per_browser=int(os.getenv('BROWSER_POOL_CONTEXTS_PER_BROWSER', '4')),
+        health_check_interval=float(os.getenv('BROWSER_POOL_HEALTH_INTERVAL', '30')),
+    )
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\']+|\b(?:[a-z0-9-]+\.)+[a-z]{2,}(?:/[^\s<>"\']*)?', re.IGNORECASE)
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries also expire `ttl` seconds after being stored.
+
+    Safe to share between threads, like SQLiteCache, so callers can use either backend
+    from asyncio.to_thread.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk counterpart of TTLCache; values are stored as JSON and survive restarts."""
+
+    def __init__(self, path: str, max_entries: int = 1024, ttl: float = 3600.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE cache SET last_used = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._conn.execute('DELETE FROM cache WHERE expires_at < ?', (now,))
+            overflow = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)', (overflow,)
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def extract_urls(text: str) -> List[str]:
+    return [url.rstrip('.,;:!?)\'"') for url in URL_PATTERN.findall(text or '')]
+
+
+def normalize_task(task: str) -> str:
+    """Lower-case the task, collapse whitespace and drop trailing punctuation.
+
+    URLs are left out here; they are case-sensitive and are keyed separately.
+    """
+    text = URL_PATTERN.sub(' ', task or '')
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return text.rstrip('.!?;, ')
+
+
+class TaskResultCache:
+    """Opt-in cache of finished agent runs, keyed on the normalized task, start URL and run flags."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0, path: Optional[str] = None):
+        self.backend = SQLiteCache(path, max_entries, ttl) if path else TTLCache(max_entries, ttl)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @staticmethod
+    def make_key(task: str, headless: bool, use_vision: bool) -> str:
+        urls = extract_urls(task)
+        parts = {
+            'task': normalize_task(task),
+            'start_url': urls[0] if urls else None,
+            'urls': urls,
+            'headless': headless,
+            'vision': use_vision,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, task: str, headless: bool, use_vision: bool) -> Optional[Dict[str, Any]]:
+        result = self.backend.get(self.make_key(task, headless, use_vision))
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, task: str, headless: bool, use_vision: bool, final_result: str, urls: List[Optional[str]]):
+        self.backend.set(self.make_key(task, headless, use_vision), {
+            'final_result': final_result,
+            'urls': [url for url in urls if url],
+            'stored_at': time.time(),
+        })
+        self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.backend.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
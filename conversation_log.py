@@ -0,0 +1,253 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TASK_ID_SAFE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def format_record(step: int, timestamp: float, input_messages: list, model_output: Any) -> str:
+    """One step as text: the messages the model got, then its response (browser-use's conversation layout)."""
+    lines = [f"=== Step {step} @ {datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')} ==="]
+    for message in input_messages:
+        lines.append(f" {message.__class__.__name__} ")
+        content = message.content
+        if isinstance(content, list):
+            lines.extend(item['text'].strip() for item in content if isinstance(item, dict) and item.get('type') == 'text')
+        else:
+            lines.append(str(content).strip())
+        lines.append('')
+    lines.append(' RESPONSE')
+    try:
+        lines.append(json.dumps(json.loads(model_output.model_dump_json(exclude_unset=True)), indent=2))
+    except Exception:
+        lines.append(str(model_output))
+    return '\n'.join(lines) + '\n\n'
+
+
+class ConversationLog:
+    """Per-task agent conversation logs, gzip-compressed and written by a background thread.
+
+    record() only queues the step, so the agent's event loop never waits on
+    formatting, compression or disk. The writer buffers each task's steps and
+    appends them as complete gzip members every `flush_interval` seconds (and when
+    the task finishes), so a log can be read while its task is still running. A
+    task's log rolls over to a new part file past `part_bytes`; parts older than
+    `max_age` seconds, or the oldest ones beyond `max_total_bytes`, are pruned. An
+    SQLite index maps task IDs to their parts. If the queue is full, steps are
+    dropped and counted rather than blocking the agent.
+    """
+
+    def __init__(self, directory: str, max_total_bytes: int = 512 * 1024 * 1024, max_age: float = 14 * 86400.0,
+                 part_bytes: int = 8 * 1024 * 1024, flush_interval: float = 2.0, queue_size: int = 1000,
+                 compress_level: int = 6):
+        self.directory = directory
+        self.max_total_bytes = max_total_bytes
+        self.max_age = max_age
+        self.part_bytes = part_bytes
+        self.flush_interval = flush_interval
+        self.compress_level = compress_level
+        self.dropped = 0
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS parts ('
+            'task_id TEXT NOT NULL, part INTEGER NOT NULL, filename TEXT NOT NULL, steps INTEGER NOT NULL, '
+            'bytes INTEGER NOT NULL, started_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL, '
+            'PRIMARY KEY (task_id, part));'
+            'CREATE INDEX IF NOT EXISTS parts_updated ON parts (updated_at);'
+        )
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+        self._thread.start()
+
+    def record(self, task_id: str, step: int, input_messages: list, model_output: Any):
+        """Queue one step of a task's conversation (never blocks)."""
+        if not TASK_ID_SAFE.match(task_id or ''):
+            return
+        try:
+            self._queue.put_nowait(('record', task_id, step, time.time(), list(input_messages), model_output))
+        except queue.Full:
+            self.dropped += 1
+
+    def finish(self, task_id: str):
+        """Flush the task's buffered steps and mark its log finished."""
+        try:
+            self._queue.put_nowait(('finish', task_id))
+        except queue.Full:
+            pass  # Its buffer is still flushed on the next interval
+
+    def close(self, timeout: float = 10.0):
+        """Write out everything still queued and stop the writer."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        buffers: Dict[str, List[str]] = {}
+        steps: Dict[str, int] = {}
+        finished = set()
+        last_flush = last_prune = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            try:
+                if item is None:
+                    for task_id in list(buffers):
+                        self._flush(task_id, buffers.pop(task_id), steps.pop(task_id), finished=False)
+                    return
+                if item and item[0] == 'record':
+                    _, task_id, step, timestamp, input_messages, model_output = item
+                    buffers.setdefault(task_id, []).append(format_record(step, timestamp, input_messages, model_output))
+                    steps[task_id] = steps.get(task_id, 0) + 1
+                elif item:
+                    finished.add(item[1])
+                if finished or time.monotonic() - last_flush >= self.flush_interval:
+                    for task_id in set(buffers) | finished:
+                        self._flush(task_id, buffers.pop(task_id, []), steps.pop(task_id, 0), finished=task_id in finished)
+                    finished.clear()
+                    last_flush = time.monotonic()
+                if time.monotonic() - last_prune >= 300:
+                    self.prune()
+                    last_prune = time.monotonic()
+            except Exception as e:
+                logger.error(f"Conversation log writer failed: {str(e)}")
+
+    def _flush(self, task_id: str, chunks: List[str], step_count: int, finished: bool):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT part, filename, bytes FROM parts WHERE task_id = ? ORDER BY part DESC LIMIT 1', (task_id,)
+            ).fetchone()
+        if chunks:
+            data = gzip.compress(''.join(chunks).encode('utf-8'), compresslevel=self.compress_level)
+            if row is None or row['bytes'] + len(data) > self.part_bytes and row['bytes'] > 0:
+                part = row['part'] + 1 if row else 0
+                filename = f"{task_id}.{part}.log.gz"
+                with self._lock:
+                    self._conn.execute(
+                        'INSERT INTO parts (task_id, part, filename, steps, bytes, started_at, updated_at) VALUES (?, ?, ?, 0, 0, ?, ?)',
+                        (task_id, part, filename, now, now),
+                    )
+            else:
+                part, filename = row['part'], row['filename']
+            # Each flush is a complete gzip member; concatenated members are still one valid gzip file
+            with open(os.path.join(self.directory, filename), 'ab') as f:
+                f.write(data)
+            with self._lock:
+                self._conn.execute(
+                    'UPDATE parts SET steps = steps + ?, bytes = bytes + ?, updated_at = ? WHERE task_id = ? AND part = ?',
+                    (step_count, len(data), now, task_id, part),
+                )
+            self.written += step_count
+        if finished:
+            with self._lock:
+                self._conn.execute('UPDATE parts SET finished_at = ? WHERE task_id = ?', (now, task_id))
+
+    def prune(self) -> int:
+        """Delete parts past `max_age`, then the oldest until the logs fit in `max_total_bytes`."""
+        with self._lock:
+            rows = self._conn.execute('SELECT task_id, part, filename, bytes, updated_at FROM parts ORDER BY updated_at').fetchall()
+        total = sum(row['bytes'] for row in rows)
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for row in rows:
+            if row['updated_at'] >= cutoff and total <= self.max_total_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, row['filename']))
+            except FileNotFoundError:
+                pass  # Another process pruned it first
+            with self._lock:
+                self._conn.execute('DELETE FROM parts WHERE task_id = ? AND part = ?', (row['task_id'], row['part']))
+            total -= row['bytes']
+            removed += 1
+        return removed
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Index entry of a task: its parts, step count and size on disk."""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM parts WHERE task_id = ? ORDER BY part', (task_id,)).fetchall()
+        if not rows:
+            return None
+        return {
+            'task_id': task_id,
+            'steps': sum(row['steps'] for row in rows),
+            'bytes': sum(row['bytes'] for row in rows),
+            'started_at': rows[0]['started_at'],
+            'updated_at': rows[-1]['updated_at'],
+            'finished_at': rows[-1]['finished_at'],
+            'parts': [row['filename'] for row in rows],
+        }
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT task_id, SUM(steps) AS steps, SUM(bytes) AS bytes, MIN(started_at) AS started_at, '
+                'MAX(updated_at) AS updated_at, MAX(finished_at) AS finished_at FROM parts '
+                'GROUP BY task_id ORDER BY updated_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def read(self, task_id: str) -> Optional[str]:
+        """The task's whole conversation, decompressed; None if it has no log.
+
+        Each flush is one gzip member, decoded one at a time: a member the writer is
+        still appending is left out and everything before it is returned.
+        """
+        entry = self.get(task_id)
+        if entry is None:
+            return None
+        texts = []
+        for filename in entry['parts']:
+            try:
+                with open(os.path.join(self.directory, filename), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            while data:
+                member = zlib.decompressobj(wbits=31)  # 31: gzip header and trailer
+                try:
+                    text = member.decompress(data)
+                except zlib.error as e:
+                    logger.warning(f"Log part {filename} is corrupt past this point: {str(e)}")
+                    break
+                if not member.eof:
+                    break  # Still being written
+                texts.append(text.decode('utf-8', errors='replace'))
+                data = member.unused_data
+        return ''.join(texts)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute('SELECT COUNT(DISTINCT task_id) AS tasks, COALESCE(SUM(bytes), 0) AS bytes FROM parts').fetchone()
+        return {'tasks': row['tasks'], 'bytes': row['bytes'], 'steps_written': self.written,
+                'steps_dropped': self.dropped, 'queued': self._queue.qsize()}
+
+
+def get_conversation_log(default_directory: str) -> Optional[ConversationLog]:
+    """Build the log from CONVERSATION_LOG* settings; CONVERSATION_LOG=off disables it."""
+    if os.getenv('CONVERSATION_LOG', 'on').lower() == 'off':
+        return None
+    return ConversationLog(
+        directory=os.getenv('CONVERSATION_LOG_DIR') or default_directory,
+        max_total_bytes=int(float(os.getenv('CONVERSATION_LOG_MAX_MB', '512')) * 1024 * 1024),
+        max_age=float(os.getenv('CONVERSATION_LOG_MAX_AGE_DAYS', '14')) * 86400,
+        part_bytes=int(float(os.getenv('CONVERSATION_LOG_PART_MB', '8')) * 1024 * 1024),
+    )
@@ -0,0 +1,164 @@
+import difflib
+import logging
+import re
+from typing import List, Optional
+
+from browser_use.agent.message_manager.service import MessageManager
+from browser_use.agent.prompts import AgentMessagePrompt
+from langchain_core.messages import HumanMessage
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DOM_TOKENS_TOTAL = metrics.registry.counter(
+    'siteguide_dom_state_tokens_total', 'Page-state prompt tokens: what full snapshots would cost vs what was sent.', ['kind'])
+
+# The element listing inside browser-use's state message, up to the step/date footer
+ELEMENTS_SECTION = re.compile(
+    r'(Interactive elements from top layer of the current page inside the viewport:\n)(.*?)(\n(?:Current step: |Current date and time: ))',
+    re.DOTALL,
+)
+
+
+def diff_elements(before: List[str], after: List[str]) -> Optional[dict]:
+    """Removed/added element lines between two listings; None when they are identical."""
+    removed, added = [], []
+    for op, i1, i2, j1, j2 in difflib.SequenceMatcher(None, before, after, autojunk=False).get_opcodes():
+        if op in ('replace', 'delete'):
+            removed.extend(before[i1:i2])
+        if op in ('replace', 'insert'):
+            added.extend(after[j1:j2])
+    if not removed and not added:
+        return None
+    return {'removed': removed, 'added': added}
+
+
+class DomDiffMessageManager(MessageManager):
+    """Sends the interactive-element list once per page and only its changes after that.
+
+    browser-use drops each step's state message once the model has answered, so a
+    diff alone would refer to something the model no longer sees. Instead the full
+    listing is kept in the history as a snapshot message, and each step's state
+    message carries the changes relative to it (plus URL, tabs, scroll position and
+    action results, as before). The snapshot is part of the unchanged prompt prefix,
+    so what is new per step - and what prefix-caching providers bill at full price -
+    is only the diff. A new snapshot replaces the old one when the URL changes or when
+    the diff would be more than `max_diff_ratio` of the full listing.
+    """
+
+    def __init__(self, *args, max_diff_ratio: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_diff_ratio = max_diff_ratio
+        self._snapshot_message: Optional[HumanMessage] = None
+        self._snapshot_url: Optional[str] = None
+        self._snapshot_lines: List[str] = []
+        self.steps = 0
+        self.full_snapshots = 0
+        self.tokens_full = 0
+        self.tokens_sent = 0
+
+    def add_state_message(self, state, result=None, step_info=None, use_vision=True) -> None:
+        # Results kept in memory go to the history first, exactly as the base class does
+        if result:
+            for r in result:
+                if r.include_in_memory:
+                    if r.extracted_content:
+                        self._add_message_with_tokens(HumanMessage(content='Action result: ' + str(r.extracted_content)))
+                    if r.error:
+                        self._add_message_with_tokens(HumanMessage(content='Action error: ' + r.error.rstrip('\n').split('\n')[-1]))
+                    result = None
+
+        full_message = AgentMessagePrompt(
+            state, result, include_attributes=self.settings.include_attributes, step_info=step_info,
+        ).get_user_message(use_vision)
+        elements = state.element_tree.clickable_elements_to_string(include_attributes=self.settings.include_attributes)
+        lines = elements.split('\n') if elements else []
+
+        changes = diff_elements(self._snapshot_lines, lines) if self._snapshot_message is not None else None
+        needs_snapshot = (
+            self._snapshot_message is None
+            or state.url != self._snapshot_url
+            or (changes and len(changes['removed']) + len(changes['added']) > self.max_diff_ratio * max(len(lines), 1))
+        )
+        if needs_snapshot:
+            self._replace_snapshot(state.url, lines, elements)
+            summary = f'Unchanged: all {len(lines)} elements are as listed in the page snapshot above.'
+            snapshot_tokens = self.state.history.messages[-1].metadata.tokens
+        else:
+            summary = self._describe_changes(changes, len(lines))
+            snapshot_tokens = 0
+
+        step_message = self._with_elements(full_message, summary)
+        self._add_message_with_tokens(step_message)
+        self._account(full_message, snapshot_tokens + self.state.history.messages[-1].metadata.tokens, needs_snapshot)
+
+    def _replace_snapshot(self, url: str, lines: List[str], elements: str):
+        if self._snapshot_message is not None:
+            for index, managed in enumerate(self.state.history.messages):
+                if managed.message is self._snapshot_message:
+                    self.state.history.current_tokens -= managed.metadata.tokens
+                    self.state.history.messages.pop(index)
+                    break
+        self._add_message_with_tokens(HumanMessage(content=(
+            f'[Page snapshot] Interactive elements of {url}. Later state messages only list what changed '
+            f'compared to this snapshot; elements they do not mention are unchanged and keep their index:\n'
+            f'{elements or "empty page"}'
+        )))
+        self._snapshot_message = self.state.history.messages[-1].message
+        self._snapshot_url = url
+        self._snapshot_lines = lines
+        self.full_snapshots += 1
+
+    @staticmethod
+    def _describe_changes(changes: Optional[dict], count: int) -> str:
+        if not changes:
+            return f'Unchanged since the page snapshot above ({count} elements).'
+        parts = [f"Changes since the page snapshot above ({count} elements now; "
+                 f"{len(changes['removed'])} gone, {len(changes['added'])} new or changed; all others unchanged):"]
+        if changes['removed']:
+            parts.append('Gone:\n' + '\n'.join(changes['removed']))
+        if changes['added']:
+            parts.append('New or changed:\n' + '\n'.join(changes['added']))
+        return '\n'.join(parts)
+
+    @staticmethod
+    def _with_elements(message: HumanMessage, summary: str) -> HumanMessage:
+        """Swap the element listing in a state message for `summary`, keeping the scroll markers."""
+        def replace(text: str) -> str:
+            def section(match):
+                body = match.group(2)
+                head = body.split('\n', 1)[0] if body.startswith(('[Start of page]', '...')) else ''
+                tail = body.rsplit('\n', 1)[-1] if body.endswith(('[End of page]', '...')) else ''
+                return match.group(1) + '\n'.join(part for part in (head, summary, tail) if part) + match.group(3)
+            return ELEMENTS_SECTION.sub(section, text, count=1)
+
+        if isinstance(message.content, list):
+            return HumanMessage(content=[
+                dict(part, text=replace(part['text'])) if isinstance(part, dict) and part.get('type') == 'text' else part
+                for part in message.content
+            ])
+        return HumanMessage(content=replace(message.content))
+
+    def _account(self, full_message: HumanMessage, sent_tokens: int, snapshot: bool):
+        full_tokens = self._count_tokens(full_message)
+        self.steps += 1
+        self.tokens_full += full_tokens
+        self.tokens_sent += sent_tokens
+        DOM_TOKENS_TOTAL.inc(full_tokens, kind='full')
+        DOM_TOKENS_TOTAL.inc(sent_tokens, kind='sent')
+        timeline = metrics.current_timeline.get()
+        if timeline is not None:
+            timeline.add('dom_state', 0.0, mode='snapshot' if snapshot else 'diff',
+                         tokens_full=full_tokens, tokens_sent=sent_tokens, tokens_saved=full_tokens - sent_tokens)
+        logger.info(f"Page state: {'snapshot' if snapshot else 'diff'}, {sent_tokens} of {full_tokens} tokens sent "
+                    f"({self.tokens_full - self.tokens_sent} saved so far)")
+
+    def stats(self) -> dict:
+        return {
+            'steps': self.steps,
+            'full_snapshots': self.full_snapshots,
+            'tokens_full': self.tokens_full,
+            'tokens_sent': self.tokens_sent,
+            'tokens_saved': self.tokens_full - self.tokens_sent,
+        }
@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Job states; the last three are final
+QUEUED = 'queued'
+RUNNING = 'running'
+CANCELLING = 'cancelling'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Grace on top of a job's timeout before a silent worker is presumed dead
+LEASE_GRACE_SECONDS = 60.0
+
+
+class JobStore:
+    """Durable agent job queue in SQLite, shared by the web process and the workers.
+
+    Jobs are claimed highest priority first (then oldest), under a write lock so two
+    workers never take the same job. A claim is a lease that runs out `timeout` plus
+    a grace period later; jobs whose worker died are put back by requeue_expired().
+    Failed attempts are retried with exponential backoff up to `max_attempts`.
+    Progress messages go to a separate events table that readers page through by ID.
+    """
+
+    def __init__(self, path: str, retry_delay: float = 5.0):
+        self.path = path
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, task TEXT NOT NULL, params TEXT NOT NULL, priority INTEGER NOT NULL, '
+            'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, '
+            'timeout REAL NOT NULL, result TEXT, error TEXT, worker_id TEXT, created_at REAL NOT NULL, '
+            'available_at REAL NOT NULL, started_at REAL, finished_at REAL, lease_expires_at REAL);'
+            'CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, created_at);'
+            'CREATE TABLE IF NOT EXISTS job_events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, message TEXT NOT NULL, created_at REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);'
+        )
+
+    def enqueue(self, task: str, params: Optional[Dict[str, Any]] = None, priority: int = 0,
+                max_attempts: int = 3, timeout: float = 600.0) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, task, params, priority, status, max_attempts, timeout, created_at, available_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, task, json.dumps(params or {}), priority, QUEUED, max(1, max_attempts), timeout, now, now),
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Take the next runnable job for `worker_id`, or None if there is nothing to do."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT * FROM jobs WHERE status = ? AND available_at <= ? ORDER BY priority DESC, created_at LIMIT 1',
+                    (QUEUED, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute('COMMIT')
+                    return None
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?, started_at = ?, '
+                    'lease_expires_at = ? WHERE id = ?',
+                    (RUNNING, worker_id, now, now + row['timeout'] + LEASE_GRACE_SECONDS, row['id']),
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        job = self._to_dict(row)
+        job.update(status=RUNNING, attempts=job['attempts'] + 1, worker_id=worker_id, started_at=now)
+        return job
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        self._finish(job_id, SUCCEEDED, result=result)
+
+    def fail(self, job_id: str, error: str, retry: bool = True) -> str:
+        """Record a failed attempt; requeues it with backoff if attempts remain. Returns the new status."""
+        with self._lock:
+            row = self._conn.execute('SELECT status, attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return FAILED
+        if row['status'] == CANCELLING:
+            self._finish(job_id, CANCELLED, error=error)
+            return CANCELLED
+        if retry and row['attempts'] < row['max_attempts']:
+            delay = self.retry_delay * (2 ** (row['attempts'] - 1))
+            with self._lock:
+                self._conn.execute(
+                    'UPDATE jobs SET status = ?, error = ?, worker_id = NULL, lease_expires_at = NULL, available_at = ? '
+                    'WHERE id = ?',
+                    (QUEUED, error, time.time() + delay, job_id),
+                )
+            return QUEUED
+        self._finish(job_id, FAILED, error=error)
+        return FAILED
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a queued job at once; a running one is flagged for its worker to stop."""
+        with self._lock:
+            row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['status'] == QUEUED:
+                self._conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?', (CANCELLED, time.time(), job_id))
+                return CANCELLED
+            if row['status'] == RUNNING:
+                self._conn.execute('UPDATE jobs SET status = ? WHERE id = ?', (CANCELLING, job_id))
+                return CANCELLING
+            return row['status']
+
+    def requeue_expired(self) -> int:
+        """Put back (or fail) running jobs whose worker died before finishing them."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id FROM jobs WHERE status IN (?, ?) AND lease_expires_at < ?', (RUNNING, CANCELLING, now)
+            ).fetchall()
+        for row in rows:
+            logger.warning(f"Job {row['id']} outlived its lease; its worker is presumed dead.")
+            self.fail(row['id'], 'Worker stopped responding')
+        return len(rows)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def status(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row['status'] if row else None
+
+    def add_event(self, job_id: str, message: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO job_events (job_id, message, created_at) VALUES (?, ?, ?)', (job_id, message, time.time())
+            )
+            return cursor.lastrowid
+
+    def events_after(self, job_id: str, after: int = 0, limit: int = 100) -> List[Tuple[int, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, message FROM job_events WHERE job_id = ? AND id > ? ORDER BY id LIMIT ?', (job_id, after, limit)
+            ).fetchall()
+        return [(row['id'], row['message']) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def _finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = COALESCE(?, error), finished_at = ?, lease_expires_at = NULL '
+                'WHERE id = ?',
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job.pop('lease_expires_at', None)
+        return job
+
+
+def get_job_store(default_path: Optional[str] = None) -> JobStore:
+    """Open the store at JOBS_DB_PATH (jobs.db next to the code by default)."""
+    path = os.getenv('JOBS_DB_PATH') or default_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db')
+    return JobStore(path, retry_delay=float(os.getenv('JOB_RETRY_DELAY', '5')))
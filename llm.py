@@ -0,0 +1,291 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr, SecretStr
+
+import metrics
+from caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCallStats:
+    """Token and latency counters for every call that goes through MemoizingLLM."""
+
+    def __init__(self, keep_last: int = 200):
+        self.calls = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.total_latency = 0.0
+        self.recent = deque(maxlen=keep_last)
+
+    def record(self, latency: float, usage: Optional[dict], cached: bool):
+        self.calls += 1
+        input_tokens = (usage or {}).get('input_tokens', 0)
+        output_tokens = (usage or {}).get('output_tokens', 0)
+        metrics.LLM_CALLS_TOTAL.inc(cached='true' if cached else 'false')
+        if cached:
+            self.cache_hits += 1
+        else:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.total_latency += latency
+            metrics.LLM_TOKENS_TOTAL.inc(input_tokens, direction='input')
+            metrics.LLM_TOKENS_TOTAL.inc(output_tokens, direction='output')
+            metrics.observe('llm', latency, input_tokens=input_tokens, output_tokens=output_tokens)
+        self.recent.append({
+            'latency': round(latency, 4),
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'cached': cached,
+        })
+
+    def summary(self) -> Dict[str, Any]:
+        misses = self.calls - self.cache_hits
+        return {
+            'calls': self.calls,
+            'cache_hits': self.cache_hits,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'avg_latency': round(self.total_latency / misses, 4) if misses else 0.0,
+        }
+
+
+class MemoizingLLM(BaseChatModel):
+    """Wraps a LangChain chat model with request memoization and per-call accounting.
+
+    Identical requests (same messages, same structured-output schema) are answered
+    from a local TTL/LRU cache; this covers retried steps and repeated DOM snapshots
+    of an unchanged page. The memoization is purely local: a miss sends the whole
+    prompt to the provider and pays for all of its input tokens. Building the cache
+    key hashes the large, static system prompt only once per process, not once per
+    step. It is itself a BaseChatModel so browser-use accepts it anywhere a model goes.
+    """
+
+    llm: Any
+    cache: Any = None
+    stats: Any = None
+    _system_prompt_digests: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, llm, cache_size: int = 256, ttl: float = 600.0):
+        super().__init__(llm=llm, cache=TTLCache(max_entries=cache_size, ttl=ttl), stats=LLMCallStats())
+
+    @property
+    def model_name(self) -> str:
+        # browser-use reads the model name to pick its tool-calling mode
+        return getattr(self.llm, 'model_name', None) or getattr(self.llm, 'model', 'unknown')
+
+    @property
+    def _llm_type(self) -> str:
+        return f"memoizing-{getattr(self.llm, '_llm_type', 'chat')}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def request_key(self, messages, tag: str = '') -> str:
+        if isinstance(messages, str):
+            messages = [messages]
+        digest = hashlib.sha256(tag.encode('utf-8'))
+        for message in messages:
+            digest.update(b'\x00')
+            if isinstance(message, SystemMessage) and isinstance(message.content, str):
+                digest.update(self._system_prompt_digest(message.content).encode('ascii'))
+            elif isinstance(message, BaseMessage):
+                content = message.content if isinstance(message.content, str) else json.dumps(message.content, sort_keys=True)
+                digest.update(f"{message.type}:{content}".encode('utf-8'))
+                if isinstance(message, AIMessage) and message.tool_calls:
+                    digest.update(json.dumps(message.tool_calls, sort_keys=True, default=str).encode('utf-8'))
+            else:
+                digest.update(str(message).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _system_prompt_digest(self, content: str) -> str:
+        # Part of the local cache key only. str hashes are cached on the object, so this lookup is O(1) for the reused prompt
+        digest = self._system_prompt_digests.get(content)
+        if digest is None:
+            digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            if len(self._system_prompt_digests) > 32:
+                self._system_prompt_digests.clear()
+            self._system_prompt_digests[content] = digest
+        return digest
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        return await self._acall(self.llm, messages, config, kwargs, tag='chat')
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self._call(self.llm, messages, config, kwargs, tag='chat')
+
+    def with_structured_output(self, schema, **kwargs):
+        tag = f"structured:{getattr(schema, '__name__', schema)}:{json.dumps(kwargs, sort_keys=True, default=str)}"
+        if hasattr(schema, 'model_json_schema'):
+            # Dynamic AgentOutput models share a name; the action schema tells them apart
+            tag += hashlib.sha256(json.dumps(schema.model_json_schema(), sort_keys=True).encode('utf-8')).hexdigest()
+        return MemoizedRunnable(self, self.llm.with_structured_output(schema, **kwargs), tag)
+
+    async def _acall(self, runnable, messages, config, kwargs, tag: str):
+        key = self.request_key(messages, tag) if not kwargs else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.stats.record(0.0, _usage_of(cached), cached=True)
+                return copy.deepcopy(cached)
+        start = time.perf_counter()
+        result = await runnable.ainvoke(messages, config, **kwargs)
+        self.stats.record(time.perf_counter() - start, _usage_of(result), cached=False)
+        if key and _is_cacheable(result):
+            self.cache.set(key, copy.deepcopy(result))
+        return result
+
+    def _call(self, runnable, messages, config, kwargs, tag: str):
+        key = self.request_key(messages, tag) if not kwargs else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.stats.record(0.0, _usage_of(cached), cached=True)
+                return copy.deepcopy(cached)
+        start = time.perf_counter()
+        result = runnable.invoke(messages, config, **kwargs)
+        self.stats.record(time.perf_counter() - start, _usage_of(result), cached=False)
+        if key and _is_cacheable(result):
+            self.cache.set(key, copy.deepcopy(result))
+        return result
+
+
+class MemoizedRunnable:
+    """Structured-output runnable routed through its MemoizingLLM's cache and stats."""
+
+    def __init__(self, owner: MemoizingLLM, runnable, tag: str):
+        self.owner = owner
+        self.runnable = runnable
+        self.tag = tag
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        return await self.owner._acall(self.runnable, messages, config, kwargs, self.tag)
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self.owner._call(self.runnable, messages, config, kwargs, self.tag)
+
+
+def _usage_of(result) -> Optional[dict]:
+    if isinstance(result, dict):
+        result = result.get('raw')
+    return getattr(result, 'usage_metadata', None)
+
+
+def _is_cacheable(result) -> bool:
+    # Never pin a failed parse; the next attempt should get a fresh answer
+    if isinstance(result, dict):
+        return result.get('parsed') is not None and not result.get('parsing_error')
+    return True
+
+
+class ScriptedLLM(BaseChatModel):
+    """Deterministic stand-in for the chat model, for offline tests and benchmarks.
+
+    `steps` are AgentOutput-shaped dicts returned one per agent step, e.g.
+    {'current_state': {...}, 'action': [{'go_to_url': {'url': '...'}}]}. A `responder`
+    callable (messages, step_index) -> dict can be given instead to react to the page.
+    When the script runs out the model answers with a `done` action.
+    """
+
+    model_name: str = 'scripted'
+    steps: List[dict] = []
+    responder: Optional[Callable[[list, int], dict]] = None
+    delay: float = 0.0
+    extraction_text: str = 'scripted extraction'
+    _step_index: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted'
+
+    @property
+    def step_index(self) -> int:
+        return self._step_index
+
+    def next_output(self, messages) -> dict:
+        index = self._step_index
+        self._step_index += 1
+        if self.responder:
+            return self.responder(messages, index)
+        if index < len(self.steps):
+            return self.steps[index]
+        return {
+            'current_state': {'evaluation_previous_goal': 'Success', 'memory': '', 'next_goal': 'Finish'},
+            'action': [{'done': {'text': 'Scripted run finished.', 'success': True}}],
+        }
+
+    def with_structured_output(self, schema, include_raw: bool = False, **kwargs):
+        return ScriptedStructuredRunnable(self, schema, include_raw)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Plain (unstructured) calls, e.g. the extract_content action
+        if self.delay:
+            time.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.extraction_text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.extraction_text))])
+
+
+class ScriptedStructuredRunnable:
+    def __init__(self, llm: ScriptedLLM, schema, include_raw: bool):
+        self.llm = llm
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def _respond(self, messages):
+        output = self.llm.next_output(messages)
+        parsed = self.schema.model_validate(output)
+        raw = AIMessage(content=json.dumps(output), usage_metadata={
+            'input_tokens': sum(len(str(getattr(m, 'content', m))) for m in messages) // 4,
+            'output_tokens': len(json.dumps(output)) // 4,
+            'total_tokens': 0,
+        })
+        if self.include_raw:
+            return {'raw': raw, 'parsed': parsed, 'parsing_error': None}
+        return parsed
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        if self.llm.delay:
+            await asyncio.sleep(self.llm.delay)
+        return self._respond(messages)
+
+    def invoke(self, messages, config=None, **kwargs):
+        if self.llm.delay:
+            time.sleep(self.llm.delay)
+        return self._respond(messages)
+
+
+def get_llm():
+    """Build the agent's chat model, wrapped for memoization and accounting.
+
+    LLM_BACKEND=scripted swaps Gemini for ScriptedLLM so the agent loop can run offline.
+    """
+    if os.getenv('LLM_BACKEND', 'gemini').lower() == 'scripted':
+        base = ScriptedLLM(delay=float(os.getenv('SCRIPTED_LLM_DELAY', '0')))
+    else:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError('GEMINI_API_KEY is not set.')
+        base = ChatGoogleGenerativeAI(model='gemini-2.0-flash-exp', api_key=SecretStr(api_key))
+    return MemoizingLLM(
+        base,
+        cache_size=int(os.getenv('LLM_CACHE_SIZE', '256')),
+        ttl=float(os.getenv('LLM_CACHE_TTL', '600')),
+    )
@@ -0,0 +1,215 @@
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+# Words that mark a form, heading or button as part of signing in
+LOGIN_CONTEXT = re.compile(r'\b(log ?in|log ?on|sign[ -]?in|signin|authenticat\w*|verif\w*|two[- ]factor|2fa|one[- ]time)\b', re.IGNORECASE)
+# Forms that collect an email or phone for something other than an account
+NON_LOGIN_CONTEXT = re.compile(r'\b(subscribe|newsletter|search|comment|contact|feedback|call ?back|shipping|billing|checkout)\b', re.IGNORECASE)
+IDENTITY_FIELD = re.compile(r'user|e-?mail|login|account|phone|mobile', re.IGNORECASE)
+OTP_FIELD = re.compile(r'otp|one[-_ ]?time|verification|passcode|security[-_ ]?code|2fa|totp|mfa', re.IGNORECASE)
+SEARCH_FIELD = re.compile(r'^(q|query|search|s|keywords?)$|search', re.IGNORECASE)
+# Changing or resetting a password asks for passwords too, but the user is already past the login
+PASSWORD_CHANGE = re.compile(r'\b(change|update|reset|new|current|old)[ _-]?(your )?pass(word)?\b', re.IGNORECASE)
+
+# Attributes the rules look at, the same ones the agent's system prompt used to list
+FIELD_ATTRIBUTES = ('name', 'id', 'placeholder', 'aria-label', 'title', 'autocomplete')
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+HIDDEN_STYLE = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+# Static HTML carries no stylesheet results; these utility classes are the common way pages hide a modal
+HIDDEN_CLASS = re.compile(r'(^|\s)(hidden|d-none|is-hidden|invisible|hide)(\s|$)', re.IGNORECASE)
+
+# Run in a live page with page.evaluate(): builds the same per-form groups as _FormCollector,
+# but visibility comes from the browser, so stylesheets, classes and collapsed parents count.
+# Only these groups cross over, not the page's HTML, and null comes back when no input is
+# visible at all, which is most pages.
+RENDERED_FORMS_SCRIPT = """() => {
+  const shown = (el) => {
+    if (el.closest('[aria-hidden="true"], [hidden]')) return false;
+    if (el.checkVisibility) {
+      return el.checkVisibility({opacityProperty: true, visibilityProperty: true, checkOpacity: true, checkVisibilityCSS: true});
+    }
+    return getComputedStyle(el).visibility !== 'hidden' && el.getClientRects().length > 0;
+  };
+  const inputs = Array.from(document.querySelectorAll('input')).filter(shown);
+  if (!inputs.length) return null;
+  const groups = new Map();
+  const group = (el) => {
+    const form = el.closest('form');
+    if (!groups.has(form)) {
+      const context = form ? ['action', 'id', 'name', 'class', 'aria-label'].map((name) => form.getAttribute(name) || '').join(' ') : '';
+      groups.set(form, {fields: [], buttons: [], context: context.trim() ? [context] : []});
+    }
+    return groups.get(form);
+  };
+  const text = (el) => (el.innerText || el.textContent || '').trim();
+  for (const el of inputs) {
+    const type = (el.getAttribute('type') || 'text').toLowerCase();
+    if (['submit', 'button', 'image'].includes(type)) {
+      group(el).buttons.push(el.getAttribute('value') || el.getAttribute('aria-label') || '');
+    } else if (!['hidden', 'checkbox', 'radio', 'file', 'reset', 'range', 'color'].includes(type)) {
+      group(el).fields.push({...Object.fromEntries(Array.from(el.attributes, (attr) => [attr.name, attr.value])), type});
+    }
+  }
+  for (const el of Array.from(document.querySelectorAll('button, a[role="button"]')).filter(shown)) {
+    group(el).buttons.push(el.getAttribute('aria-label') || '', text(el));
+  }
+  for (const el of Array.from(document.querySelectorAll('h2, h3, legend, label')).filter(shown)) {
+    group(el).context.push(text(el));
+  }
+  const pageContext = [document.title].concat(Array.from(document.querySelectorAll('h1')).filter(shown).map(text));
+  return {forms: Array.from(groups.values()), page_context: pageContext};
+}"""
+
+# Score at which a form counts as a login form; a password or one-time-code field alone reaches it
+LOGIN_THRESHOLD = 2
+
+
+class _FormCollector(HTMLParser):
+    """Collects visible inputs, button texts and context text per form (inputs outside forms share one group)."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[tuple] = []  # (tag, hidden)
+        self.page_form = self._new_form('')
+        self.forms: List[dict] = [self.page_form]
+        self.form: Optional[dict] = None
+        self.page_context: List[str] = []
+        self._text_target: Optional[list] = None
+        self._text_tag: Optional[str] = None
+
+    @staticmethod
+    def _new_form(context: str) -> dict:
+        return {'fields': [], 'buttons': [], 'context': [context] if context else []}
+
+    def _hidden(self) -> bool:
+        return any(hidden for _, hidden in self.stack)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or '' for name, value in attrs}
+        hidden = ('hidden' in attrs or bool(HIDDEN_STYLE.search(attrs.get('style', ''))) or bool(HIDDEN_CLASS.search(attrs.get('class', '')))
+                  or attrs.get('aria-hidden') == 'true' or tag == 'template')
+        if tag not in VOID_ELEMENTS:
+            self.stack.append((tag, hidden))
+        hidden = hidden or self._hidden()
+        current = self.form or self.page_form
+
+        if tag == 'form':
+            self.form = self._new_form(' '.join(attrs.get(name, '') for name in ('action', 'id', 'name', 'class', 'aria-label')))
+            self.forms.append(self.form)
+        elif tag == 'input' and not hidden:
+            field_type = attrs.get('type', 'text').lower()
+            if field_type in ('submit', 'button', 'image'):
+                current['buttons'].append(attrs.get('value', '') or attrs.get('aria-label', ''))
+            elif field_type not in ('hidden', 'checkbox', 'radio', 'file', 'reset', 'range', 'color'):
+                current['fields'].append(dict(attrs, type=field_type))
+        elif tag in ('button', 'a') and not hidden and (tag == 'button' or attrs.get('role') == 'button'):
+            current['buttons'].append(attrs.get('aria-label', ''))
+            self._capture(current['buttons'], tag)
+        elif tag in ('title', 'h1', 'h2', 'h3', 'legend', 'label') and not hidden:
+            self._capture(self.page_context if tag in ('title', 'h1') else current['context'], tag)
+
+    def _capture(self, target: list, tag: str):
+        target.append('')
+        self._text_target, self._text_tag = target, tag
+
+    def handle_endtag(self, tag):
+        if tag == self._text_tag:
+            self._text_target = self._text_tag = None
+        if tag == 'form':
+            self.form = None
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self._text_target is not None:
+            self._text_target[-1] += data
+
+
+def _field_text(field: Dict[str, str]) -> str:
+    return ' '.join(field.get(name, '') for name in FIELD_ATTRIBUTES)
+
+
+def _score_form(form: dict, page_context: str) -> dict:
+    fields = form['fields']
+    text_fields = [field for field in fields if not SEARCH_FIELD.search(field.get('name', '') + ' ' + field.get('id', ''))
+                   and field['type'] != 'search']
+    passwords = [field for field in text_fields if field['type'] == 'password']
+    otp = [field for field in text_fields
+           if field.get('autocomplete') == 'one-time-code' or OTP_FIELD.search(_field_text(field))
+           or 'code' in (field.get('name', '').lower(), field.get('id', '').lower())]
+    digit_boxes = [field for field in text_fields if field.get('maxlength') == '1']
+    identity = [field for field in text_fields if field['type'] in ('email', 'tel')
+                or field.get('autocomplete') in ('username', 'email', 'tel')
+                or IDENTITY_FIELD.search(_field_text(field))]
+
+    buttons = ' '.join(form['buttons'])
+    context = ' '.join(form['context'])
+    score, reasons = 0, []
+    if passwords and len(passwords) >= 2 and not identity and PASSWORD_CHANGE.search(
+            ' '.join([buttons, context] + [_field_text(field) for field in passwords])):
+        reasons.append('looks like a password change form')
+    elif passwords:
+        score += 3
+        reasons.append('password field')
+    if otp or len(digit_boxes) >= 4:
+        score += 3
+        reasons.append('one-time code field')
+    if identity:
+        score += 1
+        reasons.append(f"{identity[0]['type']} field")
+        if LOGIN_CONTEXT.search(buttons):
+            score += 1
+            reasons.append('sign-in button')
+        if LOGIN_CONTEXT.search(context) or LOGIN_CONTEXT.search(page_context):
+            score += 1
+            reasons.append('sign-in heading or form')
+        if not passwords and not otp and NON_LOGIN_CONTEXT.search(f"{buttons} {context} {page_context}"):
+            score -= 2
+            reasons.append('looks like a search/newsletter/contact form')
+    return {'score': score, 'reasons': reasons, 'fields': [field.get('name') or field.get('id') or field['type'] for field in text_fields]}
+
+
+def detect_login_form(html: str) -> Optional[dict]:
+    """Find a form on the page that asks for login credentials or a one-time code.
+
+    Deterministic rules over the page HTML: a visible password or one-time-code field
+    is enough on its own, unless the form changes a password; an email/username/phone
+    field needs a sign-in button or a sign-in heading next to it, and loses out on
+    newsletter, search, contact and checkout forms. Returns the best-scoring form's
+    score, reason and field names, or None when nothing reaches LOGIN_THRESHOLD.
+
+    Visibility is judged from inline attributes and common hiding classes only; for a
+    live page use RENDERED_FORMS_SCRIPT with detect_rendered_login_form().
+    """
+    collector = _FormCollector()
+    try:
+        collector.feed(html)
+        collector.close()
+    except Exception:
+        return None  # Unparseable markup; leave the decision to the LLM
+    return _best_login_form(collector.forms, collector.page_context)
+
+
+def detect_rendered_login_form(snapshot: Optional[dict]) -> Optional[dict]:
+    """detect_login_form() for what RENDERED_FORMS_SCRIPT returned from a live page."""
+    if not snapshot:
+        return None  # Nothing to fill in on the page
+    return _best_login_form(snapshot.get('forms') or [], snapshot.get('page_context') or [])
+
+
+def _best_login_form(forms: List[dict], page_context: List[str]) -> Optional[dict]:
+    page_context = ' '.join(text for text in page_context if text)
+    best = max((_score_form(form, page_context) for form in forms if form['fields']),
+               key=lambda result: result['score'], default=None)
+    if best is None or best['score'] < LOGIN_THRESHOLD:
+        return None
+    best['reason'] = ', '.join(best['reasons'])
+    return best
+
+
+def form_fingerprint(result: dict) -> str:
+    """Identifies a detected form by its fields, so the same form does not pause a run twice."""
+    return ','.join(sorted(str(field) for field in result['fields']))
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, quote_plus, urlsplit
+
+import metrics
+from auth_store import normalize_domain
+from caching import URL_PATTERN, extract_urls
+
+logger = logging.getLogger(__name__)
+
+# The variable parts of a task: quoted text, URLs, dates and numbers. Everything else is the template,
+# so "Track order '1234' on shop.example.com" and "Track order '5678' ..." share one macro.
+PARAM_PATTERN = re.compile(r'"([^"]+)"|\'([^\']+)\'|(' + URL_PATTERN.pattern + r')|(\b\d{4}-\d{2}-\d{2}\b|\b\d+(?:[.,]\d+)*\b)',
+                           re.IGNORECASE)
+# How a parameter can appear in a recorded action: as typed, or encoded into a URL
+ENCODINGS = {'': lambda value: value, '+': quote_plus, '%': quote}
+
+MACRO_LOOKUPS_TOTAL = metrics.registry.counter('siteguide_macro_lookups_total', 'Macro lookups by task template.', ['result'])
+MACRO_STEPS_REPLAYED_TOTAL = metrics.registry.counter(
+    'siteguide_macro_steps_replayed_total', 'Agent steps replayed from a macro instead of asking the LLM.')
+MACRO_SECONDS_SAVED_TOTAL = metrics.registry.counter(
+    'siteguide_macro_seconds_saved_total', 'Recorded step time minus replay time, summed over replayed steps.')
+
+
+def task_template(task: str) -> Tuple[str, List[str]]:
+    """Split a task into its template (lower-cased, parameters as {}) and the parameter values in order."""
+    params = []
+
+    def placeholder(match):
+        params.append(next(group for group in match.groups() if group).rstrip('.,;:!?)'))
+        return '{}'
+
+    template = PARAM_PATTERN.sub(placeholder, task or '')
+    template = re.sub(r'\s+', ' ', template).strip().lower().rstrip('.!?;, ')
+    return template, params
+
+
+def _marker(index: int, encoding: str) -> str:
+    return f'{{{{p{index}{encoding}}}}}'
+
+
+def parameterize(value: Any, params: List[str]) -> Any:
+    """Replace the task's parameter values inside `value` (any JSON) with markers, longest first.
+
+    Values shorter than 3 characters are only replaced when they are the whole string,
+    so a parameter like '5' does not turn every 5 in a page URL into a marker.
+    """
+    if isinstance(value, dict):
+        return {key: parameterize(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [parameterize(item, params) for item in value]
+    if not isinstance(value, str):
+        return value
+    for index, param in sorted(enumerate(params), key=lambda pair: -len(pair[1])):
+        for encoding, encode in ENCODINGS.items():
+            encoded = encode(param)
+            if encoding and encoded == param:
+                continue  # Nothing to encode; the plain marker covers it
+            if value == encoded:
+                return _marker(index, encoding)
+            if len(param) >= 3 and encoded in value:
+                value = value.replace(encoded, _marker(index, encoding))
+    return value
+
+
+def substitute(value: Any, params: List[str]) -> Any:
+    """The inverse of parameterize(): fill the markers with this run's parameter values."""
+    if isinstance(value, dict):
+        return {key: substitute(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute(item, params) for item in value]
+    if not isinstance(value, str) or '{{p' not in value:
+        return value
+    for index, param in enumerate(params):
+        for encoding, encode in ENCODINGS.items():
+            value = value.replace(_marker(index, encoding), encode(param))
+    return value
+
+
+def record_trace(history, params: List[str], replayed_seconds: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    """The replayable steps of a successful run, parameterized by the task's values.
+
+    Failed steps are left out, and recording stops before the final 'done' step: the
+    answer depends on what the pages show on the day, so the LLM always writes it.
+    Each step keeps what the page looked like when it ran (URL, title and the
+    elements its actions used) for replays to check against; element positions
+    (xpaths) are kept verbatim, only their attributes are parameterized. Steps that were
+    themselves replayed keep the duration they took when the LLM first ran them.
+    """
+    steps = []
+    for position, item in enumerate(history.history):
+        if item.model_output is None or any(result.error for result in item.result):
+            continue
+        output = item.model_output.model_dump(mode='json', exclude_unset=True)
+        if any('done' in action for action in output.get('action', [])):
+            break
+        elements = []
+        for element in item.state.interacted_element:
+            elements.append(None if element is None else {
+                'tag_name': element.tag_name,
+                'xpath': element.xpath,
+                'highlight_index': element.highlight_index,
+                'entire_parent_branch_path': element.entire_parent_branch_path,
+                'attributes': parameterize(element.attributes, params),
+                'shadow_root': element.shadow_root,
+            })
+        if replayed_seconds and position < len(replayed_seconds):
+            seconds = replayed_seconds[position]
+        else:
+            seconds = item.metadata.duration_seconds if item.metadata else 0.0
+        steps.append({
+            'model_output': parameterize(output, params),
+            'elements': elements,
+            'url': parameterize(item.state.url, params),
+            'title': parameterize(item.state.title, params),
+            'seconds': round(seconds, 3),
+        })
+    return steps
+
+
+def same_location(url: str, expected: str) -> bool:
+    """Whether the page is where the recording was: same host and path (queries hold per-visit state)."""
+    current, recorded = urlsplit(url or ''), urlsplit(expected or '')
+    return (current.hostname or '', current.path.rstrip('/')) == (recorded.hostname or '', recorded.path.rstrip('/'))
+
+
+class Macro:
+    """A recorded action trace ready to replay for one task: its steps with this task's parameters filled in."""
+
+    def __init__(self, macro_id: int, template: str, domain: str, steps: List[Dict[str, Any]]):
+        self.macro_id = macro_id
+        self.template = template
+        self.domain = domain
+        self.steps = steps
+
+    @property
+    def recorded_seconds(self) -> float:
+        return sum(step['seconds'] for step in self.steps)
+
+
+class MacroStore:
+    """Action traces of successful runs, keyed by task template and domain, for replaying without the LLM.
+
+    A run of a task whose template (and start domain, if the task names one) has a
+    macro replays its steps first and hands over to the LLM at the first step whose
+    page no longer matches the recording. A successful run records its trace,
+    replacing the macro's; a macro whose replays keep ending in failed runs is
+    dropped after `max_failures` in a row. Hit rate and the time replays saved are
+    counted per process and per macro.
+    """
+
+    def __init__(self, path: str, max_failures: int = 3, min_steps: int = 2):
+        self.path = path
+        self.max_failures = max_failures
+        self.min_steps = min_steps
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.replays_completed = 0
+        self.replays_diverged = 0
+        self.steps_replayed = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(
+            'CREATE TABLE IF NOT EXISTS macros ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, template TEXT NOT NULL, domain TEXT NOT NULL, steps TEXT NOT NULL, '
+            'step_count INTEGER NOT NULL, recorded_seconds REAL NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL, '
+            'replays INTEGER NOT NULL DEFAULT 0, steps_replayed INTEGER NOT NULL DEFAULT 0, divergences INTEGER NOT NULL DEFAULT 0, '
+            'seconds_saved REAL NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, UNIQUE (template, domain));'
+            'CREATE INDEX IF NOT EXISTS macros_template ON macros (template, updated_at);'
+        )
+
+    @staticmethod
+    def task_domain(task: str) -> Optional[str]:
+        urls = extract_urls(task)
+        return normalize_domain(urls[0]) if urls else None
+
+    def find(self, task: str) -> Optional[Macro]:
+        """The macro for the task's template and start domain (any domain if the task names none), filled in."""
+        template, params = task_template(task)
+        domain = self.task_domain(task)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT id, template, domain, steps FROM macros WHERE template = ? AND (? IS NULL OR domain = ?) '
+                'ORDER BY updated_at DESC LIMIT 1', (template, domain, domain),
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            MACRO_LOOKUPS_TOTAL.inc(result='miss')
+            return None
+        self.hits += 1
+        MACRO_LOOKUPS_TOTAL.inc(result='hit')
+        steps = json.loads(row['steps'])
+        for step in steps:
+            for key in ('model_output', 'url', 'title'):
+                step[key] = substitute(step[key], params)
+            for element in step['elements']:
+                if element is not None:
+                    element['attributes'] = substitute(element['attributes'], params)
+        return Macro(row['id'], row['template'], row['domain'], steps)
+
+    def complete(self, task: str, history, replay: Optional[Dict[str, Any]], succeeded: bool):
+        """Account for a finished run: the outcome of its replay (if any), and its trace when it succeeded."""
+        if replay:
+            self._count_replay(replay, succeeded)
+        if not succeeded:
+            return
+        template, params = task_template(task)
+        steps = record_trace(history, params, replay['step_seconds'][:replay['replayed']] if replay else None)
+        if len(steps) < self.min_steps:
+            return
+        domain = self.task_domain(task)
+        if domain is None:
+            urls = [url for url in history.urls() if url and url.startswith('http')]
+            domain = normalize_domain(urls[0]) if urls else ''
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO macros (template, domain, steps, step_count, recorded_seconds, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (template, domain) DO UPDATE SET steps = excluded.steps, '
+                'step_count = excluded.step_count, recorded_seconds = excluded.recorded_seconds, '
+                'updated_at = excluded.updated_at, failures = 0',
+                (template, domain, json.dumps(steps), len(steps), round(sum(step['seconds'] for step in steps), 3), now, now),
+            )
+        self.recorded += 1
+        logger.info(f"Recorded a {len(steps)}-step macro for '{template}' on {domain or 'any domain'}.")
+
+    def _count_replay(self, replay: Dict[str, Any], succeeded: bool):
+        diverged = replay['replayed'] < replay['steps']
+        self.replays_diverged += diverged
+        self.replays_completed += not diverged
+        self.steps_replayed += replay['replayed']
+        self.seconds_saved += replay['seconds_saved']
+        MACRO_STEPS_REPLAYED_TOTAL.inc(replay['replayed'])
+        MACRO_SECONDS_SAVED_TOTAL.inc(max(replay['seconds_saved'], 0.0))
+        with self._lock:
+            self._conn.execute(
+                'UPDATE macros SET replays = replays + 1, steps_replayed = steps_replayed + ?, divergences = divergences + ?, '
+                'seconds_saved = seconds_saved + ?, failures = CASE WHEN ? THEN 0 ELSE failures + 1 END WHERE id = ?',
+                (replay['replayed'], int(diverged), replay['seconds_saved'], succeeded, replay['macro_id']),
+            )
+            self._conn.execute('DELETE FROM macros WHERE id = ? AND failures >= ?', (replay['macro_id'], self.max_failures))
+
+    def delete(self, macro_id: int) -> bool:
+        with self._lock:
+            return self._conn.execute('DELETE FROM macros WHERE id = ?', (macro_id,)).rowcount > 0
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, template, domain, step_count, recorded_seconds, created_at, updated_at, replays, steps_replayed, '
+                'divergences, seconds_saved, failures FROM macros ORDER BY updated_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM macros').fetchone()[0]
+        lookups = self.hits + self.misses
+        replays = self.replays_completed + self.replays_diverged
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'recorded': self.recorded,
+            'replays_completed': self.replays_completed,
+            'replays_diverged': self.replays_diverged,
+            'full_replay_ratio': round(self.replays_completed / replays, 4) if replays else 0.0,
+            'llm_steps_saved': self.steps_replayed,
+            'seconds_saved': round(self.seconds_saved, 3),
+        }
+
+
+def get_macro_store(default_path: str) -> Optional[MacroStore]:
+    """Open the store at MACROS_PATH (default_path otherwise); MACROS=off disables recording and replay."""
+    if os.getenv('MACROS', 'on').lower() == 'off':
+        return None
+    return MacroStore(
+        path=os.getenv('MACROS_PATH') or default_path,
+        max_failures=int(os.getenv('MACRO_MAX_FAILURES', '3')),
+        min_steps=int(os.getenv('MACRO_MIN_STEPS', '2')),
+    )
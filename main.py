@@ -1,15 +1,49 @@
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.textinput import TextInput
-from kivy.uix.button import Button
 from kivy.uix.label import Label
+from kivy.properties import StringProperty
 from kivy.lang import Builder
 from kivy.core.window import Window
 from kivy.clock import Clock
 
+# Server the desktop client drives; the same one the web frontend talks to
+SERVER_URL = os.getenv('SITEGUIDE_SERVER_URL', 'http://127.0.0.1:5000').rstrip('/')
+HEADLESS = os.getenv('SITEGUIDE_HEADLESS', 'false').lower() == 'true'
+USE_VISION = os.getenv('SITEGUIDE_VISION', 'false').lower() == 'true'
+# The server sends a keep-alive every 15 seconds; a silent stream longer than this is dead
+STREAM_READ_TIMEOUT = 45.0
+STREAM_MAX_BACKOFF = 30.0
+# How often streamed messages are moved into the chat list (one list update per tick)
+FLUSH_INTERVAL = 0.1
+
 # Define the KV language string for styling
 Builder.load_string('''
+<ChatMessage>:
+    size_hint_y: None
+    height: self.texture_size[1] + 20
+    text_size: self.width - 20, None
+    padding: 10, 10
+    halign: 'right' if self.sender == 'user' else 'left'
+    valign: 'top'
+    font_size: '15sp'
+    color: (0.7, 0.7, 0.7, 1) if self.sender == 'status' else (1, 1, 1, 1)
+    canvas.before:
+        Color:
+            rgba: (0.25, 0.25, 0.25, 1) if self.sender == 'user' else (0, 0, 0, 0)
+        RoundedRectangle:
+            pos: self.pos
+            size: self.size
+            radius: [15]
+
 <ChatInterface>:
     orientation: 'horizontal'
     canvas.before:
@@ -71,12 +105,16 @@ Builder.load_string('''
         padding: [20, 10]
         spacing: 20
         
-        ScrollView:
-            BoxLayout:
-                id: chat_messages
+        # Only the visible messages have widgets; the rest are plain dicts in `data`
+        RecycleView:
+            id: chat_messages
+            viewclass: 'ChatMessage'
+            RecycleBoxLayout:
                 orientation: 'vertical'
                 size_hint_y: None
                 height: self.minimum_height
+                default_size: None, dp(60)
+                default_size_hint: 1, None
                 spacing: 20
                 padding: [0, 20]
         
@@ -124,10 +162,128 @@ Builder.load_string('''
                         radius: [15]
 ''')
 
+
+class ChatMessage(Label):
+    """One row of the chat list; RecycleView reuses these for whichever messages are on screen."""
+    sender = StringProperty('agent')
+
+
+class ServerClient:
+    """Talks to the SiteGuide server from background threads so the Kivy loop never waits on the network.
+
+    Tasks are posted to /run_task and the session's agent messages are followed on
+    /stream_agent_messages (Server-Sent Events), resuming from the last event ID
+    after a dropped connection. `on_event(sender, text)` is called from those
+    threads, so it must only hand the message over, not touch widgets.
+    """
+
+    def __init__(self, base_url: str, on_event):
+        self.base_url = base_url
+        self.on_event = on_event
+        self.session_id = uuid.uuid4().hex
+        self._stopped = threading.Event()
+        self._last_event_id = 0
+        self._stream = None
+
+    def start(self):
+        threading.Thread(target=self._follow_stream, name='siteguide-stream', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()  # Unblocks the reader thread
+            except Exception:
+                pass
+
+    def send_task(self, task: str):
+        threading.Thread(target=self._post_task, args=(task,), name='siteguide-send', daemon=True).start()
+
+    def _post_task(self, task: str):
+        body = urlencode({
+            'task': task,
+            'session_id': self.session_id,
+            'headless': 'true' if HEADLESS else 'false',
+            'vision': 'true' if USE_VISION else 'false',
+        }).encode('utf-8')
+        try:
+            with urlopen(Request(f"{self.base_url}/run_task", data=body, method='POST'), timeout=30) as response:
+                response.read()
+        except HTTPError:
+            pass  # The server explains rejected tasks on the message stream
+        except (URLError, OSError) as e:
+            self.on_event('status', f"Could not reach the server at {self.base_url}: {e}")
+
+    def _follow_stream(self):
+        backoff = 1.0
+        reported = False
+        while not self._stopped.is_set():
+            url = f"{self.base_url}/stream_agent_messages?{urlencode({'session_id': self.session_id})}"
+            headers = {'Accept': 'text/event-stream', 'Last-Event-ID': str(self._last_event_id)}
+            try:
+                with urlopen(Request(url, headers=headers), timeout=STREAM_READ_TIMEOUT) as response:
+                    self._stream = response
+                    if reported:
+                        self.on_event('status', 'Reconnected to the server.')
+                    backoff, reported = 1.0, False
+                    self._read_events(response)
+            except Exception as e:
+                if self._stopped.is_set():
+                    return
+                if not reported:
+                    self.on_event('status', f"Lost connection to the server ({e}); retrying...")
+                    reported = True
+            finally:
+                self._stream = None
+            self._stopped.wait(backoff)
+            backoff = min(backoff * 2, STREAM_MAX_BACKOFF)
+
+    def _read_events(self, response):
+        event, data, event_id = 'message', [], None
+        for raw in response:
+            if self._stopped.is_set():
+                return
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if line:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append(value)
+                elif field == 'id':
+                    event_id = value
+                continue
+            # A blank line ends the event
+            if data:
+                try:
+                    message = json.loads('\n'.join(data)).get('message', '')
+                except ValueError:
+                    message = '\n'.join(data)
+                if event == 'gap':
+                    self.on_event('status', message)
+                else:
+                    self.on_event('agent', self._format(message))
+            if event_id and event_id.isdigit():
+                self._last_event_id = int(event_id)
+            event, data, event_id = 'message', [], None
+
+    def _format(self, message: str) -> str:
+        if message.startswith('/artifacts/'):
+            return f"Replay of the run: {self.base_url}{message}"
+        return message
+
+
 class ChatInterface(BoxLayout):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         Window.clearcolor = (0.1, 0.1, 0.1, 1)
+        # Messages arriving from the client's threads wait here until the next UI tick
+        self.pending = deque()
+        self.client = None
+        self.connect()
+        Clock.schedule_interval(self.flush_pending, FLUSH_INTERVAL)
         # Bind buttons
         self.ids.send_button.bind(on_press=lambda x: self.handle_send())
         self.ids.message_input.bind(on_text_validate=lambda x: self.handle_send())
@@ -137,6 +293,13 @@ class ChatInterface(BoxLayout):
         # Bind keyboard
         Window.bind(on_key_down=self.on_key_down)
 
+    def connect(self):
+        """Start a fresh server session and follow its messages."""
+        if self.client:
+            self.client.stop()
+        self.client = ServerClient(SERVER_URL, lambda sender, text: self.pending.append({'text': text, 'sender': sender}))
+        self.client.start()
+
     def on_key_down(self, instance, keyboard, keycode, text, modifiers):
         # Check if the focused widget is the message input and Enter key is pressed
         if self.ids.message_input.focus and keycode == 40:  # 40 is the keycode for Enter
@@ -148,60 +311,45 @@ class ChatInterface(BoxLayout):
     def handle_send(self, *args):
         message = self.ids.message_input.text.strip()
         if message:
-            # Create user message bubble
-            user_message = Label(
-                text=message,
-                size_hint_y=None,
-                height=60,
-                text_size=(self.width * 0.7, None),
-                halign='right',
-                color=(1, 1, 1, 1),
-                padding=(10, 10)
-            )
-            
-            # Add message to chat
-            self.ids.chat_messages.add_widget(user_message)
-            
+            self.add_message('user', message)
             # Clear input
             self.ids.message_input.text = ''
-            
-            # Simulate AI response
-            ai_response = Label(
-                text=f"You said: {message}",
-                size_hint_y=None,
-                height=60,
-                text_size=(self.width * 0.7, None),
-                halign='left',
-                color=(1, 1, 1, 1),
-                padding=(10, 10)
-            )
-            self.ids.chat_messages.add_widget(ai_response)
-            
-            # Scroll to bottom
+            self.client.send_task(message)
+
+    def add_message(self, sender, text):
+        self.pending.append({'text': text, 'sender': sender})
+        self.flush_pending()
+
+    def flush_pending(self, *args):
+        """Move queued messages into the list in one update, keeping the view pinned to the bottom if it was."""
+        if not self.pending:
+            return
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        chat = self.ids.chat_messages
+        at_bottom = chat.scroll_y <= 0.01 or chat.height >= chat.children[0].height
+        chat.data.extend(batch)
+        if at_bottom:
             Clock.schedule_once(lambda dt: self.scroll_to_bottom())
 
     def scroll_to_bottom(self):
-        scroll_view = self.ids.chat_messages.parent
-        scroll_view.scroll_y = 0
+        self.ids.chat_messages.scroll_y = 0
 
     def new_chat(self, instance):
-        # Clear the chat messages
-        self.ids.chat_messages.clear_widgets()
+        # Start over in a new server session
+        self.connect()
+        self.pending.clear()
+        self.ids.chat_messages.data = []
         # Clear the input field
         self.ids.message_input.text = ''
         # Add a welcome message
-        welcome_msg = Label(
-            text="Start a new conversation!",
-            size_hint_y=None,
-            height=40,
-            color=(0.7, 0.7, 0.7, 1),
-            font_size='16sp'
-        )
-        self.ids.chat_messages.add_widget(welcome_msg)
+        self.add_message('status', "Start a new conversation!")
 
     def clear_history(self, instance):
         # Clear all messages
-        self.ids.chat_messages.clear_widgets()
+        self.pending.clear()
+        self.ids.chat_messages.data = []
         # Clear the input field
         self.ids.message_input.text = ''
 
@@ -209,5 +357,9 @@ class ChatGPTCloneApp(App):
     def build(self):
         return ChatInterface()
 
+    def on_stop(self):
+        if self.root and self.root.client:
+            self.root.client.stop()
+
 if __name__ == '__main__':
     ChatGPTCloneApp().run()
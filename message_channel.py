@@ -0,0 +1,57 @@
+import asyncio
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+# (event_id, message)
+Event = Tuple[int, str]
+
+
+class MessageChannel:
+    """Bounded, ordered log of a session's agent messages, addressed by event ID.
+
+    Publishers never block: the log keeps the last `max_buffered` events and every
+    reader keeps its own cursor. A reader that falls further behind than the buffer
+    (a slow client, or one that reconnects late) is told how many events it missed
+    instead of holding memory for it.
+    """
+
+    def __init__(self, max_buffered: int = 500):
+        self._events = deque(maxlen=max_buffered)
+        self._next_id = 1
+        self._changed = asyncio.Event()
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
+
+    def publish(self, message: str) -> int:
+        event_id = self._next_id
+        self._next_id += 1
+        self._events.append((event_id, message))
+        # Wake every waiting reader, then arm a fresh event for the next publish
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return event_id
+
+    def read_after(self, last_event_id: int, limit: Optional[int] = None) -> Tuple[List[Event], int]:
+        """Return events newer than `last_event_id` and how many were dropped before them."""
+        events = [event for event in self._events if event[0] > last_event_id]
+        oldest_id = events[0][0] if events else self._next_id
+        missed = max(oldest_id - last_event_id - 1, 0)
+        if limit is not None:
+            events = events[:limit]
+        return events, missed
+
+    async def wait_for(self, last_event_id: int, timeout: float, limit: Optional[int] = None) -> Tuple[List[Event], int]:
+        """Like read_after(), but wait up to `timeout` seconds until something arrives."""
+        deadline = time.monotonic() + timeout
+        while self.last_event_id <= last_event_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.read_after(last_event_id, limit)
@@ -0,0 +1,223 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers a ~1 ms cache hit up to a multi-minute agent run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(counts[-1], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Holds the process's metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class TaskTimeline:
+    """Ordered spans of one task, with offsets relative to when the task started."""
+
+    def __init__(self, task_id: str, max_spans: int = 1000):
+        self.task_id = task_id
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.max_spans = max_spans
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.finished_at: Optional[float] = None
+        self.outcome: Optional[str] = None
+
+    def add(self, name: str, duration: float, start: Optional[float] = None, **attrs):
+        """Record a span; `start` is a perf_counter() reading (defaults to now - duration)."""
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        if start is None:
+            start = time.perf_counter() - duration
+        span = {'name': name, 'start': round(start - self._origin, 4), 'duration': round(duration, 4)}
+        if attrs:
+            span.update(attrs)
+        self.spans.append(span)
+
+    def finish(self, outcome: str):
+        self.finished_at = time.time()
+        self.outcome = outcome
+
+    def to_dict(self) -> Dict[str, Any]:
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span['name']] = round(totals.get(span['name'], 0.0) + span['duration'], 4)
+        return {
+            'task_id': self.task_id,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'outcome': self.outcome,
+            'totals': totals,
+            'spans': self.spans,
+            'dropped_spans': self.dropped,
+        }
+
+
+class TimelineStore:
+    """Keeps the timelines of the most recent `max_tasks` tasks."""
+
+    def __init__(self, max_tasks: int = 200):
+        self.max_tasks = max_tasks
+        self._timelines: "OrderedDict[str, TaskTimeline]" = OrderedDict()
+
+    def start(self, task_id: str) -> TaskTimeline:
+        timeline = TaskTimeline(task_id)
+        self._timelines[task_id] = timeline
+        while len(self._timelines) > self.max_tasks:
+            self._timelines.popitem(last=False)
+        return timeline
+
+    def get(self, task_id: str) -> Optional[TaskTimeline]:
+        return self._timelines.get(task_id)
+
+
+registry = Registry()
+timelines = TimelineStore()
+
+PHASE_SECONDS = registry.histogram(
+    'siteguide_phase_seconds', 'Time spent per task phase (transcription, browser_acquire, step, llm, ...).', ['phase'])
+TASKS_TOTAL = registry.counter('siteguide_tasks_total', 'Tasks by outcome.', ['outcome'])
+STEPS_TOTAL = registry.counter('siteguide_agent_steps_total', 'Agent steps executed.')
+LLM_CALLS_TOTAL = registry.counter('siteguide_llm_calls_total', 'LLM calls, split by whether the memo cache answered.', ['cached'])
+LLM_TOKENS_TOTAL = registry.counter('siteguide_llm_tokens_total', 'Tokens billed by the LLM.', ['direction'])
+
+# The timeline spans are attached to; set per agent run so concurrent runs stay apart
+current_timeline: contextvars.ContextVar[Optional[TaskTimeline]] = contextvars.ContextVar('current_timeline', default=None)
+
+
+def observe(phase: str, duration: float, timeline: Optional[TaskTimeline] = None, start: Optional[float] = None, **attrs):
+    """Record a finished phase in the histogram and in the task's timeline."""
+    PHASE_SECONDS.observe(duration, phase=phase)
+    timeline = timeline or current_timeline.get()
+    if timeline is not None:
+        timeline.add(phase, duration, start, **attrs)
+
+
+@contextmanager
+def span(phase: str, timeline: Optional[TaskTimeline] = None, **attrs) -> Iterator[None]:
+    """Time the enclosed block as `phase` (works in sync and async code alike)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start, timeline, start, **attrs)
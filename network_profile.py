@@ -0,0 +1,185 @@
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Playwright's resource types; 'document' (the page itself) is never blocked
+RESOURCE_TYPES = {'stylesheet', 'image', 'media', 'font', 'script', 'texttrack', 'xhr', 'fetch', 'eventsource',
+                  'websocket', 'manifest', 'other'}
+DEFAULT_BLOCKED_TYPES = ['image', 'media', 'font']
+
+# Ad, analytics and tracking hosts (and their subdomains) that no task needs to read a page
+TRACKER_DOMAINS = [
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com', 'googletagmanager.com',
+    'googletagservices.com', 'adservice.google.com', 'connect.facebook.net', 'amazon-adsystem.com', 'adnxs.com',
+    'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com', 'scorecardresearch.com', 'quantserve.com',
+    'hotjar.com', 'mixpanel.com', 'segment.io', 'segment.com', 'doubleverify.com', 'moatads.com', 'rubiconproject.com',
+    'pubmatic.com', 'openx.net', 'casalemedia.com', 'adsrvr.org', 'bat.bing.com', 'clarity.ms', 'nr-data.net',
+    'optimizely.com', 'chartbeat.com', 'analytics.tiktok.com', 'ads-twitter.com',
+]
+
+# Typical transfer size per resource type, for estimating what a blocked request would have cost
+# until requests of that type have actually been loaded (with blocking off) and measured
+TYPICAL_BYTES = {'image': 40_000, 'media': 500_000, 'font': 30_000, 'stylesheet': 15_000, 'script': 25_000}
+
+BLOCKED_REQUESTS_TOTAL = metrics.registry.counter(
+    'siteguide_blocked_requests_total', 'Browser requests blocked by the network profile.', ['resource_type'])
+NETWORK_BYTES_TOTAL = metrics.registry.counter(
+    'siteguide_network_bytes_total', 'Response bytes loaded by agent browsers, and the estimated bytes blocking saved.',
+    ['kind'])
+
+_observed_sizes: Dict[str, List[int]] = {}  # resource type -> [total bytes, responses]
+
+
+def _estimated_size(resource_type: str) -> int:
+    total, count = _observed_sizes.get(resource_type, (0, 0))
+    return total // count if count else TYPICAL_BYTES.get(resource_type, 5_000)
+
+
+class NetworkStats:
+    """What one task's browser loaded and what its network profile blocked."""
+
+    def __init__(self, timeline: Optional[metrics.TaskTimeline] = None):
+        self.timeline = timeline
+        self.requests = 0
+        self.blocked: Dict[str, int] = {}
+        self.blocked_domains = 0
+        self.bytes_loaded = 0
+        self.bytes_saved_estimate = 0
+        self.page_loads: List[float] = []
+
+    def record_blocked(self, resource_type: str, by_domain: bool):
+        self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+        self.blocked_domains += by_domain
+        saved = _estimated_size(resource_type)
+        self.bytes_saved_estimate += saved
+        BLOCKED_REQUESTS_TOTAL.inc(resource_type=resource_type)
+        NETWORK_BYTES_TOTAL.inc(saved, kind='saved_estimate')
+
+    def record_loaded(self, resource_type: str, size: int):
+        self.bytes_loaded += size
+        observed = _observed_sizes.setdefault(resource_type, [0, 0])
+        observed[0] += size
+        observed[1] += 1
+        NETWORK_BYTES_TOTAL.inc(size, kind='loaded')
+
+    def record_page_load(self, seconds: float, start: float, url: str):
+        self.page_loads.append(seconds)
+        metrics.observe('page_load', seconds, self.timeline, start, url=url)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'blocked': sum(self.blocked.values()),
+            'blocked_by_type': dict(self.blocked),
+            'blocked_by_domain': self.blocked_domains,
+            'bytes_loaded': self.bytes_loaded,
+            'bytes_saved_estimate': self.bytes_saved_estimate,
+            'page_loads': len(self.page_loads),
+            'avg_page_load_seconds': round(sum(self.page_loads) / len(self.page_loads), 4) if self.page_loads else None,
+            'max_page_load_seconds': round(max(self.page_loads), 4) if self.page_loads else None,
+        }
+
+
+class NetworkProfile:
+    """Request interception for an agent's browser context: block rules per resource type plus a domain blocklist.
+
+    Blocked requests are aborted before they leave the browser, so a text-only
+    agent does not wait on (or hold in memory) images, fonts, media and trackers it
+    never reads. Page navigations themselves are never blocked. Each attached
+    context gets a NetworkStats with page-load times, bytes loaded and an estimate
+    of the bytes saved (blocked requests are never downloaded, so their size is the
+    average observed for their type).
+    """
+
+    def __init__(self, blocked_types: Iterable[str] = DEFAULT_BLOCKED_TYPES, blocked_domains: Iterable[str] = TRACKER_DOMAINS):
+        self.blocked_types = set(blocked_types)
+        self.blocked_domains = [domain.lower() for domain in blocked_domains]
+
+    def block_reason(self, resource_type: str, url: str) -> Optional[str]:
+        """'type' or 'domain' when the request is blocked, else None."""
+        if resource_type in self.blocked_types:
+            return 'type'
+        host = (urlsplit(url).hostname or '').lower()
+        if any(host == domain or host.endswith('.' + domain) for domain in self.blocked_domains):
+            return 'domain'
+        return None
+
+    async def attach(self, browser_context, timeline: Optional[metrics.TaskTimeline] = None) -> NetworkStats:
+        """Start intercepting the context's requests; the returned stats fill up as pages load."""
+        session = await browser_context.get_session()
+        context = session.context
+        stats = NetworkStats(timeline)
+        navigations: Dict[Any, float] = {}
+
+        async def route(route):
+            request = route.request
+            stats.requests += 1
+            reason = None if request.is_navigation_request() else self.block_reason(request.resource_type, request.url)
+            if reason:
+                stats.record_blocked(request.resource_type, reason == 'domain')
+                await route.abort('blockedbyclient')
+            else:
+                await route.continue_()
+
+        def on_request(request):
+            if request.is_navigation_request() and request.frame.parent_frame is None:
+                navigations[request.frame] = time.perf_counter()
+
+        async def on_request_finished(request):
+            try:
+                sizes = await request.sizes()
+            except Exception:
+                return  # The page (or the context) went away first
+            stats.record_loaded(request.resource_type, sizes['responseBodySize'] + sizes['responseHeadersSize'])
+
+        def watch_page(page):
+            def on_load(page):
+                start = navigations.pop(page.main_frame, None)
+                if start is not None:
+                    stats.record_page_load(time.perf_counter() - start, start, page.url)
+            page.on('load', on_load)
+
+        for page in context.pages:
+            watch_page(page)
+        context.on('page', watch_page)
+        context.on('request', on_request)
+        context.on('requestfinished', on_request_finished)
+        await context.route('**/*', route)
+        return stats
+
+
+def resolve_blocked_types(value: Optional[str], use_vision: bool) -> Optional[List[str]]:
+    """Resource types to block for a task, or None to load everything.
+
+    `value` is the per-task `block_resources` setting: 'true', 'false' or a
+    comma-separated list of resource types. Unset, BLOCK_RESOURCES decides: 'auto'
+    (the default) blocks only for text-only tasks, 'on' always, 'off' never.
+    """
+    value = (value or '').strip().lower()
+    if value == 'false':
+        return None
+    if value in ('', 'true'):
+        mode = os.getenv('BLOCK_RESOURCES', 'auto').lower()
+        if value == '' and (mode == 'off' or (mode == 'auto' and use_vision)):
+            return None
+        configured = os.getenv('BLOCK_RESOURCE_TYPES')
+        value = configured if configured is not None else ','.join(DEFAULT_BLOCKED_TYPES)
+    types = [kind.strip() for kind in value.split(',') if kind.strip()]
+    unknown = [kind for kind in types if kind not in RESOURCE_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown resource types: {', '.join(unknown)}")
+    return types
+
+
+def get_network_profile(blocked_types: Optional[List[str]]) -> Optional[NetworkProfile]:
+    """Build the profile for resolved `blocked_types`, with the trackers plus BLOCKED_DOMAINS on the blocklist."""
+    if blocked_types is None:
+        return None
+    extra = [domain.strip() for domain in os.getenv('BLOCKED_DOMAINS', '').split(',') if domain.strip()]
+    return NetworkProfile(blocked_types, TRACKER_DOMAINS + extra)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import re
+import time
+from html.parser import HTMLParser
+from typing import Any, Awaitable, Callable, Dict, List
+from urllib.parse import urlsplit, urlunsplit
+
+from caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'svg', 'template', 'iframe', 'head'}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'nav', 'aside', 'li', 'ul', 'ol', 'tr',
+              'table', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'form', 'label', 'button', 'blockquote', 'pre'}
+
+
+class _TextExtractor(HTMLParser):
+    """Visible text of a page, one line per block element, plus its title."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.lines: List[str] = ['']
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'title':
+            self._in_title = True
+        elif tag in SKIPPED_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS and self.lines[-1]:
+            self.lines.append('')
+        elif tag in ('td', 'th'):
+            self.lines[-1] += ' '
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        elif tag in SKIPPED_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in BLOCK_TAGS and self.lines[-1]:
+            self.lines.append('')
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.lines[-1] += data
+
+
+def html_to_text(html: str) -> Dict[str, str]:
+    """Title and readable text of an HTML page, without scripts, styles and markup."""
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        pass  # Keep whatever was extracted before the markup broke
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in extractor.lines)
+    return {'title': re.sub(r'\s+', ' ', extractor.title).strip(), 'text': '\n'.join(line for line in lines if line)}
+
+
+def page_key(url: str) -> str:
+    """A URL without its fragment and with a lower-case host, so links to the same page share a key."""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', parts.query, ''))
+
+
+class PageContextCache:
+    """Per-URL cache of a page's cleaned text (or its summary) for the extension's prompts.
+
+    Entries live in a TTLCache, so they expire after `ttl` seconds and the least
+    recently used go first once `max_entries` is reached. Concurrent requests for
+    the same page share one load instead of fetching it twice.
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: float = 900.0):
+        self.backend = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.load_seconds = 0.0
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    async def get(self, url: str, load: Callable[[str], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """The cached context of `url`, calling `load(url)` on a miss; the result has `cached` set."""
+        key = page_key(url)
+        context = self.backend.get(key)
+        if context is not None:
+            self.hits += 1
+            return dict(context, cached=True)
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.hits += 1
+            return dict(await asyncio.shield(pending), cached=True)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        start = time.perf_counter()
+        try:
+            context = await load(url)
+            context['fetched_at'] = time.time()
+            self.backend.set(key, context)
+            future.set_result(context)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark it retrieved; waiters (if any) re-raise it themselves
+            raise
+        finally:
+            self.load_seconds += time.perf_counter() - start
+            del self._loading[key]
+        return dict(context, cached=False)
+
+    def invalidate(self, url: str):
+        self.backend.delete(page_key(url))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'avg_load_seconds': round(self.load_seconds / self.misses, 4) if self.misses else 0.0,
+        }
+
+
+def same_page(open_url: str, url: str) -> bool:
+    return bool(open_url) and page_key(open_url) == page_key(url)
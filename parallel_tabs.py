@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+import metrics
+from login_detector import RENDERED_FORMS_SCRIPT, detect_rendered_login_form
+from page_context import html_to_text
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_PROMPT = (
+    "Your task is to extract the content of the page. You will be given a page and a goal and you should extract "
+    "all relevant information around this goal from the page. If the goal is vague, summarize the page. "
+    "Respond in json format. Extraction goal: {goal}, Page: {page}"
+)
+
+
+class ExploreTabsAction(BaseModel):
+    urls: List[str]
+    goal: str
+
+
+async def explore_tabs(browser_context, urls: List[str], goal: str, llm=None, fan_out: int = 4,
+                       timeout: float = 30.0, max_chars: int = 20000) -> List[Dict[str, Any]]:
+    """Open `urls` in new tabs of the agent's browser, at most `fan_out` at a time, and extract `goal` from each.
+
+    Every tab is checked with the local login-form detector first: a tab behind a
+    login is not extracted and is left open (with `login` and `page` set) for the
+    caller to hand to the login flow; all other tabs are closed once read. Results
+    come back in the order of `urls`, each with `content`, `login` or `error`.
+    """
+    session = await browser_context.get_session()
+    semaphore = asyncio.Semaphore(max(fan_out, 1))
+
+    async def explore(url: str) -> Dict[str, Any]:
+        async with semaphore:
+            start = time.perf_counter()
+            result: Dict[str, Any] = {'url': url}
+            page = None
+            try:
+                page = await session.context.new_page()
+                await page.goto(url, wait_until='domcontentloaded', timeout=timeout * 1000)
+                try:
+                    await page.wait_for_load_state('load', timeout=5000)
+                except Exception:
+                    pass  # Slow subresources; the document itself is there
+                result['url'] = page.url
+                login = detect_rendered_login_form(await page.evaluate(RENDERED_FORMS_SCRIPT))
+                if login:
+                    result.update(login=login, page=page)
+                    return result
+                html = await page.content()
+                text = html_to_text(html)
+                result['title'] = text['title']
+                page_text = text['text'][:max_chars]
+                if llm is None:
+                    result['content'] = page_text
+                else:
+                    response = await llm.ainvoke(EXTRACTION_PROMPT.format(goal=goal, page=page_text))
+                    result['content'] = response.content
+            except Exception as e:
+                logger.warning(f"Failed to explore {url}: {str(e)}")
+                result['error'] = str(e)
+            finally:
+                result['seconds'] = round(time.perf_counter() - start, 3)
+                metrics.observe('explore_tab', result['seconds'], start=start, url=result['url'])
+                if page is not None and 'login' not in result:
+                    try:
+                        await page.close()
+                    except Exception:
+                        pass  # Already closed with the browser
+            return result
+
+    with metrics.span('explore_tabs', tabs=len(urls), fan_out=fan_out):
+        return list(await asyncio.gather(*(explore(url) for url in urls)))
+
+
+def format_tab_results(goal: str, results: List[Dict[str, Any]], skipped: Optional[List[str]] = None) -> str:
+    """The explored tabs as one message for the agent's history, one section per URL."""
+    lines = [f"Explored {len(results)} tabs in parallel for: {goal}"]
+    for index, result in enumerate(results, start=1):
+        if result.get('login'):
+            lines.append(f"\n[{index}] {result['url']}\nNeeds a login ({result['login']['reason']}); not extracted.")
+        elif result.get('error'):
+            lines.append(f"\n[{index}] {result['url']}\nFailed to load: {result['error']}")
+        else:
+            title = f"{result['title']} - " if result.get('title') else ''
+            lines.append(f"\n[{index}] {title}{result['url']}\n{result['content']}")
+    if skipped:
+        lines.append(f"\nNot explored (over the per-call limit), explore them in another call: {', '.join(skipped)}")
+    return '\n'.join(lines)
@@ -1,21 +1,49 @@
 import os
 import asyncio
 import logging
-import tempfile
 import base64
-from typing import Optional, List
-from queue import Queue
+import json
+import time
+import uuid
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, Optional, List
 from pathlib import Path
+from urllib.parse import urlsplit
+
+# Startup milestones (see /readyz and siteguide_startup_seconds) are measured from here
+IMPORT_STARTED = time.perf_counter()
 
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify, Response
-from langchain_google_genai import ChatGoogleGenerativeAI
-from browser_use import Agent, Browser, BrowserConfig, SystemPrompt
-from browser_use.browser.context import BrowserContextConfig, BrowserContext
-from pydantic import SecretStr
-from browser_use.controller.service import Controller
-from groq import Groq
-from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+import metrics
+from artifacts import ReplayArtifactStore, get_replay_store
+from auth_store import AuthStateStore, apply_state, capture_state, get_auth_store, normalize_domain
+from batch import expand_tasks, fan_out, summarize
+from browser_pool import get_browser_pool
+from caching import TaskResultCache, extract_urls
+from conversation_log import ConversationLog, get_conversation_log
+from jobs import CANCELLED, FINAL_STATES, SUCCEEDED, JobStore, get_job_store
+from macros import MacroStore, get_macro_store
+from network_profile import resolve_blocked_types
+from page_context import PageContextCache, html_to_text
+from sessions import AgentSession, SessionManager
+from startup import FirstRequestTimer, LazyComponent, StartupTimings
+from transcription import UploadTooLarge, get_transcriber, iter_audio_segments
+
+if TYPE_CHECKING:
+    from browser_use import Browser
+    from browser_use.browser.context import BrowserContext
+
+    from agent_runtime import TabReusingContext
 
 # Set Windows event loop policy for asyncio compatibility
 # if os.name == 'nt':  # Windows
@@ -28,165 +56,384 @@ logger = logging.getLogger(__name__)
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24)
-
-# Global state for login handling and messages
-original_agent: Optional[Agent] = None
-login_domain = ""
-awaiting_continue = False
-awaiting_credentials = False
-is_task = True  # Flag to distinguish task inputs from login/continue/exit commands
-agent_messages = Queue()  # Use a Queue to store agent messages
-
-# Initialize the language model
-def get_llm():
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError('GEMINI_API_KEY is not set.')
-    return ChatGoogleGenerativeAI(model='gemini-2.0-flash-exp', api_key=SecretStr(api_key))
-
-try:
-    llm = get_llm()
-except ValueError as e:
-    logger.critical(f"Failed to initialize LLM: {e}")
-    exit(1)
-
-# Initialize Groq client
-groq_api_key = os.getenv("GROQ_API_KEY")
-if not groq_api_key:
-    raise ValueError("GROQ_API_KEY is not set.")
-groq_client = Groq(api_key=groq_api_key)
-
-class CustomSystemPrompt(SystemPrompt):
-    def important_rules(self) -> str:
-        return """
-1. INPUT FIELD DETECTION:
-   - Carefully analyze the current webpage for any input fields (e.g., text inputs, password fields, select boxes) that require user-provided information, such as usernames, email addresses, passwords, one-time passwords (OTPs), phone numbers, or other personal details.
-   - Look for indicators of input fields, including:
-     - HTML input types: `text`, `email`, `password`, `tel`, `number`.
-     - Attributes: `type`, `name`, `id`, `placeholder`, `aria-label`, `aria-describedby`, `title`, `role`, or `class` containing keywords like "username", "email", "password", "otp", "phone", "login", "signin", "register", "authentication", "verify", or "code".
-     - Labels or surrounding text suggesting user input is required (e.g., "Enter your email", "Password", "Phone Number", "Verification Code").
-     - Fields marked as required (`required` attribute) or visually highlighted as mandatory.
-   - Detect multi-step forms (e.g., login pages with separate email/username and password fields, or OTP verification after login).
-   - If an input field requiring user information is detected, immediately call the "Handle Login" action with the current domain (e.g., "Handle Login" with domain "example.com") and pause execution to wait for user input or credentials.
-
-2. LOGIN HANDLING:
-   - When calling "Handle Login", pause the agent and wait for user instructions via the chat interface. The user can either:
-     - Provide credentials manually (e.g., "email password" for automatic login).
-     - Manually log in and type 'continue' to resume.
-     - Type 'exit' to stop the agent.
-   - Do not attempt to guess, generate, or autofill credentials unless explicitly provided by the user.
-   - If the page requires multiple inputs (e.g., username and password), ensure the "Handle Login" action is called once for the domain, and the user provides all necessary credentials in the format specified.
-
-3. ERROR HANDLING AND CONTEXT:
-   - If unsure whether an input field requires user information, err on the side of caution and call "Handle Login" to prompt the user.
-   - Ignore non-sensitive input fields like search bars, comments, or optional form fields unless they clearly relate to authentication or personal data.
-   - Use the browser context (e.g., URLs, DOM structure, and previous actions) to determine if the input field is part of a login, registration, or verification process.
-
-4. PERFORMANCE AND PRECISION:
-   - Avoid unnecessary calls to "Handle Login" for non-authentication fields (e.g., address, preferences, or non-required fields).
-   - Prioritize accuracy over speed, ensuring you only pause for fields that genuinely require user intervention for security or access.
-   - If multiple input fields are detected on the same page, analyze their relationship (e.g., grouped in a form with a "Login" or "Submit" button) and call "Handle Login" once, providing the domain.
-
-5. EXAMPLES:
-   - For a login page with fields labeled "Email" and "Password", call "Handle Login" with the domain and pause for user input.
-   - For an OTP field labeled "Verification Code" after login, call "Handle Login" and wait for credentials or 'continue'.
-   - For a phone number field in a registration form, call "Handle Login" if it’s part of authentication, but skip if it’s optional or unrelated to login.
-"""
-    def additional_context(self) -> str:
-        return """
-- Use the browser’s DOM structure, ARIA attributes, and surrounding text to identify input fields.
-- Leverage the history of actions and page states to determine if the current page is part of an authentication flow.
-- Ensure all sensitive data (e.g., usernames, passwords, OTPs) is handled securely by pausing and deferring to user input via the chat interface.
-"""
-
-# Initialize controller
-controller = Controller()
-
-def send_agent_message(message: str):
-    """Add a message to the queue for polling by the frontend."""
-    agent_messages.put(message)
-    logger.info(f"Queued agent message: {message}")
-
-def encode_gif_to_base64(gif_path: str) -> str:
-    """Encode a GIF file to base64 for sending as a message."""
-    try:
-        with open(gif_path, "rb") as gif_file:
-            base64_encoded = base64.b64encode(gif_file.read()).decode('utf-8')
-            return f"data:image/gif;base64,{base64_encoded}"
-    except Exception as e:
-        logger.error(f"Failed to encode GIF: {str(e)}")
-        return ""
+BASE_DIR = Path(__file__).resolve().parent
+templates = Jinja2Templates(directory=str(BASE_DIR / 'templates'))
 
-@controller.action('Handle Login')
-async def handle_login_action(domain: str, reason: str, browser: BrowserContext):
-    global original_agent, login_domain, awaiting_continue, awaiting_credentials, is_task
-    logger.info(f"Login detected for {domain}. Pausing task.")
-    
-    if not original_agent:
-        logger.error("Original agent not set. Cannot pause task.")
+# Agent runs and other background work, tracked so shutdown can cancel them cleanly
+background_tasks = set()
+
+# Per-session agent state; each session owns its agent, login-pause state and messages
+DEFAULT_SESSION_ID = 'default'
+session_manager = SessionManager(
+    max_concurrent_agents=int(os.getenv('MAX_CONCURRENT_AGENTS', '4')),
+    idle_timeout=float(os.getenv('SESSION_IDLE_TIMEOUT', '3600')),
+)
+
+# Streaming/long-poll tuning: keep-alive interval, longest long-poll wait, events per flush
+STREAM_KEEPALIVE_SECONDS = 15.0
+LONG_POLL_MAX_WAIT = 25.0
+STREAM_BATCH_SIZE = 50
+
+# /upload_audio holds each segment in memory until it is transcribed; bigger uploads get a 413
+AUDIO_UPLOAD_MAX_BYTES = int(os.getenv('AUDIO_UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+
+# Warm pool of headless browsers; tasks check one out instead of launching Chromium
+browser_pool = get_browser_pool()
+
+# /run_batch fan-out: items run as their own agents, each in its own context on the shared browsers
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '200'))
+BATCH_MAX_PARALLELISM = int(os.getenv('BATCH_MAX_PARALLELISM', '8'))
+BATCH_ITEM_TIMEOUT = float(os.getenv('BATCH_ITEM_TIMEOUT', '300'))
+batch_items: Dict[int, dict] = {}  # id(browser context) -> running batch item, for the login handler
+
+# The stores below live on disk and are opened by open_stores() at startup, so importing this module
+# creates no files or threads.
+
+# Saved logins per session and domain (encrypted; only with AUTH_STATE_KEY set), so repeat tasks skip the login pause
+auth_store: Optional[AuthStateStore] = None
+
+# Durable job queue run by worker processes. TASK_EXECUTION=queue sends chat tasks there
+# too; JOB_WORKERS starts that many workers with the server (or run worker.py separately).
+TASK_EXECUTION = os.getenv('TASK_EXECUTION', 'inline').lower()
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '0'))
+JOB_RELAY_INTERVAL = 0.5
+job_store: Optional[JobStore] = None
+worker_processes = []
+
+# Opt-in cache of finished runs; TASK_CACHE_ENABLED turns it on by default, `use_cache` overrides per task
+TASK_CACHE_ENABLED = os.getenv('TASK_CACHE_ENABLED', 'false').lower() == 'true'
+task_cache = TaskResultCache(
+    max_entries=int(os.getenv('TASK_CACHE_MAX_ENTRIES', '256')),
+    ttl=float(os.getenv('TASK_CACHE_TTL', '3600')),
+    path=os.getenv('TASK_CACHE_PATH') or None,
+)
+
+# Opt-in page-state diffing: after a page's first snapshot the LLM gets only what changed (`dom_diff` per task)
+DOM_DIFF_ENABLED = os.getenv('DOM_DIFF_ENABLED', 'false').lower() == 'true'
+
+# Opt-in parallel tab exploration: the agent may open up to PARALLEL_TABS links at once (`parallel_tabs` per task)
+PARALLEL_TABS_ENABLED = os.getenv('PARALLEL_TABS_ENABLED', 'false').lower() == 'true'
+PARALLEL_TABS = int(os.getenv('PARALLEL_TABS', '4'))
+
+# Browser extension (static/popup.js): page text cached per URL for /generate, and one long-lived
+# browser for /run-gemini whose open tabs are reused (EXTENSION_CDP_URL attaches to the user's Chrome)
+page_contexts = PageContextCache(
+    max_entries=int(os.getenv('PAGE_CONTEXT_CACHE_SIZE', '128')),
+    ttl=float(os.getenv('PAGE_CONTEXT_TTL', '900')),
+)
+PAGE_CONTEXT_MAX_CHARS = int(os.getenv('PAGE_CONTEXT_MAX_CHARS', '6000'))
+PAGE_FETCH_MAX_CHARS = 60000
+PAGE_FETCH_TIMEOUT = float(os.getenv('PAGE_FETCH_TIMEOUT', '15'))
+EXTENSION_CDP_URL = os.getenv('EXTENSION_CDP_URL') or None
+EXTENSION_HEADLESS = os.getenv('EXTENSION_HEADLESS', 'false').lower() == 'true'
+EXTENSION_MAX_STEPS = int(os.getenv('EXTENSION_MAX_STEPS', '50'))
+EXTENSION_ORIGINS = os.getenv('EXTENSION_ORIGINS', r'^(chrome|moz)-extension://.*$')
+extension_browser: Optional['Browser'] = None
+extension_context: Optional['TabReusingContext'] = None
+extension_lock = asyncio.Lock()
+
+# Point-in-time gauges, refreshed on every /metrics scrape
+RUNNING_AGENTS = metrics.registry.gauge('siteguide_running_agents', 'Agents currently running.')
+POOL_BROWSERS = metrics.registry.gauge('siteguide_pool_browsers', 'Browsers in the warm pool.', ['state'])
+TASK_CACHE_ENTRIES = metrics.registry.gauge('siteguide_task_cache_entries', 'Entries in the task result cache.')
+
+# Opt-in action traces of successful runs, replayed without the LLM on later runs of the same task template;
+# MACROS_ENABLED turns them on by default, `use_macros` overrides per task and MACROS=off disables them
+MACROS_ENABLED = os.getenv('MACROS_ENABLED', 'false').lower() == 'true'
+macro_store: Optional[MacroStore] = None
+
+# Run replays are rendered off the request path and served from disk (REPLAY_FORMAT=off disables them)
+replay_store: Optional[ReplayArtifactStore] = None
+
+# Per-task compressed conversation logs, written off the event loop (CONVERSATION_LOG=off disables them)
+conversation_log: Optional[ConversationLog] = None
+
+def open_stores():
+    """Open the on-disk stores and start the conversation log's writer; called from lifespan()."""
+    global auth_store, job_store, macro_store, replay_store, conversation_log
+    auth_store = get_auth_store(str(BASE_DIR / 'auth_state.db'))
+    job_store = get_job_store(str(BASE_DIR / 'jobs.db'))
+    macro_store = get_macro_store(str(BASE_DIR / 'macros.db'))
+    replay_store = get_replay_store(str(BASE_DIR / 'artifacts'))
+    conversation_log = get_conversation_log(str(BASE_DIR / 'conversations'))
+    if lazy_runtime.ready:
+        lazy_runtime.value.set_conversation_log(conversation_log)
+
+# browser-use, LangChain and the Gemini and Groq SDKs are imported on first use or by the background
+# warm-up, so the server is up (and answers /healthz) before they load. Missing API keys no longer stop
+# the process: /readyz reports them and the requests that need them get a 503.
+startup = StartupTimings(IMPORT_STARTED)
+
+def load_agent_runtime():
+    import agent_runtime
+    agent_runtime.set_login_handler(pause_for_login)
+    agent_runtime.set_conversation_log(conversation_log)
+    return agent_runtime
+
+def build_llm():
+    # Memoized; LLM_BACKEND=scripted runs offline
+    from llm import get_llm
+    return get_llm()
+
+def build_transcriber():
+    # The Groq client is only needed by the groq transcriber; TRANSCRIBER=stub runs offline
+    groq_client = None
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if groq_api_key and os.getenv('TRANSCRIBER', 'groq').lower() == 'groq':
+        from groq import Groq
+        groq_client = Groq(api_key=groq_api_key)
+    return get_transcriber(groq_client)
+
+lazy_runtime = LazyComponent('agent_runtime', load_agent_runtime)
+lazy_llm = LazyComponent('llm', build_llm)
+lazy_transcriber = LazyComponent('transcriber', build_transcriber)
+
+# Built in the background at startup: any of runtime, llm, transcriber, browsers (the warm pool, when
+# BROWSER_POOL_SIZE > 0), or off. The pool is warmed by default so the first task doesn't wait on Chromium.
+WARMUP = [name.strip() for name in os.getenv('WARMUP', 'runtime,llm,transcriber,browsers').lower().split(',')
+          if name.strip() and name.strip() != 'off']
+warmup_task: Optional[asyncio.Task] = None
+browser_warmup = {'state': 'lazy'}
+
+
+def wants_cache(value: Optional[str]) -> bool:
+    """Resolve the per-task `use_cache` flag against the server default."""
+    if value is None or value == '':
+        return TASK_CACHE_ENABLED
+    return value == 'true'
+
+def wants_macros(value: Optional[str]) -> bool:
+    """Resolve the per-task `use_macros` flag against the server default."""
+    if macro_store is None:
+        return False
+    if value is None or value == '':
+        return MACROS_ENABLED
+    return value == 'true'
+
+def wants_dom_diff(value: Optional[str]) -> bool:
+    """Resolve the per-task `dom_diff` flag against the server default."""
+    if value is None or value == '':
+        return DOM_DIFF_ENABLED
+    return value == 'true'
+
+def parallel_tab_limit(value: Optional[str]) -> int:
+    """Resolve the per-task `parallel_tabs` setting ('true', 'false' or a fan-out) to a fan-out limit; 0 is off."""
+    if value is None or value == '':
+        return PARALLEL_TABS if PARALLEL_TABS_ENABLED else 0
+    if value.isdigit():
+        return min(int(value), PARALLEL_TABS)
+    return PARALLEL_TABS if value == 'true' else 0
+
+def get_session_id(request: Request, form=None) -> str:
+    """Read the caller's session ID from the form or query string."""
+    return (form.get('session_id') if form else None) or request.query_params.get('session_id') or DEFAULT_SESSION_ID
+
+def track_task(coro) -> asyncio.Task:
+    """Start a background task on the server loop and keep it until it finishes."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def send_agent_message(session: AgentSession, message: str):
+    """Add a message to the session's queue for polling by the frontend."""
+    session.send_message(message)
+
+def announce_replay(session: AgentSession, task_id: str, record: dict):
+    """Tell the frontend where the finished replay of a run can be fetched."""
+    if 'encode_seconds' in record:
+        metrics.observe('replay_encode', record['encode_seconds'], metrics.timelines.get(task_id), frames=record.get('frames'))
+    if record.get('status') == 'ready':
+        send_agent_message(session, f"/artifacts/{task_id}")
+    else:
+        send_agent_message(session, "Task completed, but the replay could not be generated.")
+
+async def pause_for_login(domain: str, reason: str, browser: 'BrowserContext'):
+    """Pause the chat session whose agent hit a login and ask the user how to proceed."""
+    batch_item = batch_items.get(id(browser))
+    if batch_item is not None:
+        # Batch items have nobody to ask; stop the item and report it as needing a login
+        batch_item['login_domain'] = domain
+        batch_item['agent'].stop()
         return
+
+    session = session_manager.find_by_browser_context(browser)
+    if not session or not session.agent:
+        logger.error("No session owns this browser context. Cannot pause task.")
+        return
+
+    domain_key = normalize_domain(domain)
+    if keeps_logins(session) and domain_key:
+        if domain_key in session.restored_domains:
+            # We are back at a login wall after loading the saved login: it no longer works
+            logger.info(f"Saved login for {domain_key} was rejected; discarding it.")
+            auth_store.invalidate(session.session_id, domain_key)
+            session.restored_domains.discard(domain_key)  # Save the fresh login once the user has logged in
+        elif await restore_login(session, browser, domain_key):
+            page = await browser.get_current_page()
+            await page.reload()
+            return (f"A saved login session for {domain} was restored and the page reloaded. "
+                    f"Check whether you are logged in now; only call Handle Login again if the login form is still shown.")
+    session.auth_domains.add(domain_key)
     
-    login_domain = domain
-    original_agent.pause()  # Use Agent.pause() from browser-use
-    awaiting_continue = True
-    awaiting_credentials = False
-    is_task = False  # Expecting login-related input, not a task
-    logger.info(f"Task paused for {domain}. Awaiting user login choice.")
+    session.login_domain = domain
+    session.had_login = True  # Runs behind a login are personal; never serve them from the cache
+    session.agent.pause()  # Use Agent.pause() from browser-use
+    session.awaiting_continue = True
+    session.awaiting_credentials = False
+    session.is_task = False  # Expecting login-related input, not a task
+    logger.info(f"Task paused for {domain} in session {session.session_id}. Awaiting user login choice.")
     
     # Send message to the chat interface via queue (polled by frontend)
-    send_agent_message(f"Agent has been paused. Would you like to provide your credentials to the agent? Type 'yes', 'no', or 'exit' in the chat.")
+    send_agent_message(session, f"Agent has been paused. Would you like to provide your credentials to the agent? Type 'yes', 'no', or 'exit' in the chat.")
 
-@app.route('/', methods=['GET'])
-def index():
-    return render_template('index.html')
+def keeps_logins(session: AgentSession) -> bool:
+    """Whether the session's logins are saved and restored: only for sessions with their own ID.
 
-@app.route('/run_task', methods=['POST'])
-async def run_task():
-    global original_agent, awaiting_continue, login_domain, awaiting_credentials, is_task
+    Clients that send no session ID all share the default session, so a login saved
+    there would be handed to every one of them.
+    """
+    return auth_store is not None and session.session_id != DEFAULT_SESSION_ID
+
+async def restore_login(session: AgentSession, browser_context: 'BrowserContext', domain: str) -> bool:
+    """Load the session's own saved login for `domain` into its browser, if there is one."""
+    state = auth_store.load(session.session_id, domain)
+    if not state:
+        return False
     try:
-        task = request.form.get('task')
-        audio_data = request.form.get('audioData')
-        headless = request.form.get('headless') == 'true'
-        use_vision = request.form.get('vision') == 'true'
+        await apply_state(browser_context, state)
+    except Exception as e:
+        logger.error(f"Failed to restore saved login for {domain}: {str(e)}")
+        return False
+    session.restored_domains.add(domain)
+    session.had_login = True  # Logged-in results are personal; keep them out of the task cache
+    logger.info(f"Restored saved login for {domain} in session {session.session_id}.")
+    send_agent_message(session, f"Using your saved login for {domain}.")
+    return True
 
-        logger.info(f"Task: {task}, Audio: {'Yes' if audio_data else 'No'}, Headless: {headless}, Vision: {use_vision}")
+async def save_logins(session: AgentSession, browser_context: 'BrowserContext'):
+    """Store the login state of every domain the user logged into during a successful run."""
+    for domain in session.auth_domains - session.restored_domains:
+        try:
+            state = await capture_state(browser_context, domain)
+        except Exception as e:
+            logger.error(f"Failed to capture login state for {domain}: {str(e)}")
+            continue
+        if state:
+            await asyncio.to_thread(auth_store.save, session.session_id, domain, state)
+            logger.info(f"Saved login state for {domain} ({len(state['cookies'])} cookies).")
+
+async def load_components(session: Optional[AgentSession], timeline: Optional[metrics.TaskTimeline], *components: LazyComponent) -> Optional[list]:
+    """Values of the lazily built components a request needs; None (after telling the session) if one cannot be built.
+
+    A cold build shows up as a 'runtime_load' span in the task's timeline.
+    """
+    if all(component.ready for component in components):
+        return [component.value for component in components]
+    try:
+        with metrics.span('runtime_load', timeline):
+            return [await component.get() for component in components]
+    except Exception as e:
+        if session:
+            send_agent_message(session, f"Error: the server is not fully configured ({str(e)}).")
+        return None
+
+async def warm_up():
+    """Build the WARMUP components ahead of the first task, without holding up startup."""
+    components = {'runtime': lazy_runtime, 'llm': lazy_llm, 'transcriber': lazy_transcriber}
+    for name in WARMUP:
+        if name in components:
+            await components[name].warm()
+        elif name == 'browsers':
+            if browser_pool.size == 0:
+                continue  # No pool; every task launches its own browser
+            browser_warmup['state'] = 'building'
+            start = time.perf_counter()
+            if await lazy_runtime.warm():
+                await browser_pool.start()
+            pool_stats = browser_pool.stats()
+            browser_warmup.update(state='ready' if pool_stats['browsers'] else 'failed', build_seconds=round(time.perf_counter() - start, 4),
+                                  browsers=pool_stats['browsers'])
+        else:
+            logger.warning(f"Unknown WARMUP component: {name}")
+    logger.info(f"Warm-up finished {startup.mark('warm')}s after import started.")
+
+async def healthz(request: Request):
+    """Liveness: the process is up and its event loop is responsive."""
+    return JSONResponse({'status': 'ok', 'uptime_seconds': startup.uptime()})
+
+async def readyz(request: Request):
+    """Readiness: 503 while the warm-up runs or when a component (e.g. the LLM without its API key) failed to build."""
+    components = {component.name: component.status() for component in (lazy_runtime, lazy_llm, lazy_transcriber)}
+    if 'browsers' in WARMUP and browser_pool.size > 0:
+        components['browsers'] = browser_warmup
+    warming_up = warmup_task is not None and not warmup_task.done()
+    failed = [name for name, status in components.items() if status['state'] == 'failed']
+    ready = not warming_up and not failed
+    return JSONResponse({
+        'ready': ready,
+        'warming_up': warming_up,
+        'failed': failed,
+        'components': components,
+        'startup_seconds': startup.milestones,
+    }, status_code=200 if ready else 503)
+
+async def index(request: Request):
+    return templates.TemplateResponse(request, 'index.html')
+
+async def run_task(request: Request):
+    form = await request.form()
+    session = session_manager.get(get_session_id(request, form))
+    try:
+        task = form.get('task')
+        audio_data = form.get('audioData')
+        headless = form.get('headless') == 'true'
+        use_vision = form.get('vision') == 'true'
+        use_cache = wants_cache(form.get('use_cache'))
+        dom_diff = wants_dom_diff(form.get('dom_diff'))
+        parallel_tabs = parallel_tab_limit(form.get('parallel_tabs'))
+        use_macros = wants_macros(form.get('use_macros'))
+        try:
+            block_resources = resolve_blocked_types(form.get('block_resources'), use_vision)
+        except ValueError as e:
+            send_agent_message(session, f"Error: {str(e)}")
+            return Response(status_code=400)
+
+        logger.info(f"Session: {session.session_id}, Task: {task}, Audio: {'Yes' if audio_data else 'No'}, Headless: {headless}, Vision: {use_vision}")
 
         # Handle exit command at any time
         if task and task.lower() == "exit":
-            if original_agent:
-                logger.info("Stopping active agent due to 'exit' command.")
-                original_agent.stop()  # Use Agent.stop() from browser-use to terminate the agent
-                await cleanup_agent()  # Clean up the agent and browser
-                send_agent_message("Agent stopped and exited. No task is active.")
-                is_task = True  # Reset to expect tasks for the next input
-                return '', 204
+            if session.job_id and session.is_running():
+                status = await asyncio.to_thread(job_store.cancel, session.job_id)
+                send_agent_message(session, "Job cancelled." if status == CANCELLED else "Stopping the queued job...")
+                return Response(status_code=204)
+            if session.agent:
+                logger.info(f"Stopping active agent in session {session.session_id} due to 'exit' command.")
+                session.agent.stop()  # Use Agent.stop() from browser-use to terminate the agent
+                await cleanup_agent(session)  # Clean up the agent and browser
+                send_agent_message(session, "Agent stopped and exited. No task is active.")
+                return Response(status_code=204)
             else:
-                send_agent_message("No active agent to exit.")
-                return '', 400
+                send_agent_message(session, "No active agent to exit.")
+                return Response(status_code=400)
 
         # Handle login/continue responses (not a task)
-        if not is_task:
-            if awaiting_continue and task and task.lower() == "yes":
-                awaiting_continue = False
-                awaiting_credentials = True
-                is_task = False
-                send_agent_message(f"Please provide your email/username and password for {login_domain} in the format: 'email password'.")
-                return '', 204
-            elif awaiting_continue and task and task.lower() == "no":
-                awaiting_continue = False
-                is_task = False
-                send_agent_message("Please manually log in and type 'continue' or 'exit' in the chat to resume or stop.")
-                return '', 204
-            elif awaiting_credentials and task and " " in task:
-                awaiting_credentials = False
-                awaiting_continue = False
-                is_task = False
+        if not session.is_task:
+            if session.awaiting_continue and task and task.lower() == "yes":
+                session.awaiting_continue = False
+                session.awaiting_credentials = True
+                send_agent_message(session, f"Please provide your email/username and password for {session.login_domain} in the format: 'email password'.")
+                return Response(status_code=204)
+            elif session.awaiting_continue and task and task.lower() == "no":
+                send_agent_message(session, "Please manually log in and type 'continue' or 'exit' in the chat to resume or stop.")
+                return Response(status_code=204)
+            elif session.awaiting_credentials and task and " " in task:
+                session.awaiting_credentials = False
+                session.awaiting_continue = False
                 email, password = task.split(" ", 1)
-                email_placeholder = f"{login_domain}_email"
-                password_placeholder = f"{login_domain}_password"
-                original_agent.sensitive_data = {
+                email_placeholder = f"{session.login_domain}_email"
+                password_placeholder = f"{session.login_domain}_password"
+                session.agent.sensitive_data = {
                     email_placeholder: email,  # Plain string
                     password_placeholder: password,  # Plain string
                 }
@@ -195,159 +442,972 @@ async def run_task():
                     f"2. Input <secret>{password_placeholder}</secret> into the password field. "
                     "3. Attempt to login"
                 )
-                original_agent.add_new_task(login_task)
-                original_agent.resume()  # Resume the agent to run the login task
-                send_agent_message("Credentials received. Attempting to log in automatically...")
-                return '', 204
-            elif awaiting_continue and task and task.lower() == "continue":
-                if original_agent:
-                    logger.info("Resuming paused agent after manual login.")
-                    original_agent.resume()  # Use Agent.resume() from browser-use
-                    awaiting_continue = False
-                    login_domain = ""
-                    is_task = False
-                    send_agent_message("Agent resumed. Continuing task...")
-                    return '', 204
+                session.agent.add_new_task(login_task)
+                session.agent.resume()  # Resume the agent to run the login task
+                send_agent_message(session, "Credentials received. Attempting to log in automatically...")
+                return Response(status_code=204)
+            elif session.awaiting_continue and task and task.lower() == "continue":
+                if session.agent:
+                    logger.info(f"Resuming paused agent in session {session.session_id} after manual login.")
+                    session.agent.resume()  # Use Agent.resume() from browser-use
+                    session.awaiting_continue = False
+                    session.login_domain = ""
+                    send_agent_message(session, "Agent resumed. Continuing task...")
+                    return Response(status_code=204)
                 else:
-                    send_agent_message("No paused agent to resume.")
-                    return '', 400
+                    send_agent_message(session, "No paused agent to resume.")
+                    return Response(status_code=400)
             else:
-                send_agent_message("Invalid response. Please type 'yes', 'no', 'continue', or 'exit', or provide credentials as 'email password'.")
-                return '', 400
+                send_agent_message(session, "Invalid response. Please type 'yes', 'no', 'continue', or 'exit', or provide credentials as 'email password'.")
+                return Response(status_code=400)
 
-        # Handle audio transcription if provided
+        busy = check_can_start(session)
+        if busy:
+            return busy
+
+        timeline = metrics.timelines.start(uuid.uuid4().hex)
+
+        # Handle audio transcription if provided (base64 data URL form field)
         if audio_data:
+            loaded = await load_components(session, timeline, lazy_transcriber)
+            if loaded is None:
+                return Response(status_code=503)
+            transcriber, = loaded
             try:
-                with tempfile.NamedTemporaryFile(suffix=".m4a", delete=True) as temp_audio_file:
-                    audio_bytes = base64.b64decode(audio_data.split(',')[1])
-                    temp_audio_file.write(audio_bytes)
-                    temp_audio_file.flush()
-                    temp_audio_file.seek(0)  # Rewind to read from the start
-                    transcription_response = await asyncio.to_thread(
-                        groq_client.audio.transcriptions.create,
-                        file=(temp_audio_file.name, temp_audio_file.read()),
-                        model="whisper-large-v3",
-                        response_format="verbose_json"
-                    )
-                    send_agent_message("transcribed text: " + transcription_response.text)
-                    task = transcription_response.text if transcription_response and hasattr(transcription_response, 'text') else None
-                    if task is None:
-                        logger.error("Transcription failed: No text returned from Groq API")
-                        send_agent_message("Error: Failed to transcribe audio. Please check your audio input and try again.")
-                        return '', 400
-            except base64.binascii.Error as e:
+                audio_bytes = base64.b64decode(audio_data.split(',')[1])
+                with metrics.span('transcription', timeline):
+                    task = await transcriber.transcribe_segment(audio_bytes, "audio.m4a")
+                send_agent_message(session, "transcribed text: " + task)
+            except (base64.binascii.Error, IndexError) as e:
                 logger.error(f"Invalid audio data format: {str(e)}")
-                send_agent_message("Error: Invalid audio data format. Ensure the audio is in m4a format.")
-                return '', 400
+                send_agent_message(session, "Error: Invalid audio data format. Ensure the audio is in m4a format.")
+                return Response(status_code=400)
+            except ValueError as e:
+                logger.error(f"Transcription failed: {str(e)}")
+                send_agent_message(session, "Error: Failed to transcribe audio. Please check your audio input and try again.")
+                return Response(status_code=400)
             except Exception as e:
                 logger.error(f"Transcription failed: {str(e)}")
-                send_agent_message(f"Error transcribing audio: {str(e)}")
-                return '', 500
+                send_agent_message(session, f"Error transcribing audio: {str(e)}")
+                return Response(status_code=500)
 
         if not task:
-            send_agent_message("Error: No task or audio provided.")
-            return '', 400
+            send_agent_message(session, "Error: No task or audio provided.")
+            return Response(status_code=400)
 
-        # Normal task processing (initialize and run a new agent)
-        try:
-            browser_config = BrowserConfig(
-                headless=False if os.name == 'nt' else headless,  # Disable headless on Windows for debugging
-                disable_security=True
-            )
-            browser = Browser(config=browser_config)
-        except Exception as e:
-            logger.error(f"Failed to initialize browser: {str(e)}")
-            send_agent_message(f"Error initializing browser: {str(e)}")
-            return '', 500
-
-        browser_context = BrowserContext(browser=browser, config=BrowserContextConfig())
-        original_agent = Agent(
-            task=task,
-            llm=llm,
-            browser=browser,
-            browser_context=browser_context,
-            controller=controller,
-            save_conversation_path=os.path.join(os.getcwd(), 'output.txt'),
-            generate_gif=True,
-            system_prompt_class=CustomSystemPrompt,
-        )
+        return await start_agent_task(session, task, headless, use_vision, transcribed=bool(audio_data), use_cache=use_cache,
+                                      dom_diff=dom_diff, parallel_tabs=parallel_tabs, block_resources=block_resources,
+                                      use_macros=use_macros, timeline=timeline)
+
+    except Exception as e:
+        logger.error(f"Error in run_task: {str(e)}")
+        send_agent_message(session, f"Internal Server Error: {str(e)}")
+        return Response(status_code=500)
+
+async def upload_audio(request: Request):
+    """Take a streamed audio upload, transcribe it segment by segment and run it as a task.
+
+    The body is either raw audio or multipart/form-data with one file part per
+    self-contained recording segment. Partial transcripts are sent to the chat as
+    each segment finishes, before the rest of the upload has been processed.
+    """
+    session = session_manager.get(get_session_id(request))
+    headless = request.query_params.get('headless') == 'true'
+    use_vision = request.query_params.get('vision') == 'true'
+    use_cache = wants_cache(request.query_params.get('use_cache'))
+    dom_diff = wants_dom_diff(request.query_params.get('dom_diff'))
+    parallel_tabs = parallel_tab_limit(request.query_params.get('parallel_tabs'))
+    use_macros = wants_macros(request.query_params.get('use_macros'))
+    try:
+        block_resources = resolve_blocked_types(request.query_params.get('block_resources'), use_vision)
+    except ValueError as e:
+        send_agent_message(session, f"Error: {str(e)}")
+        return Response(status_code=400)
+
+    if not session.is_task:
+        send_agent_message(session, "The agent is waiting for a typed reply ('yes', 'no', 'continue' or 'exit').")
+        return Response(status_code=409)
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > AUDIO_UPLOAD_MAX_BYTES:
+        send_agent_message(session, f"Error: Upload is larger than {AUDIO_UPLOAD_MAX_BYTES} bytes.")
+        return Response(status_code=413)
+    busy = check_can_start(session)
+    if busy:
+        return busy
+
+    timeline = metrics.timelines.start(uuid.uuid4().hex)
+    loaded = await load_components(session, timeline, lazy_transcriber)
+    if loaded is None:
+        return Response(status_code=503)
+    transcriber, = loaded
+    texts = []
+    try:
+        segments = iter_audio_segments(request.headers.get('content-type', ''), request.stream(), max_bytes=AUDIO_UPLOAD_MAX_BYTES)
+        with metrics.span('transcription', timeline):
+            async for text in transcriber.transcribe_stream(segments):
+                texts.append(text)
+                send_agent_message(session, f"transcribed text (part {len(texts)}): {text}")
+    except UploadTooLarge as e:
+        logger.error(f"Audio upload rejected: {str(e)}")
+        send_agent_message(session, f"Error: {str(e)}.")
+        return Response(status_code=413)
+    except ValueError as e:
+        logger.error(f"Transcription failed: {str(e)}")
+        send_agent_message(session, "Error: Failed to transcribe audio. Please check your audio input and try again.")
+        return Response(status_code=400)
+    except Exception as e:
+        logger.error(f"Transcription failed: {str(e)}")
+        send_agent_message(session, f"Error transcribing audio: {str(e)}")
+        return Response(status_code=500)
+
+    task = " ".join(text for text in texts if text).strip()
+    if not task:
+        send_agent_message(session, "Error: No speech found in the uploaded audio.")
+        return Response(status_code=400)
+    send_agent_message(session, "transcribed text: " + task)
+    return await start_agent_task(session, task, headless, use_vision, transcribed=True, use_cache=use_cache,
+                                  dom_diff=dom_diff, parallel_tabs=parallel_tabs, block_resources=block_resources,
+                                  use_macros=use_macros, timeline=timeline)
+
+def check_can_start(session: AgentSession) -> Optional[Response]:
+    """Return an error response if the session cannot start a new agent right now."""
+    if session.is_running():
+        send_agent_message(session, "An agent is already running in this session. Type 'exit' to stop it first.")
+        return Response(status_code=409)
+    if TASK_EXECUTION != 'queue' and session_manager.at_capacity():  # Queued jobs just wait their turn
+        send_agent_message(session, "Server is busy running other agents. Please try again shortly.")
+        return Response(status_code=429)
+    return None
+
+async def start_agent_task(session: AgentSession, task: str, headless: bool, use_vision: bool, transcribed: bool = False,
+                           use_cache: bool = False, dom_diff: bool = False, parallel_tabs: int = 0,
+                           block_resources: Optional[List[str]] = None, use_macros: bool = False,
+                           timeline: Optional[metrics.TaskTimeline] = None) -> Response:
+    """Build an agent for `task` in the session and run it in the background.
+
+    With `use_cache`, a stored result for the same normalized task and flags is
+    returned straight away instead of running the agent. With `dom_diff`, the agent
+    sends page state as changes against a per-page snapshot. With `parallel_tabs`, it
+    can explore up to that many links at once in extra tabs. `block_resources` are the
+    resource types its browser does not load (None loads everything). With `use_macros`, a
+    recorded macro for the task is replayed first and successful runs are recorded. Phase timings go to
+    `timeline` (a new one if not given), retrievable under /tasks/<task_id>/timeline.
+    """
+    busy = check_can_start(session)
+    if busy:
+        return busy
+    timeline = timeline or metrics.timelines.start(uuid.uuid4().hex)
+    task_id = timeline.task_id
+
+    headless = False if os.name == 'nt' else headless  # Disable headless on Windows for debugging
+    if use_cache:
+        cached = await asyncio.to_thread(task_cache.get, task, headless, use_vision)
+        loaded = await load_components(session, timeline, lazy_runtime) if cached else None
+        if loaded:
+            logger.info(f"Task cache hit for session {session.session_id}: {task}")
+            result = loaded[0].format_result(cached['final_result'], cached['urls'])
+            send_agent_message(session, result + "\n(Served from cache)")
+            metrics.TASKS_TOTAL.inc(outcome='cached')
+            timeline.finish('cached')
+            return JSONResponse({'cached': True, 'final_result': cached['final_result'], 'urls': cached['urls']})
+
+    if TASK_EXECUTION == 'queue':
+        return await enqueue_session_task(session, task, headless, use_vision, use_cache, dom_diff, parallel_tabs,
+                                          block_resources, use_macros)
+
+    loaded = await load_components(session, timeline, lazy_runtime, lazy_llm)
+    if loaded is None:
+        metrics.TASKS_TOTAL.inc(outcome='failed')
+        timeline.finish('failed')
+        return Response(status_code=503)
+    runtime, llm = loaded
+    from browser_use import Browser, BrowserConfig
+    from browser_use.browser.context import BrowserContext, BrowserContextConfig
+
+    # Normal task processing (check out a warm browser, or launch one when headed)
+    lease = None
+    try:
+        with metrics.span('browser_acquire', timeline, pooled=headless and browser_pool.size > 0):
+            if headless and browser_pool.size > 0:
+                lease = await browser_pool.acquire()
+                browser, browser_context = lease.browser, lease.context
+            else:
+                browser_config = BrowserConfig(
+                    headless=headless,
+                    disable_security=True
+                )
+                browser = Browser(config=browser_config)
+                browser_context = BrowserContext(browser=browser, config=BrowserContextConfig())
+    except Exception as e:
+        logger.error(f"Failed to initialize browser: {str(e)}")
+        send_agent_message(session, f"Error initializing browser: {str(e)}")
+        metrics.TASKS_TOTAL.inc(outcome='failed')
+        timeline.finish('failed')
+        return Response(status_code=500)
+
+    session.lease = lease
+    session.task_id = task_id
+    try:
+        macro = await asyncio.to_thread(macro_store.find, task) if use_macros else None
+        session.agent = runtime.build_agent(task, llm, browser, browser_context, use_vision=use_vision, dom_diff=dom_diff,
+                                            task_id=task_id, parallel_tabs=parallel_tabs, block_resources=block_resources,
+                                            macro=macro)
+        if keeps_logins(session):
+            # Log in up front on sites named in the task, before the agent ever meets the login wall
+            for domain in dict.fromkeys(normalize_domain(url) for url in extract_urls(task)):
+                if domain:
+                    await restore_login(session, browser_context, domain)
+
+        # Run the agent in the background and send updates via polling
+        agent = session.agent
 
+        async def run_agent():
+            metrics.current_timeline.set(timeline)  # Spans from the agent's steps and LLM calls land here
+            outcome = 'failed'
+            try:
+                with metrics.span('agent_run'):
+                    history = await agent.run()
+                outcome = 'completed' if history.is_done() else 'incomplete'
+                final_result = history.final_result() or "No result returned."
+                urls = [url for url in history.urls() if url]
+                result = runtime.format_result(final_result, urls)
+                diff_stats = agent.dom_diff_stats()
+                if diff_stats:
+                    logger.info(f"Page-state diffing in session {session.session_id}: {diff_stats}")
+                network_stats = agent.network_stats()
+                if network_stats:
+                    logger.info(f"Resource blocking in session {session.session_id}: {network_stats}")
+                if use_cache and history.is_done() and history.is_successful() is not False and not session.had_login:
+                    await asyncio.to_thread(task_cache.put, task, headless, use_vision, final_result, urls)
+                if keeps_logins(session) and session.auth_domains and history.is_done() and history.is_successful() is not False:
+                    await save_logins(session, browser_context)
+                if use_macros:
+                    # Like the result cache, runs behind a login are personal and never recorded
+                    succeeded = history.is_done() and history.is_successful() is not False and not session.had_login
+                    await asyncio.to_thread(macro_store.complete, task, history, agent.macro_replay, succeeded)
+                    if agent.macro_replay:
+                        result += f"\n[Agent] Replayed {agent.macro_replay['replayed']} of {agent.macro_replay['steps']} recorded steps."
+                if transcribed:
+                    result += f"\n[Agent] Transcribed: {task}"
+                send_agent_message(session, result)
+                
+                # Queue the replay; its link is sent once the worker has written it
+                if history.is_done() and replay_store:
+                    replay_store.submit(task_id, history, on_ready=lambda ready_id, record: announce_replay(session, ready_id, record))
+            except Exception as e:
+                logger.error(f"Agent run failed: {str(e)}")
+                send_agent_message(session, f"Error processing task: {str(e)}")
+            finally:
+                metrics.TASKS_TOTAL.inc(outcome=outcome)
+                timeline.finish(outcome)
+                if conversation_log:
+                    conversation_log.finish(task_id)
+                # Hand the browser back to the pool (or close it) once the run is over
+                if session.agent is agent:
+                    await cleanup_agent(session)
+
+        # Run the agent in the background
+        session.run = track_task(run_agent())
+        
+        # Return immediately with no content to keep the frontend responsive
+        return Response(status_code=204)
+    except Exception as e:
+        logger.error(f"Error in task setup: {str(e)}")
+        send_agent_message(session, f"Error setting up task: {str(e)}")
+        if session.agent:
+            await cleanup_agent(session)
+        else:
+            # Failed before there was an agent for cleanup_agent to go through; hand the browser back here
+            session.lease = None
+            try:
+                if lease:
+                    await browser_pool.release(lease)
+                else:
+                    await browser_context.close()
+                    await browser.close()
+            except Exception as e:
+                logger.error(f"Cleanup failed: {str(e)}")
+        metrics.TASKS_TOTAL.inc(outcome='failed')
+        timeline.finish('failed')
+        return Response(status_code=500)
+
+async def run_batch(request: Request):
+    """Run a list of tasks in parallel and stream each result as an NDJSON line, then a summary.
+
+    Body (JSON): `tasks` (list of task strings) or `template` + `urls` (with `{url}` in the
+    template), plus optional `parallelism`, `vision`, `use_cache`, `dom_diff`, `parallel_tabs`,
+    `block_resources` and `use_macros`. Items always run headless, each as its own agent in its own
+    browser context on the shared browsers.
+    """
+    try:
+        data = await request.json()
+        tasks = expand_tasks(data, BATCH_MAX_ITEMS)
+        parallelism = max(1, min(int(data.get('parallelism') or BATCH_MAX_PARALLELISM), BATCH_MAX_PARALLELISM))
+        use_vision = str(data.get('vision', 'false')).lower() == 'true'
+        block_resources = resolve_blocked_types(None if data.get('block_resources') is None else str(data['block_resources']),
+                                                use_vision)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    use_cache = wants_cache(None if data.get('use_cache') is None else str(data['use_cache']).lower())
+    dom_diff = wants_dom_diff(None if data.get('dom_diff') is None else str(data['dom_diff']).lower())
+    parallel_tabs = parallel_tab_limit(None if data.get('parallel_tabs') is None else str(data['parallel_tabs']).lower())
+    use_macros = wants_macros(None if data.get('use_macros') is None else str(data['use_macros']).lower())
+    if await load_components(None, None, lazy_runtime, lazy_llm) is None:
+        return JSONResponse({'error': lazy_runtime.error or lazy_llm.error}, status_code=503)
+    from browser_use import Browser, BrowserConfig
+    logger.info(f"Batch of {len(tasks)} tasks, parallelism {parallelism}")
+
+    async def generate():
+        # Without a warm pool, the batch still shares one browser process across its items
+        shared_browser = Browser(config=BrowserConfig(headless=True, disable_security=True)) if browser_pool.size == 0 else None
+        started = time.perf_counter()
+        results = []
         try:
-            # Run the agent in the background and send updates via polling
-            async def run_agent():
+            yield json.dumps({'batch': {'items': len(tasks), 'parallelism': parallelism}}) + '\n'
+            if shared_browser:
+                # Launch it here, once: browser-use doesn't lock the launch, so concurrent items would
+                # each start a Chromium and all but the last would be left running
                 try:
-                    history = await original_agent.run()
-                    final_result = history.final_result() or "No result returned."
-                    urls = "\nURLs visited:\n" + "\n".join(history.urls())
-                    result = f"Final Result:\n{final_result}\n{urls}"
-                    if audio_data:
-                        result += f"\n[Agent] Transcribed: {task}"
-                    send_agent_message(result)
-                    
-                    # Check if the task completed successfully and GIF exists
-                    if history.is_done():
-                        gif_path = os.path.join(os.getcwd(), "agent_history.gif")
-                        if os.path.exists(gif_path):
-                            gif_base64 = encode_gif_to_base64(gif_path)
-                            send_agent_message(gif_base64)  # Send base64-encoded GIF as a message
-                        else:
-                            logger.warning("agent_history.gif not found after task completion.")
-                            send_agent_message("Task completed, but GIF generation failed or not found.")
+                    with metrics.span('browser_launch'):
+                        await shared_browser.get_playwright_browser()
                 except Exception as e:
-                    logger.error(f"Agent run failed: {str(e)}")
-                    send_agent_message(f"Error processing task: {str(e)}")
-
-            # Run the agent in the background
-            asyncio.create_task(run_agent())
-            
-            # Return immediately with no content to keep the frontend responsive
-            is_task = True  # Reset to expect tasks for the next input
-            return '', 204
-        except Exception as e:
-            logger.error(f"Error in task setup: {str(e)}")
-            send_agent_message(f"Error setting up task: {str(e)}")
-            await cleanup_agent()
-            return '', 500
+                    logger.error(f"Failed to launch the batch browser: {str(e)}")
+                    yield json.dumps({'error': f"Could not launch a browser: {str(e)}"}) + '\n'
+                    return
+
+            async def run_item(index: int, task: str) -> dict:
+                return await run_batch_item(task, use_vision, use_cache, dom_diff, shared_browser, parallel_tabs, block_resources,
+                                            use_macros)
+
+            async for result in fan_out(tasks, run_item, parallelism):
+                results.append(result)
+                yield json.dumps(result) + '\n'
+            yield json.dumps({'summary': summarize(results, time.perf_counter() - started)}) + '\n'
         finally:
-            # Cleanup in a separate task to avoid blocking
-            async def cleanup():
-                await cleanup_agent()
-            asyncio.create_task(cleanup())
+            if shared_browser:
+                await shared_browser.close()
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+async def run_batch_item(task: str, use_vision: bool, use_cache: bool, dom_diff: bool, shared_browser: Optional['Browser'],
+                         parallel_tabs: int = 0, block_resources: Optional[List[str]] = None, use_macros: bool = False) -> dict:
+    """Run one batch task to completion and describe the outcome (run_batch has loaded the runtime and LLM)."""
+    from browser_use.browser.context import BrowserContext, BrowserContextConfig
+
+    timeline = metrics.timelines.start(uuid.uuid4().hex)
+    metrics.current_timeline.set(timeline)
+    if use_cache:
+        cached = await asyncio.to_thread(task_cache.get, task, True, use_vision)
+        if cached:
+            metrics.TASKS_TOTAL.inc(outcome='cached')
+            timeline.finish('cached')
+            return {'status': 'cached', 'task_id': timeline.task_id, 'final_result': cached['final_result'], 'urls': cached['urls']}
+
+    lease = None
+    with metrics.span('browser_acquire'):
+        if shared_browser is None:
+            lease = await browser_pool.acquire()
+            browser, browser_context = lease.browser, lease.context
+        else:
+            browser = shared_browser
+            browser_context = BrowserContext(browser=shared_browser, config=BrowserContextConfig())
+    timer = None
+    try:
+        # Everything after the acquire is inside the try, so a failed setup still hands the context back
+        macro = await asyncio.to_thread(macro_store.find, task) if use_macros else None
+        agent = lazy_runtime.value.build_agent(task, lazy_llm.value, browser, browser_context, use_vision=use_vision,
+                                               dom_diff=dom_diff, task_id=timeline.task_id, parallel_tabs=parallel_tabs,
+                                               block_resources=block_resources, macro=macro)
+        item = batch_items[id(browser_context)] = {'agent': agent, 'login_domain': None, 'timed_out': False}
+
+        def on_timeout():
+            item['timed_out'] = True
+            agent.stop()
+
+        timer = asyncio.get_running_loop().call_later(BATCH_ITEM_TIMEOUT, on_timeout)
+        with metrics.span('agent_run'):
+            history = await agent.run()
+    finally:
+        if timer:
+            timer.cancel()
+        batch_items.pop(id(browser_context), None)
+        if conversation_log:
+            conversation_log.finish(timeline.task_id)
+        try:
+            if lease:
+                await browser_pool.release(lease)
+            else:
+                await browser_context.close()
+        except Exception as e:
+            logger.error(f"Cleanup failed: {str(e)}")
+
+    final_result = history.final_result()
+    urls = [url for url in history.urls() if url]
+    if item['login_domain']:
+        status = 'login_required'
+    elif item['timed_out']:
+        status = 'timeout'
+    elif history.is_done():
+        status = 'succeeded' if history.is_successful() is not False else 'failed'
+    else:
+        status = 'incomplete'
+    if status == 'succeeded' and use_cache:
+        await asyncio.to_thread(task_cache.put, task, True, use_vision, final_result or "No result returned.", urls)
+    if use_macros:
+        await asyncio.to_thread(macro_store.complete, task, history, agent.macro_replay, status == 'succeeded')
+    metrics.TASKS_TOTAL.inc(outcome=status)
+    timeline.finish(status)
+    return {
+        'status': status,
+        'task_id': timeline.task_id,
+        'final_result': final_result,
+        'urls': urls,
+        'steps': history.number_of_steps(),
+        'login_domain': item['login_domain'],
+        'network': agent.network_stats(),
+        'macro': agent.macro_replay,
+    }
+
+async def load_page_context(url: str) -> dict:
+    """Fetch a page and reduce it to text, summarized by the LLM when it is too long for a prompt."""
+    import httpx
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    with metrics.span('page_fetch'):
+        async with httpx.AsyncClient(follow_redirects=True, timeout=PAGE_FETCH_TIMEOUT) as client:
+            response = await client.get(url, headers={'User-Agent': 'Mozilla/5.0 (SiteGuide)'})
+            response.raise_for_status()
+    page = html_to_text(response.text)
+    context = {'url': str(response.url), 'title': page['title'], 'text': page['text'][:PAGE_CONTEXT_MAX_CHARS], 'summary': None}
+    if len(page['text']) > PAGE_CONTEXT_MAX_CHARS:
+        llm = await lazy_llm.get()
+        with metrics.span('page_summary'):
+            summary = await llm.ainvoke([
+                SystemMessage(content=(
+                    "Summarize this web page for an assistant that automates tasks on it. Keep what a user could "
+                    "do there (sections, links, forms, buttons) and the key facts. At most 300 words."
+                )),
+                HumanMessage(content=f"Title: {page['title']}\nURL: {url}\n\n{page['text'][:PAGE_FETCH_MAX_CHARS]}"),
+            ])
+        context['summary'] = str(summary.content).strip()
+    return context
+
+async def generate_instruction(request: Request):
+    """Turn the extension user's prompt into one instruction for the agent, using the page they are on.
+
+    Body (JSON): `prompt` and `link` (the page's URL). The page's text, or its summary, is
+    cached per URL, so more prompts on the same page skip the fetch and summarization.
+    """
+    try:
+        data = await request.json()
+        prompt = str(data.get('prompt') or '').strip()
+        link = str(data.get('link') or '').strip()
+    except (ValueError, AttributeError):
+        return JSONResponse({'error': 'Expected a JSON object with `prompt` and `link`.'}, status_code=400)
+    if not prompt:
+        return JSONResponse({'error': 'No prompt provided.'}, status_code=400)
+    loaded = await load_components(None, None, lazy_llm)
+    if loaded is None:
+        return JSONResponse({'error': f"The LLM is unavailable: {lazy_llm.error}"}, status_code=503)
+    llm, = loaded
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    context = None
+    if urlsplit(link).scheme in ('http', 'https'):
+        try:
+            context = await page_contexts.get(link, load_page_context)
+        except Exception as e:
+            logger.error(f"Failed to load page context for {link}: {str(e)}")
+    page = ''
+    if context:
+        page = (f"The user is on {context['url']} (\"{context['title']}\").\n"
+                f"{'Page summary' if context['summary'] else 'Page text'}:\n{context['summary'] or context['text']}\n\n")
+    elif link:
+        page = f"The user is on {link}.\n\n"
+    try:
+        response = await llm.ainvoke([
+            SystemMessage(content=(
+                "You turn a user's request about the web page they are on into one clear, self-contained "
+                "instruction for a browser automation agent. Name the page URL, the elements to use and the "
+                "result to report. Reply with the instruction only."
+            )),
+            HumanMessage(content=f"{page}Request: {prompt}"),
+        ])
+    except Exception as e:
+        logger.error(f"Instruction generation failed: {str(e)}")
+        return JSONResponse({'error': f"Failed to generate an instruction: {str(e)}"}, status_code=502)
+    return JSONResponse({
+        'instruction': str(response.content).strip(),
+        'link': link,
+        'page_context': {'cached': context['cached'], 'title': context['title'], 'summarized': bool(context['summary'])} if context else None,
+    })
 
+async def get_extension_context() -> 'TabReusingContext':
+    """The extension's browser context, (re)launching or reattaching the browser when needed."""
+    global extension_browser, extension_context
+    from browser_use import Browser, BrowserConfig
+    from browser_use.browser.context import BrowserContextConfig
+
+    runtime = await lazy_runtime.get()
+    if extension_browser is not None:
+        playwright_browser = extension_browser.playwright_browser
+        if playwright_browser is not None and not playwright_browser.is_connected():
+            await close_extension_browser()
+    if extension_context is None:
+        extension_browser = Browser(config=BrowserConfig(headless=EXTENSION_HEADLESS, cdp_url=EXTENSION_CDP_URL))
+        # Never close the user's own windows when attached over CDP
+        extension_context = runtime.TabReusingContext(
+            browser=extension_browser, config=BrowserContextConfig(_force_keep_context_alive=bool(EXTENSION_CDP_URL)))
+    return extension_context
+
+async def close_extension_browser():
+    global extension_browser, extension_context
+    context, browser = extension_context, extension_browser
+    extension_context = extension_browser = None
+    try:
+        if context:
+            await context.close()
+        if browser:
+            await browser.close()
     except Exception as e:
-        logger.error(f"Error in run_task: {str(e)}")
-        send_agent_message(f"Internal Server Error: {str(e)}")
-        return '', 500
-
-@app.route('/get_agent_messages', methods=['GET'])
-def get_agent_messages():
-    """Poll for new agent messages and return them."""
-    messages = []
-    while not agent_messages.empty():
-        messages.append(agent_messages.get())
-    if messages:
-        return jsonify({'messages': messages})
-    return jsonify({'messages': []})
-
-async def cleanup_agent():
-    """Clean up the agent and browser resources."""
-    global original_agent
-    if original_agent:
+        logger.error(f"Failed to close the extension browser: {str(e)}")
+
+async def run_gemini(request: Request):
+    """Run an instruction from the extension to completion, starting in the tab that has `link` open.
+
+    Body (JSON): `instruction`, plus optional `link` (defaults to the first URL in the
+    instruction). A tab already showing that page is reused instead of loading it again.
+    """
+    try:
+        data = await request.json()
+        instruction = str(data.get('instruction') or '').strip()
+        link = str(data.get('link') or '').strip()
+    except (ValueError, AttributeError):
+        return JSONResponse({'status': 'Expected a JSON object with `instruction`.'}, status_code=400)
+    if not instruction:
+        return JSONResponse({'status': 'No instruction provided.'}, status_code=400)
+    if urlsplit(link).scheme not in ('http', 'https'):
+        urls = [url for url in extract_urls(instruction) if url.startswith(('http://', 'https://'))]
+        link = urls[0] if urls else ''
+    if extension_lock.locked():
+        return JSONResponse({'status': 'Another extension task is still running.'}, status_code=409)
+    if await load_components(None, None, lazy_runtime, lazy_llm) is None:
+        return JSONResponse({'status': f"The agent is unavailable: {lazy_runtime.error or lazy_llm.error}"}, status_code=503)
+
+    async with extension_lock:
+        timeline = metrics.timelines.start(uuid.uuid4().hex)
+        metrics.current_timeline.set(timeline)
         try:
-            if not original_agent.injected_browser_context:
-                await original_agent.browser_context.close()
-            if not original_agent.injected_browser and original_agent.browser:
-                await original_agent.browser.close()
+            with metrics.span('browser_acquire'):
+                context = await get_extension_context()
+                reused_tab = await context.open_tab(link) if link else False
+        except Exception as e:
+            logger.error(f"Failed to open the extension browser: {str(e)}")
+            await close_extension_browser()
+            metrics.TASKS_TOTAL.inc(outcome='failed')
+            timeline.finish('failed')
+            return JSONResponse({'status': f"Browser error: {str(e)}"}, status_code=500)
+
+        task = instruction
+        if link:
+            task += f"\nThe page {link} is already open in the current tab; start from there instead of opening it again."
+        agent = lazy_runtime.value.build_agent(task, lazy_llm.value, extension_browser, context, use_vision=False,
+                                               dom_diff=DOM_DIFF_ENABLED, task_id=timeline.task_id,
+                                               parallel_tabs=parallel_tab_limit(None))
+        # Like a batch item, nobody can answer a login prompt here; the login handler stops the run
+        item = batch_items[id(context)] = {'agent': agent, 'login_domain': None}
+        outcome = 'failed'
+        try:
+            with metrics.span('agent_run'):
+                history = await agent.run(max_steps=EXTENSION_MAX_STEPS)
+            if item['login_domain']:
+                outcome = 'login_required'
+                status = f"Please log in to {item['login_domain']} in the browser, then try again."
+            else:
+                outcome = 'completed' if history.is_done() else 'incomplete'
+                status = history.final_result() or ("Task completed." if history.is_done() else "Task did not finish.")
+        except Exception as e:
+            logger.error(f"Extension task failed: {str(e)}")
+            return JSONResponse({'status': f"Error executing the task: {str(e)}", 'task_id': timeline.task_id}, status_code=500)
+        finally:
+            batch_items.pop(id(context), None)
+            metrics.TASKS_TOTAL.inc(outcome=outcome)
+            timeline.finish(outcome)
+            if conversation_log:
+                conversation_log.finish(timeline.task_id)
+    logger.info(f"Extension task {timeline.task_id}: {outcome}, reused tab: {reused_tab}")
+    return JSONResponse({
+        'status': status,
+        'task_id': timeline.task_id,
+        'outcome': outcome,
+        'reused_tab': reused_tab,
+        'urls': [url for url in history.urls() if url],
+    })
+
+async def enqueue_session_task(session: AgentSession, task: str, headless: bool, use_vision: bool, use_cache: bool,
+                               dom_diff: bool = False, parallel_tabs: int = 0, block_resources: Optional[List[str]] = None,
+                               use_macros: bool = False) -> Response:
+    """Queue a chat task for the workers and relay its progress into the session."""
+    job_id = await asyncio.to_thread(job_store.enqueue, task, {
+        'headless': headless,
+        'use_vision': use_vision,
+        'dom_diff': dom_diff,
+        'parallel_tabs': parallel_tabs,
+        'block_resources': block_resources,
+        'use_macros': use_macros,
+        'session_id': session.session_id,
+    })
+    session.job_id = job_id
+    session.run = track_task(relay_job_events(session, job_id, task, headless, use_vision, use_cache))
+    send_agent_message(session, f"Task queued as job {job_id}.")
+    return JSONResponse({'job_id': job_id}, status_code=202)
+
+async def relay_job_events(session: AgentSession, job_id: str, task: str, headless: bool, use_vision: bool, use_cache: bool):
+    """Forward a job's messages to the session until the job is finished."""
+    cursor = 0
+    while True:
+        events = await asyncio.to_thread(job_store.events_after, job_id, cursor)
+        for event_id, message in events:
+            send_agent_message(session, message)
+            cursor = event_id
+        if events:
+            continue
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None or job['status'] in FINAL_STATES:
+            break
+        await asyncio.sleep(JOB_RELAY_INTERVAL)
+    # Replays are announced after the job finishes; pick those up for a little longer
+    if replay_store and job and job['status'] == SUCCEEDED:
+        for _ in range(20):
+            await asyncio.sleep(JOB_RELAY_INTERVAL)
+            events = await asyncio.to_thread(job_store.events_after, job_id, cursor)
+            for event_id, message in events:
+                send_agent_message(session, message)
+                cursor = event_id
+            if events:
+                break
+    result = job['result'] if job else None
+    if use_cache and result and result.get('done') and result.get('success') is not False:
+        await asyncio.to_thread(task_cache.put, task, headless, use_vision, result['final_result'], result['urls'])
+
+def parse_job_request(data) -> dict:
+    """Validate POST /jobs fields (form or JSON)."""
+    if not isinstance(data, Mapping):  # A JSON dict, or the submitted form
+        raise ValueError("Expected a JSON object or form fields")
+    task = data.get('task') or ''
+    if not isinstance(task, str):
+        raise ValueError("'task' must be a string")
+    task = task.strip()
+    if not task:
+        raise ValueError("'task' is required")
+    use_vision = str(data.get('vision', 'false')).lower() == 'true'
+    return {
+        'task': task,
+        'priority': int(data.get('priority') or 0),
+        'max_attempts': int(data.get('max_attempts') or 3),
+        'timeout': float(data.get('timeout') or os.getenv('JOB_TIMEOUT', '600')),
+        'params': {
+            'headless': str(data.get('headless', 'true')).lower() == 'true',
+            'use_vision': use_vision,
+            'dom_diff': wants_dom_diff(None if data.get('dom_diff') is None else str(data['dom_diff']).lower()),
+            'parallel_tabs': parallel_tab_limit(None if data.get('parallel_tabs') is None else str(data['parallel_tabs']).lower()),
+            'block_resources': resolve_blocked_types(None if data.get('block_resources') is None else str(data['block_resources']),
+                                                     use_vision),
+            'use_macros': wants_macros(None if data.get('use_macros') is None else str(data['use_macros']).lower()),
+        },
+    }
+
+async def create_job(request: Request):
+    """Queue an agent task; workers pick jobs up by priority, then age."""
+    try:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            data = await request.json()
+        else:
+            data = await request.form()
+        job = parse_job_request(data)
+    except (ValueError, TypeError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    job_id = await asyncio.to_thread(job_store.enqueue, **job)
+    return JSONResponse({'job_id': job_id, 'status': 'queued'}, status_code=202)
+
+async def get_job(request: Request):
+    """Status, result and progress messages (after the `after` event ID) of one job."""
+    job_id = request.path_params['job_id']
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        return JSONResponse({'error': 'Unknown job ID'}, status_code=404)
+    try:
+        after = int(request.query_params.get('after', 0))
+    except ValueError:
+        after = 0
+    events = await asyncio.to_thread(job_store.events_after, job_id, after)
+    job['messages'] = [message for _, message in events]
+    job['last_event_id'] = events[-1][0] if events else after
+    return JSONResponse(job)
+
+async def cancel_job(request: Request):
+    status = await asyncio.to_thread(job_store.cancel, request.path_params['job_id'])
+    if status is None:
+        return JSONResponse({'error': 'Unknown job ID'}, status_code=404)
+    return JSONResponse({'status': status})
+
+async def job_stats(request: Request):
+    """Number of jobs in each state, and how many workers this server started."""
+    counts = await asyncio.to_thread(job_store.counts)
+    return JSONResponse({'jobs': counts, 'workers': sum(1 for process in worker_processes if process.is_alive())})
+
+async def cache_stats(request: Request):
+    """Hit/miss counters of the task result cache and the extension's page-context cache."""
+    stats = await asyncio.to_thread(task_cache.stats)
+    return JSONResponse({**stats, 'page_context': page_contexts.stats()})
+
+async def get_artifact(request: Request):
+    """Stream a run's replay from disk, or report that it is still being rendered."""
+    record = replay_store.get(request.path_params['task_id']) if replay_store else None
+    if record is None or record['status'] in ('failed', 'skipped'):
+        return JSONResponse({'status': record['status'] if record else 'not_found'}, status_code=404)
+    if record['status'] == 'pending':
+        return JSONResponse({'status': 'pending'}, status_code=202, headers={'Retry-After': '1'})
+    return FileResponse(record['path'], media_type=record['media_type'], headers={'Cache-Control': 'private, max-age=86400'})
+
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint: phase histograms, task/step/LLM counters and live gauges."""
+    pool_stats = browser_pool.stats()
+    RUNNING_AGENTS.set(session_manager.running_count())
+    POOL_BROWSERS.set(pool_stats['browsers'], state='total')
+    POOL_BROWSERS.set(pool_stats['active'], state='active')
+    TASK_CACHE_ENTRIES.set((await asyncio.to_thread(task_cache.stats))['entries'])
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+async def get_task_timeline(request: Request):
+    """Per-phase spans of one task as JSON."""
+    timeline = metrics.timelines.get(request.path_params['task_id'])
+    if timeline is None:
+        # Jobs run in worker processes; their timeline is stored with the result
+        job = await asyncio.to_thread(job_store.get, request.path_params['task_id'])
+        if job and job['result'] and 'timeline' in job['result']:
+            return JSONResponse(job['result']['timeline'])
+        return JSONResponse({'error': 'Unknown task ID'}, status_code=404)
+    return JSONResponse(timeline.to_dict())
+
+async def get_task_conversation(request: Request):
+    """The task's logged conversation with the model, as plain text."""
+    if not conversation_log:
+        return JSONResponse({'error': 'Conversation logging is disabled.'}, status_code=404)
+    text = await asyncio.to_thread(conversation_log.read, request.path_params['task_id'])
+    if text is None:
+        return JSONResponse({'error': 'No conversation logged for this task'}, status_code=404)
+    return PlainTextResponse(text)
+
+async def list_conversations(request: Request):
+    """Index of the most recently logged conversations, plus writer counters."""
+    if not conversation_log:
+        return JSONResponse({'enabled': False})
+    try:
+        limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+    except ValueError:
+        limit = 50
+    recent = await asyncio.to_thread(conversation_log.recent, limit)
+    stats = await asyncio.to_thread(conversation_log.stats)
+    return JSONResponse({'enabled': True, **stats, 'conversations': recent})
+
+async def list_macros(request: Request):
+    """Recorded macros with their replay counters, plus the hit rate and time saved in this process."""
+    if not macro_store:
+        return JSONResponse({'enabled': False})
+    try:
+        limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+    except ValueError:
+        limit = 50
+    recent = await asyncio.to_thread(macro_store.recent, limit)
+    stats = await asyncio.to_thread(macro_store.stats)
+    return JSONResponse({'enabled': True, **stats, 'macros': recent})
+
+async def forget_macro(request: Request):
+    """Drop a recorded macro, e.g. after the site changed in a way replays do not notice."""
+    if not macro_store:
+        return JSONResponse({'error': 'Macros are disabled (MACROS=off).'}, status_code=404)
+    try:
+        macro_id = int(request.path_params['macro_id'])
+    except ValueError:
+        return JSONResponse({'error': 'Invalid macro id'}, status_code=400)
+    if not await asyncio.to_thread(macro_store.delete, macro_id):
+        return JSONResponse({'error': 'Macro not found'}, status_code=404)
+    return JSONResponse({'macro_id': macro_id, 'forgotten': True})
+
+async def auth_stats(request: Request):
+    """Counters of the saved-login store."""
+    if not auth_store:
+        return JSONResponse({'enabled': False})
+    stats = await asyncio.to_thread(auth_store.stats)
+    return JSONResponse({'enabled': True, **stats})
+
+async def forget_login(request: Request):
+    """Drop the session's saved login of a domain, e.g. after logging out or changing the password."""
+    if not auth_store:
+        return JSONResponse({'error': 'Saved logins are disabled (AUTH_STATE_KEY is not set).'}, status_code=404)
+    domain = normalize_domain(request.path_params['domain'])
+    await asyncio.to_thread(auth_store.invalidate, get_session_id(request), domain)
+    return JSONResponse({'domain': domain, 'forgotten': True})
+
+async def llm_stats(request: Request):
+    """Token, latency and memoization counters of the agent's LLM calls."""
+    if not lazy_llm.ready:
+        return JSONResponse({'loaded': False, **lazy_llm.status()})
+    llm = lazy_llm.value
+    return JSONResponse({**llm.stats.summary(), 'recent_calls': list(llm.stats.recent)[-20:]})
+
+def get_event_cursor(request: Request, session: AgentSession) -> int:
+    """Read the client's resume cursor (Last-Event-ID header or `after` parameter)."""
+    raw = request.headers.get('last-event-id') or request.query_params.get('after') or '0'
+    try:
+        cursor = int(raw)
+    except ValueError:
+        cursor = 0
+    # A cursor from before a server restart points past the channel; start over
+    return cursor if cursor <= session.channel.last_event_id else 0
+
+def format_sse(event_id: int, message: str, event: str = 'message') -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps({'message': message})}\n\n"
+
+async def stream_agent_messages(request: Request):
+    """Push the session's agent messages as Server-Sent Events as soon as they are published."""
+    session = session_manager.get(get_session_id(request))
+    cursor = get_event_cursor(request, session)
+
+    async def generate():
+        nonlocal cursor
+        yield "retry: 2000\n\n"
+        while True:
+            events, missed = await session.channel.wait_for(cursor, timeout=STREAM_KEEPALIVE_SECONDS, limit=STREAM_BATCH_SIZE)
+            session.last_active = time.monotonic()
+            if missed:
+                # The client fell behind the channel buffer; tell it rather than stall the producer
+                yield format_sse(events[0][0] - 1, f"{missed} earlier messages were dropped.", event='gap')
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, message in events:
+                yield format_sse(event_id, message)
+            cursor = events[-1][0]
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+
+async def get_agent_messages(request: Request):
+    """Poll for new agent messages of the caller's session and return them.
+
+    Without `after` this drains unseen messages like before. With `after=<event id>`
+    it long-polls: it waits up to `wait` seconds for messages newer than that ID.
+    """
+    session = session_manager.get(get_session_id(request))
+    if 'after' not in request.query_params:
+        return JSONResponse({'messages': session.drain_messages()})
+
+    cursor = get_event_cursor(request, session)
+    try:
+        wait = float(request.query_params.get('wait', 0) or 0)
+    except ValueError:
+        wait = 0.0
+    wait = min(wait, LONG_POLL_MAX_WAIT) if wait > 0 else 0.0  # Also turns 'nan' into no wait
+    events, missed = await session.channel.wait_for(cursor, timeout=wait, limit=STREAM_BATCH_SIZE)
+    last_event_id = events[-1][0] if events else cursor
+    return JSONResponse({
+        'messages': [message for _, message in events],
+        'last_event_id': last_event_id,
+        'missed': missed,
+    })
+
+async def cleanup_agent(session: AgentSession):
+    """Clean up the session's agent and browser resources."""
+    if session.agent:
+        try:
+            if session.lease:
+                # Pooled browsers are reused; only the task's context is discarded
+                lease, session.lease = session.lease, None
+                await browser_pool.release(lease)
+            else:
+                await session.agent.browser_context.close()
+                if session.agent.browser:
+                    await session.agent.browser.close()
         except Exception as e:
             logger.error(f"Cleanup failed: {str(e)}")
-        original_agent = None
-        awaiting_continue = False
-        awaiting_credentials = False
-        is_task = True
+        session.agent = None
+        session.reset_login_state()
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    global warmup_task
+    open_stores()
+    startup.mark('app_started')
+    if WARMUP:
+        warmup_task = track_task(warm_up())
+    if JOB_WORKERS > 0:
+        import worker
+        worker_processes.extend(worker.start_workers(JOB_WORKERS, int(os.getenv('JOB_WORKER_CONCURRENCY', '1'))))
+        logger.info(f"Started {JOB_WORKERS} job worker processes.")
+    yield
+    # Stop agents still in flight and hand their browsers back before the loop goes away
+    for session in session_manager.sessions():
+        if session.agent:
+            session.agent.stop()
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    for session in session_manager.sessions():
+        await cleanup_agent(session)
+    await browser_pool.close()
+    await close_extension_browser()
+    if replay_store:
+        await replay_store.close()
+    if conversation_log:
+        await asyncio.to_thread(conversation_log.close)
+    if worker_processes:
+        import worker
+        await asyncio.to_thread(worker.stop_workers, worker_processes)
+
+app = Starlette(
+    routes=[
+        Route('/', index, methods=['GET']),
+        Route('/healthz', healthz, methods=['GET']),
+        Route('/readyz', readyz, methods=['GET']),
+        Route('/run_task', run_task, methods=['POST']),
+        Route('/upload_audio', upload_audio, methods=['POST']),
+        Route('/run_batch', run_batch, methods=['POST']),
+        Route('/generate', generate_instruction, methods=['POST']),
+        Route('/run-gemini', run_gemini, methods=['POST']),
+        Route('/get_agent_messages', get_agent_messages, methods=['GET']),
+        Route('/stream_agent_messages', stream_agent_messages, methods=['GET']),
+        Route('/cache/stats', cache_stats, methods=['GET']),
+        Route('/llm/stats', llm_stats, methods=['GET']),
+        Route('/auth/stats', auth_stats, methods=['GET']),
+        Route('/macros', list_macros, methods=['GET']),
+        Route('/macros/{macro_id}', forget_macro, methods=['DELETE']),
+        Route('/auth/{domain}', forget_login, methods=['DELETE']),
+        Route('/jobs', create_job, methods=['POST']),
+        Route('/jobs', job_stats, methods=['GET']),
+        Route('/jobs/{job_id}', get_job, methods=['GET']),
+        Route('/jobs/{job_id}', cancel_job, methods=['DELETE']),
+        Route('/artifacts/{task_id}', get_artifact, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/tasks/{task_id}/timeline', get_task_timeline, methods=['GET']),
+        Route('/tasks/{task_id}/conversation', get_task_conversation, methods=['GET']),
+        Route('/conversations', list_conversations, methods=['GET']),
+        Mount('/static', app=StaticFiles(directory=str(BASE_DIR / 'static')), name='static'),
+    ],
+    # The extension popup calls /generate and /run-gemini from its own origin
+    middleware=[
+        Middleware(FirstRequestTimer, timings=startup),
+        Middleware(CORSMiddleware, allow_origin_regex=EXTENSION_ORIGINS, allow_methods=['GET', 'POST'],
+                   allow_headers=['Content-Type']),
+    ],
+    lifespan=lifespan,
+)
 
-# Wrap Flask app with ASGI adapter
-asgi_app = WsgiToAsgi(app)
+# Kept for deployments that still point uvicorn at `server:asgi_app`
+asgi_app = app
+startup.mark('import')
 
 if __name__ == '__main__':
     import uvicorn
-    uvicorn.run(asgi_app, host="127.0.0.1", port=5000, log_level="info")
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=5000, log_level="info")
\ No newline at end of file
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+from message_channel import MessageChannel
+
+if TYPE_CHECKING:
+    # Annotations only: the server starts without importing browser-use
+    from browser_use import Agent
+    from browser_use.browser.context import BrowserContext
+
+    from browser_pool import BrowserLease
+
+logger = logging.getLogger(__name__)
+
+
+class AgentSession:
+    """Everything one chat session owns: its agent, login-pause state and message channel."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.agent: Optional['Agent'] = None
+        self.lease: Optional['BrowserLease'] = None
+        self.run: Optional[asyncio.Task] = None
+        self.task_id: Optional[str] = None  # ID of the current (or last) run, used for its artifacts
+        self.job_id: Optional[str] = None  # Queued job of the current run when tasks go through the job queue
+        self.login_domain = ""
+        self.awaiting_continue = False
+        self.awaiting_credentials = False
+        self.is_task = True  # Flag to distinguish task inputs from login/continue/exit commands
+        self.had_login = False  # Set once the current run has paused for a login
+        self.auth_domains: Set[str] = set()  # Domains the user logged into during this run (saved when it succeeds)
+        self.restored_domains: Set[str] = set()  # Domains whose saved login was loaded into this run's browser
+        self.channel = MessageChannel()  # Agent messages streamed or polled by this session's frontend
+        self.poll_cursor = 0  # Last event ID handed out through the legacy drain-style poll
+        self.last_active = time.monotonic()
+
+    def send_message(self, message: str) -> int:
+        """Publish a message on this session's channel for the frontend."""
+        event_id = self.channel.publish(message)
+        logger.info(f"Queued agent message {event_id} for session {self.session_id}: {message}")
+        return event_id
+
+    def drain_messages(self) -> List[str]:
+        """Return messages not yet handed out by drain_messages() (legacy polling)."""
+        events, _ = self.channel.read_after(self.poll_cursor)
+        if events:
+            self.poll_cursor = events[-1][0]
+        return [message for _, message in events]
+
+    def reset_login_state(self):
+        self.login_domain = ""
+        self.awaiting_continue = False
+        self.awaiting_credentials = False
+        self.is_task = True
+        self.had_login = False
+        self.auth_domains = set()
+        self.restored_domains = set()
+
+    def is_running(self) -> bool:
+        return self.run is not None and not self.run.done()
+
+
+class SessionManager:
+    """Keeps one AgentSession per session ID and caps how many agents run at once."""
+
+    def __init__(self, max_concurrent_agents: int = 4, idle_timeout: float = 3600.0):
+        self.max_concurrent_agents = max_concurrent_agents
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[str, AgentSession] = {}
+
+    def get(self, session_id: str) -> AgentSession:
+        """Return the session for `session_id`, creating it on first use."""
+        self._prune_idle()
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = AgentSession(session_id)
+            self._sessions[session_id] = session
+        session.last_active = time.monotonic()
+        return session
+
+    def find_by_browser_context(self, browser_context: 'BrowserContext') -> Optional[AgentSession]:
+        """Map a controller action's BrowserContext back to the session running it."""
+        for session in self._sessions.values():
+            if session.agent is not None and session.agent.browser_context is browser_context:
+                return session
+        return None
+
+    def running_count(self) -> int:
+        return sum(1 for session in self._sessions.values() if session.is_running())
+
+    def at_capacity(self) -> bool:
+        return self.running_count() >= self.max_concurrent_agents
+
+    def sessions(self) -> List[AgentSession]:
+        return list(self._sessions.values())
+
+    def _prune_idle(self):
+        """Drop sessions idle for `idle_timeout`, except those with a run in flight.
+
+        A queued job has no agent in this process, but its relay (session.run) still
+        publishes into the session's channel until the job finishes.
+        """
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if session.agent is not None or session.is_running():
+                continue
+            if now - session.last_active > self.idle_timeout:
+                logger.info(f"Dropping idle session {session_id}.")
+                del self._sessions[session_id]
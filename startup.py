@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STARTUP_SECONDS = metrics.registry.gauge(
+    'siteguide_startup_seconds', 'Seconds from the start of the server import to each startup milestone.', ['phase'])
+COMPONENT_BUILD_SECONDS = metrics.registry.gauge(
+    'siteguide_component_build_seconds', 'Seconds it took to import and build each lazily loaded component.', ['component'])
+
+
+class StartupTimings:
+    """Startup milestones (import done, app started, first request answered, warm-up done), in seconds since `started`."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.milestones: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> float:
+        if phase not in self.milestones:
+            self.milestones[phase] = round(time.perf_counter() - self.started, 4)
+            STARTUP_SECONDS.set(self.milestones[phase], phase=phase)
+        return self.milestones[phase]
+
+    def uptime(self) -> float:
+        return round(time.perf_counter() - self.started, 3)
+
+
+class LazyComponent:
+    """Something expensive to import or construct (an SDK, a client) that is built once, when first needed.
+
+    get() builds it in a worker thread, so a cold first request does not stall the
+    event loop, and concurrent first uses share one build. A failed build is kept
+    for readiness to report and retried on the next use. warm() does the same
+    ahead of time.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self.value: Any = None
+        self.state = 'lazy'  # lazy -> building -> ready | failed
+        self.error: Optional[str] = None
+        self.build_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def get_sync(self) -> Any:
+        with self._lock:
+            if self.state == 'ready':
+                return self.value
+            self.state = 'building'
+            start = time.perf_counter()
+            try:
+                self.value = self.factory()
+            except Exception as e:
+                self.state, self.error = 'failed', str(e)
+                logger.error(f"Failed to initialize {self.name}: {str(e)}")
+                raise
+            finally:
+                self.build_seconds = round(time.perf_counter() - start, 4)
+                COMPONENT_BUILD_SECONDS.set(self.build_seconds, component=self.name)
+            self.state, self.error = 'ready', None
+            logger.info(f"Initialized {self.name} in {self.build_seconds:.2f}s.")
+            return self.value
+
+    async def get(self) -> Any:
+        if self.state == 'ready':
+            return self.value
+        return await asyncio.to_thread(self.get_sync)
+
+    def set(self, value: Any):
+        """Use `value` instead of building one (benchmarks inject their own model this way)."""
+        with self._lock:
+            self.value, self.state, self.error = value, 'ready', None
+
+    async def warm(self) -> bool:
+        try:
+            await self.get()
+            return True
+        except Exception:
+            return False
+
+    def status(self) -> Dict[str, Any]:
+        status = {'state': self.state, 'build_seconds': self.build_seconds}
+        if self.error:
+            status['error'] = self.error
+        return status
+
+
+class FirstRequestTimer:
+    """ASGI middleware that marks when the first HTTP response went out, then just passes requests through."""
+
+    def __init__(self, app, timings: StartupTimings):
+        self.app = app
+        self.timings = timings
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or 'first_request' in self.timings.milestones:
+            return await self.app(scope, receive, send)
+
+        async def send_and_mark(message):
+            await send(message)
+            if message['type'] == 'http.response.start':
+                self.timings.mark('first_request')
+
+        await self.app(scope, receive, send_and_mark)
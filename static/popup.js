@@ -19,6 +19,14 @@ document.addEventListener('DOMContentLoaded', () => {
         chatMessages.scrollTop = chatMessages.scrollHeight; // Auto-scroll to the latest message
     }
 
+    // URL of the page the user is on (window.location here is the popup's own chrome-extension:// page).
+    // Needs the "tabs" (or "activeTab") permission in the extension's manifest to see the URL.
+    async function activeTabUrl() {
+        if (typeof chrome === 'undefined' || !chrome.tabs) return '';
+        const [tab] = await chrome.tabs.query({ active: true, currentWindow: true });
+        return (tab && tab.url) || '';
+    }
+
     // Function to send user input to /generate and process the instruction
     async function sendMessage() {
         const userPrompt = chatInput.value.trim();
@@ -28,10 +36,11 @@ document.addEventListener('DOMContentLoaded', () => {
         chatInput.value = '';
 
         try {
+            const link = await activeTabUrl();
             const generateResponse = await fetch('http://127.0.0.1:5000/generate', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ link: window.location.href, prompt: userPrompt }),
+                body: JSON.stringify({ link: link, prompt: userPrompt }),
             });
 
             if (!generateResponse.ok) {
@@ -47,7 +56,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const geminiResponse = await fetch('http://127.0.0.1:5000/run-gemini', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ instruction: generatedInstruction }),
+                body: JSON.stringify({ instruction: generatedInstruction, link: link }),
             });
 
             if (!geminiResponse.ok) {
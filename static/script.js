@@ -1,6 +1,12 @@
+// Identify this tab's chat session so the server keeps its agent separate from other users
+var sessionId = sessionStorage.getItem("siteguideSessionId");
+if (!sessionId) {
+    sessionId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+    sessionStorage.setItem("siteguideSessionId", sessionId);
+}
+
 $(document).ready(function() {
     let mediaRecorder;
-    let audioChunks = [];
     let isProcessing = false; // Track if a request is in progress
 
     // Function to add a message to the chat (already defined in index.html for polling)
@@ -25,16 +31,6 @@ $(document).ready(function() {
         $("#chatMessages").scrollTop($("#chatMessages")[0].scrollHeight);
     }
 
-    // Function to encode audio data to base64
-    function blobToBase64(blob) {
-        return new Promise((resolve, reject) => {
-            const reader = new FileReader();
-            reader.onloadend = () => resolve(reader.result);
-            reader.onerror = reject;
-            reader.readAsDataURL(blob);
-        });
-    }
-
     // Function to send request asynchronously without waiting for response
     function sendRequest(url, data) {
         if (isProcessing) {
@@ -43,6 +39,7 @@ $(document).ready(function() {
         }
 
         isProcessing = true;
+        data.session_id = sessionId;
         $.ajax({
             type: "POST",
             url: url,
@@ -50,7 +47,7 @@ $(document).ready(function() {
             async: true, // Ensure asynchronous
             success: function() {
                 isProcessing = false;
-                addMessage("agent", "Request sent successfully (updates via polling).");
+                addMessage("agent", "Request sent successfully (updates are streamed).");
             },
             error: function(xhr, status, error) {
                 isProcessing = false;
@@ -62,27 +59,85 @@ $(document).ready(function() {
         });
     }
 
+    // Upload recorded segments as multipart parts; the server transcribes each part as it arrives
+    function uploadAudioSegments(segments) {
+        if (isProcessing) {
+            addMessage("agent", "Please wait, processing previous request...");
+            return;
+        }
+
+        var formData = new FormData();
+        segments.forEach(function(segment, i) {
+            var extension = (segment.type.split("/")[1] || "webm").split(";")[0];
+            formData.append("audio", segment, "segment-" + (i + 1) + "." + extension);
+        });
+        var params = $.param({
+            session_id: sessionId,
+            headless: $('#headlessCheckbox').is(':checked'),
+            vision: $('#visionCheckbox').is(':checked'),
+            dom_diff: $('#domDiffCheckbox').is(':checked'),
+            parallel_tabs: $('#parallelTabsCheckbox').is(':checked')
+        });
+
+        isProcessing = true;
+        $.ajax({
+            type: "POST",
+            url: "/upload_audio?" + params,
+            data: formData,
+            processData: false,
+            contentType: false,
+            success: function() {
+                addMessage("agent", "Audio sent successfully (updates are streamed).");
+            },
+            error: function(xhr, status, error) {
+                addMessage("agent", "Error sending audio: " + (error || "Network error"));
+            },
+            complete: function() {
+                isProcessing = false;
+            }
+        });
+    }
+
+    // Record in short self-contained segments so each one can be transcribed on its own
+    var SEGMENT_MS = 10000;
+    var recordedSegments = [];
+    var segmentTimer = null;
+    var isRecording = false;
+
+    function recordSegment(stream) {
+        var chunks = [];
+        var recorder = new MediaRecorder(stream);
+        mediaRecorder = recorder;
+        recorder.ondataavailable = function(e) { chunks.push(e.data); };
+        recorder.onstop = function() {
+            recordedSegments.push(new Blob(chunks, { type: recorder.mimeType || 'audio/webm' }));
+            if (isRecording) {
+                recordSegment(stream);
+            } else {
+                stream.getTracks().forEach(function(track) { track.stop(); });
+                addMessage("user", "Recorded audio, sending to server...");
+                uploadAudioSegments(recordedSegments);
+            }
+        };
+        recorder.start();
+        segmentTimer = setTimeout(function() { recorder.stop(); }, SEGMENT_MS);
+    }
+
     // Record button functionality
     $("#recordButton").click(function() {
-        if (mediaRecorder && mediaRecorder.state === "recording") {
+        var button = $(this);
+        if (isRecording) {
+            isRecording = false;
+            clearTimeout(segmentTimer);
             mediaRecorder.stop();
-            $(this).text("Record");
+            button.text("Record");
         } else {
             navigator.mediaDevices.getUserMedia({ audio: true })
                 .then(stream => {
-                    mediaRecorder = new MediaRecorder(stream);
-                    audioChunks = [];
-                    mediaRecorder.ondataavailable = function(e) { audioChunks.push(e.data); };
-                    mediaRecorder.onstop = async function() {
-                        const audioBlob = new Blob(audioChunks, { type: 'audio/m4a' });
-                        const audioBase64 = await blobToBase64(audioBlob);
-                        addMessage("user", "Recorded audio, sending to server...");
-                        var headless = $('#headlessCheckbox').is(':checked');
-                        var vision = $('#visionCheckbox').is(':checked');
-                        sendRequest("/run_task", { audioData: audioBase64, headless: headless, vision: vision });
-                    };
-                    mediaRecorder.start();
-                    $(this).text("Recording...");
+                    isRecording = true;
+                    recordedSegments = [];
+                    recordSegment(stream);
+                    button.text("Recording...");
                 })
                 .catch(err => addMessage("agent", "Error accessing microphone: " + err));
         }
@@ -96,7 +151,9 @@ $(document).ready(function() {
             $("#messageInput").val("");
             var headless = $('#headlessCheckbox').is(':checked');
             var vision = $('#visionCheckbox').is(':checked');
-            sendRequest("/run_task", { task: messageText, headless: headless, vision: vision });
+            var domDiff = $('#domDiffCheckbox').is(':checked');
+            var parallelTabs = $('#parallelTabsCheckbox').is(':checked');
+            sendRequest("/run_task", { task: messageText, headless: headless, vision: vision, dom_diff: domDiff, parallel_tabs: parallelTabs });
         }
     });
 
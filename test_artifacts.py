@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import io
+import os
+from types import SimpleNamespace
+
+from PIL import Image
+
+from artifacts import ReplayArtifactStore, sample_frames
+
+
+def noise_frame(width: int = 320, height: int = 200) -> str:
+    """A PNG screenshot of random pixels, which no encoder can compress much."""
+    buffer = io.BytesIO()
+    Image.frombytes('RGB', (width, height), os.urandom(width * height * 3)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def flat_frame(color, width: int = 320, height: int = 200) -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def history_of(frames):
+    return SimpleNamespace(history=[SimpleNamespace(state=SimpleNamespace(screenshot=frame)) for frame in frames])
+
+
+def render(store: ReplayArtifactStore, task_id: str, frames) -> dict:
+    """Run a replay through submit() and the background worker, failing instead of hanging."""
+    async def run():
+        assert store.submit(task_id, history_of(frames))
+        await asyncio.wait_for(store._queue.join(), timeout=30)
+        await store.close()
+        return store.get(task_id)
+    return asyncio.run(run())
+
+
+def test_sample_frames_keeps_first_and_last():
+    frames = [str(index) for index in range(10)]
+    assert sample_frames(frames, 3) == ['0', '4', '9']
+    assert sample_frames(frames, 1) == ['9']
+    assert sample_frames(frames, 20) == frames
+
+
+def test_replay_within_budget_is_written(tmp_path):
+    store = ReplayArtifactStore(str(tmp_path), fmt='gif', max_frames=5)
+    record = render(store, 'a' * 32, [flat_frame(color) for color in ('red', 'green', 'blue')])
+    assert record['status'] == 'ready'
+    assert record['frames'] == 3
+    assert os.path.getsize(record['path']) == record['bytes']
+
+
+def test_replay_over_budget_shrinks_to_fit(tmp_path):
+    frames = [noise_frame() for _ in range(3)]
+    single = ReplayArtifactStore(str(tmp_path / 'probe'), fmt='webp', frame_width=160)._encode('webp', frames[-1:], 160)
+    store = ReplayArtifactStore(str(tmp_path), fmt='webp', max_bytes=len(single) + 100)
+    record = render(store, 'b' * 32, frames)
+    assert record['status'] == 'ready'
+    assert record['bytes'] <= store.max_bytes
+
+
+def test_replay_that_never_fits_fails_instead_of_looping(tmp_path):
+    store = ReplayArtifactStore(str(tmp_path), fmt='gif', max_bytes=1000)
+    record = render(store, 'c' * 32, [noise_frame() for _ in range(3)])
+    assert record['status'] == 'failed'
+    assert 'exceeds' in record['reason']
+    assert not os.listdir(tmp_path)
+
+
+def test_unknown_task_ids_are_not_looked_up(tmp_path):
+    store = ReplayArtifactStore(str(tmp_path))
+    assert store.get('../etc/passwd') is None
+
+
+def test_records_of_runs_without_replays_are_capped(tmp_path):
+    store = ReplayArtifactStore(str(tmp_path), keep=3)
+    for index in range(10):
+        assert not store.submit(f"{index:032x}", history_of([]))
+    assert list(store.records) == [f"{index:032x}" for index in (7, 8, 9)]
+    assert store.get(f"{0:032x}") is None
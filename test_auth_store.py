@@ -0,0 +1,51 @@
+import sqlite3
+
+from auth_store import AuthStateStore, filter_state, matches_domain, normalize_domain
+
+STATE = {
+    'cookies': [{'name': 'sid', 'value': 'secret-session-cookie', 'domain': '.example.com'}],
+    'origins': [{'origin': 'https://app.example.com', 'localStorage': [{'name': 'token', 'value': 'abc'}]}],
+}
+
+
+def test_normalize_and_match_domains():
+    assert normalize_domain('https://www.Example.com/login') == 'example.com'
+    assert normalize_domain('Example.com:8080/path') == 'example.com'
+    assert matches_domain('.accounts.example.com', 'example.com')
+    assert not matches_domain('notexample.com', 'example.com')
+
+
+def test_filter_state_keeps_only_the_domain():
+    state = {
+        'cookies': STATE['cookies'] + [{'name': 'other', 'value': '1', 'domain': 'tracker.net'}],
+        'origins': STATE['origins'] + [{'origin': 'https://tracker.net', 'localStorage': []}],
+    }
+    assert filter_state(state, 'example.com') == STATE
+
+
+def test_round_trip_is_encrypted_on_disk(tmp_path):
+    path = str(tmp_path / 'auth.db')
+    AuthStateStore(path, secret='passphrase').save('session-1', 'https://www.example.com', STATE)
+    rows = sqlite3.connect(path).execute('SELECT key, value FROM cache').fetchall()
+    assert len(rows) == 1
+    assert 'secret-session-cookie' not in rows[0][1]
+    assert 'session-1' not in rows[0][0]
+    assert AuthStateStore(path, secret='passphrase').load('session-1', 'example.com') == STATE
+
+
+def test_logins_are_scoped_to_their_owner(tmp_path):
+    store = AuthStateStore(str(tmp_path / 'auth.db'), secret='passphrase')
+    store.save('alice', 'example.com', STATE)
+    assert store.load('bob', 'example.com') is None
+    store.invalidate('bob', 'example.com')
+    assert store.load('alice', 'example.com') == STATE
+    store.invalidate('alice', 'example.com')
+    assert store.load('alice', 'example.com') is None
+
+
+def test_state_written_with_another_key_is_discarded(tmp_path):
+    path = str(tmp_path / 'auth.db')
+    AuthStateStore(path, secret='old key').save('alice', 'example.com', STATE)
+    store = AuthStateStore(path, secret='new key')
+    assert store.load('alice', 'example.com') is None
+    assert store.stats()['entries'] == 0
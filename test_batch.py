@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from batch import expand_tasks, fan_out, summarize
+
+
+def test_expand_tasks_from_list_or_template():
+    assert expand_tasks({'tasks': [' a ', 'b']}, 5) == ['a', 'b']
+    assert expand_tasks({'template': 'email on {url}', 'urls': ['x.com', 'y.com']}, 5) == ['email on x.com', 'email on y.com']
+    assert expand_tasks({'template': 'summarize', 'urls': ['x.com']}, 5) == ['summarize x.com']
+
+
+@pytest.mark.parametrize('data', [{}, {'tasks': []}, {'tasks': ['ok', ' ']}, {'tasks': ['a', 'b', 'c']}])
+def test_expand_tasks_rejects_bad_batches(data):
+    with pytest.raises(ValueError):
+        expand_tasks(data, 2)
+
+
+def test_fan_out_limits_parallelism_and_reports_errors():
+    running = 0
+    peak = 0
+
+    async def run_item(index: int, task: str) -> dict:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if task == 'bad':
+            raise RuntimeError('broken')
+        return {'status': 'succeeded'}
+
+    async def run():
+        return [result async for result in fan_out(['a', 'bad', 'c', 'd', 'e'], run_item, 2)]
+
+    results = asyncio.run(run())
+    assert peak == 2
+    assert sorted(result['index'] for result in results) == [0, 1, 2, 3, 4]
+    failed = [result for result in results if result['status'] == 'error']
+    assert [(result['task'], result['error']) for result in failed] == [('bad', 'broken')]
+
+
+def test_summarize_counts_statuses():
+    summary = summarize([{'index': 1, 'status': 'failed', 'seconds': 4.0}, {'index': 0, 'status': 'succeeded', 'seconds': 2.0}], 3.0)
+    assert summary['by_status'] == {'succeeded': 1, 'failed': 1}
+    assert summary['item_seconds_total'] == 6.0
+    assert summary['speedup'] == 2.0
+    assert [timing['index'] for timing in summary['timings']] == [0, 1]
@@ -0,0 +1,75 @@
+import time
+
+from caching import SQLiteCache, TTLCache, TaskResultCache, extract_urls, normalize_task
+
+
+class FakeClock:
+    def __init__(self, monkeypatch, now: float = 1000.0):
+        self.now = now
+        monkeypatch.setattr(time, 'time', lambda: self.now)
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = FakeClock(monkeypatch)
+    cache = TTLCache(max_entries=4, ttl=10)
+    cache.set('a', 1)
+    clock.now += 9
+    assert cache.get('a') == 1
+    clock.now += 2
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_sqlite_cache_survives_reopening(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SQLiteCache(path).set('key', {'value': [1, 2]})
+    assert SQLiteCache(path).get('key') == {'value': [1, 2]}
+
+
+def test_sqlite_cache_expires_and_evicts(tmp_path, monkeypatch):
+    clock = FakeClock(monkeypatch)
+    cache = SQLiteCache(str(tmp_path / 'cache.db'), max_entries=2, ttl=10)
+    cache.set('a', 1)
+    clock.now += 1
+    cache.set('b', 2)
+    clock.now += 1
+    cache.get('a')
+    clock.now += 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.evictions == 1
+    clock.now += 20
+    assert cache.get('a') is None
+    assert len(cache) == 1
+
+
+def test_normalize_task_ignores_case_spacing_and_urls():
+    assert normalize_task('  Find   Flights to https://X.com/Path. ') == 'find flights to'
+    assert extract_urls('see x.com/a, and https://y.org/b).') == ['x.com/a', 'https://y.org/b']
+
+
+def test_task_result_cache_keys_on_task_urls_and_flags():
+    cache = TaskResultCache()
+    cache.put('Find the price on https://shop.example.com/item', True, False, 'It costs $5', ['https://shop.example.com/item', None])
+    assert cache.get('find the price on https://shop.example.com/item.', True, False)['urls'] == ['https://shop.example.com/item']
+    assert cache.get('Find the price on https://shop.example.com/other', True, False) is None
+    assert cache.get('Find the price on https://shop.example.com/item', True, True) is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_task_result_cache_on_disk(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    TaskResultCache(path=path).put('Say hi', True, False, 'hi', [])
+    assert TaskResultCache(path=path).get('say hi', True, False)['final_result'] == 'hi'
@@ -0,0 +1,76 @@
+import gzip
+import os
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from conversation_log import ConversationLog
+
+
+class Output:
+    """Stands in for browser-use's AgentOutput."""
+
+    def model_dump_json(self, exclude_unset: bool = False) -> str:
+        return '{"action": [{"done": {"text": "ok"}}]}'
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = ConversationLog(str(tmp_path), flush_interval=0.05)
+    yield log
+    log.close()
+
+
+def test_steps_are_written_compressed_and_read_back(log, tmp_path):
+    log.record('task-1', 1, [SystemMessage(content='You are a browser agent.'), HumanMessage(content='Open the page')], Output())
+    log.record('task-1', 2, [HumanMessage(content=[{'type': 'text', 'text': 'Page state'}, {'type': 'image_url'}])], Output())
+    log.finish('task-1')
+    log.close()
+    entry = log.get('task-1')
+    assert entry['steps'] == 2
+    assert entry['finished_at'] is not None
+    with open(os.path.join(tmp_path, entry['parts'][0]), 'rb') as f:
+        assert f.read(2) == b'\x1f\x8b'
+    text = log.read('task-1')
+    assert '=== Step 1 @' in text and '=== Step 2 @' in text
+    assert 'You are a browser agent.' in text
+    assert '"done"' in text
+
+
+def test_unsafe_task_ids_are_ignored(log):
+    log.record('../escape', 1, [], Output())
+    log.close()
+    assert log.read('../escape') is None
+    assert log.recent() == []
+
+
+def test_prune_drops_the_oldest_parts_over_budget(tmp_path):
+    log = ConversationLog(str(tmp_path), max_total_bytes=1, flush_interval=0.05)
+    for task_id in ('old', 'new'):
+        log.record(task_id, 1, [HumanMessage(content='step')], Output())
+    log.close()
+    assert log.prune() == 2
+    assert log.stats()['tasks'] == 0
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.gz')] == []
+
+
+def test_log_parts_are_valid_gzip_across_flushes(tmp_path):
+    log = ConversationLog(str(tmp_path), flush_interval=0.05)
+    log.record('task-2', 1, [HumanMessage(content='first')], Output())
+    log.close()
+    log = ConversationLog(str(tmp_path), flush_interval=0.05)
+    log.record('task-2', 2, [HumanMessage(content='second')], Output())
+    log.close()
+    with gzip.open(os.path.join(tmp_path, log.get('task-2')['parts'][0]), 'rt') as f:
+        text = f.read()
+    assert 'first' in text and 'second' in text
+
+
+def test_reading_while_a_flush_is_half_written(tmp_path):
+    log = ConversationLog(str(tmp_path), flush_interval=0.05)
+    log.record('task-3', 1, [HumanMessage(content='complete step')], Output())
+    log.close()
+    member = gzip.compress(b'=== Step 2 ===\n' + os.urandom(4096).hex().encode('ascii'))
+    with open(os.path.join(tmp_path, log.get('task-3')['parts'][0]), 'ab') as f:
+        f.write(member[:len(member) // 2])
+    assert 'complete step' in log.read('task-3')
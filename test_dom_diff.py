@@ -0,0 +1,48 @@
+from langchain_core.messages import HumanMessage
+
+from dom_diff import DomDiffMessageManager, diff_elements
+
+STATE_MESSAGE = (
+    'Current url: https://example.com\n'
+    'Interactive elements from top layer of the current page inside the viewport:\n'
+    '[Start of page]\n[0]<a>Home</a>\n[1]<button>Buy</button>\n... 300 pixels below - scroll to see more ...\n'
+    'Current step: 2/10'
+)
+
+
+def test_identical_listings_have_no_diff():
+    assert diff_elements(['[0]<a>Home</a>'], ['[0]<a>Home</a>']) is None
+
+
+def test_diff_lists_removed_and_added_lines():
+    before = ['[0]<a>Home</a>', '[1]<button>Buy</button>', '[2]<a>Help</a>']
+    after = ['[0]<a>Home</a>', '[1]<button>In cart</button>', '[2]<a>Help</a>', '[3]<a>Checkout</a>']
+    assert diff_elements(before, after) == {
+        'removed': ['[1]<button>Buy</button>'],
+        'added': ['[1]<button>In cart</button>', '[3]<a>Checkout</a>'],
+    }
+
+
+def test_describe_changes():
+    assert DomDiffMessageManager._describe_changes(None, 4) == 'Unchanged since the page snapshot above (4 elements).'
+    summary = DomDiffMessageManager._describe_changes({'removed': ['[1]<b>x</b>'], 'added': []}, 3)
+    assert '1 gone, 0 new or changed' in summary
+    assert summary.endswith('Gone:\n[1]<b>x</b>')
+
+
+def test_listing_is_swapped_for_the_summary_keeping_scroll_markers():
+    message = DomDiffMessageManager._with_elements(HumanMessage(content=STATE_MESSAGE), 'Unchanged.')
+    assert message.content == (
+        'Current url: https://example.com\n'
+        'Interactive elements from top layer of the current page inside the viewport:\n'
+        '[Start of page]\nUnchanged.\n... 300 pixels below - scroll to see more ...\n'
+        'Current step: 2/10'
+    )
+
+
+def test_vision_messages_keep_their_image():
+    image = {'type': 'image_url', 'image_url': {'url': 'data:image/png;base64,AAAA'}}
+    message = DomDiffMessageManager._with_elements(HumanMessage(content=[{'type': 'text', 'text': STATE_MESSAGE}, image]), 'Unchanged.')
+    assert 'Unchanged.' in message.content[0]['text']
+    assert '[1]<button>Buy</button>' not in message.content[0]['text']
+    assert message.content[1] == image
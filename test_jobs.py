@@ -0,0 +1,81 @@
+import time
+
+from jobs import CANCELLED, CANCELLING, FAILED, QUEUED, RUNNING, SUCCEEDED, JobStore
+
+
+def make_store(tmp_path, retry_delay: float = 0.0) -> JobStore:
+    return JobStore(str(tmp_path / 'jobs.db'), retry_delay=retry_delay)
+
+
+def test_claims_by_priority_then_age(tmp_path):
+    store = make_store(tmp_path)
+    first = store.enqueue('first')
+    urgent = store.enqueue('urgent', priority=5)
+    second = store.enqueue('second')
+    claimed = [store.claim('w1')['id'] for _ in range(3)]
+    assert claimed == [urgent, first, second]
+    assert store.claim('w1') is None
+
+
+def test_claimed_job_is_running_and_completes(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue('task', {'headless': True})
+    job = store.claim('w1')
+    assert (job['status'], job['attempts'], job['params']) == (RUNNING, 1, {'headless': True})
+    store.complete(job_id, {'final_result': 'done'})
+    job = store.get(job_id)
+    assert job['status'] == SUCCEEDED
+    assert job['result'] == {'final_result': 'done'}
+
+
+def test_failed_attempts_are_retried_until_max_attempts(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue('task', max_attempts=2)
+    store.claim('w1')
+    assert store.fail(job_id, 'boom') == QUEUED
+    store.claim('w1')
+    assert store.fail(job_id, 'boom again') == FAILED
+    assert store.get(job_id)['error'] == 'boom again'
+
+
+def test_retries_back_off(tmp_path):
+    store = make_store(tmp_path, retry_delay=60.0)
+    job_id = store.enqueue('task')
+    store.claim('w1')
+    store.fail(job_id, 'boom')
+    assert store.claim('w1') is None
+    assert store.get(job_id)['available_at'] > time.time() + 30
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    store = make_store(tmp_path)
+    queued = store.enqueue('queued')
+    assert store.cancel(queued) == CANCELLED
+    running = store.enqueue('running')
+    store.claim('w1')
+    assert store.cancel(running) == CANCELLING
+    # The worker notices, stops the agent and reports the attempt as failed
+    assert store.fail(running, 'stopped') == CANCELLED
+    assert store.cancel('missing') is None
+
+
+def test_expired_leases_are_requeued(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    job_id = store.enqueue('task', timeout=1)
+    store.claim('dead-worker')
+    later = time.time() + 3600
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert store.requeue_expired() == 1
+    assert store.get(job_id)['status'] == QUEUED
+
+
+def test_events_page_by_id(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.enqueue('task')
+    other = store.enqueue('other')
+    ids = [store.add_event(job_id, f'message {index}') for index in range(3)]
+    store.add_event(other, 'elsewhere')
+    assert store.events_after(job_id) == [(ids[0], 'message 0'), (ids[1], 'message 1'), (ids[2], 'message 2')]
+    assert store.events_after(job_id, ids[1]) == [(ids[2], 'message 2')]
+    assert store.events_after(job_id, 0, limit=1) == [(ids[0], 'message 0')]
+    assert store.counts() == {QUEUED: 2}
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+import pytest
+
+from login_detector import detect_login_form, detect_rendered_login_form, form_fingerprint
+
+CORPUS = Path(__file__).resolve().parent / 'benchmarks' / 'fixtures' / 'login_forms'
+
+
+@pytest.mark.parametrize('path', sorted((CORPUS / 'positive').glob('*.html')), ids=lambda path: path.stem)
+def test_detects_login_forms(path):
+    assert detect_login_form(path.read_text(encoding='utf-8')) is not None
+
+
+@pytest.mark.parametrize('path', sorted((CORPUS / 'negative').glob('*.html')), ids=lambda path: path.stem)
+def test_ignores_other_forms(path):
+    assert detect_login_form(path.read_text(encoding='utf-8')) is None
+
+
+def test_reports_reason_and_fields():
+    result = detect_login_form(
+        '<form><h2>Sign in</h2><input type="email" name="email"><input type="password" name="pass">'
+        '<button>Log in</button></form>'
+    )
+    assert 'password field' in result['reason']
+    assert form_fingerprint(result) == 'email,pass'
+
+
+def test_rendered_forms_are_scored_like_html():
+    # What RENDERED_FORMS_SCRIPT returns: only forms the browser shows, grouped like the HTML parser does
+    snapshot = {
+        'forms': [{'fields': [{'type': 'email', 'name': 'email'}, {'type': 'password', 'name': 'pass'}],
+                   'buttons': ['', 'Log in'], 'context': ['/session']}],
+        'page_context': ['Acme', 'Welcome back'],
+    }
+    assert detect_rendered_login_form(snapshot)['reason'] == 'password field, email field, sign-in button'
+    assert detect_rendered_login_form(None) is None  # No visible input on the page
+
+
+def test_password_change_needs_two_password_fields():
+    change = ('<form><input type="password" name="current_password"><input type="password" name="new_password">'
+              '<button>Update password</button></form>')
+    assert detect_login_form(change) is None
+    assert detect_login_form('<form><h2>Enter your current password</h2><input type="password" name="pw"></form>') is not None
+
+
+def test_unparseable_markup_is_left_to_the_llm():
+    assert detect_login_form('') is None
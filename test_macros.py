@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from macros import MacroStore, parameterize, same_location, substitute, task_template
+
+
+class Output:
+    """Stands in for browser-use's AgentOutput."""
+
+    def __init__(self, *actions):
+        self.actions = list(actions)
+
+    def model_dump(self, mode: str = 'json', exclude_unset: bool = False) -> dict:
+        return {'current_state': {'next_goal': 'next'}, 'action': self.actions}
+
+
+def step(url: str, *actions, error=None, element=None, seconds: float = 2.0):
+    return SimpleNamespace(
+        model_output=Output(*actions),
+        result=[SimpleNamespace(error=error)],
+        state=SimpleNamespace(url=url, title='Shop', interacted_element=[element]),
+        metadata=SimpleNamespace(duration_seconds=seconds),
+    )
+
+
+def search_history(query: str):
+    search_box = SimpleNamespace(tag_name='input', xpath='html/body/form/input[3]', highlight_index=3,
+                                 entire_parent_branch_path=['html', 'body', 'form', 'input'],
+                                 attributes={'placeholder': 'Search', 'value': ''}, shadow_root=False)
+    items = [
+        step('about:blank', {'go_to_url': {'url': 'https://shop.example.com/'}}),
+        step('https://shop.example.com/', {'input_text': {'index': 3, 'text': query}}, element=search_box),
+        step('https://shop.example.com/', {'click_element': {'index': 99}}, error='Element not found'),
+        step('https://shop.example.com/', {'go_to_url': {'url': f"https://shop.example.com/search?q={query.replace(' ', '+')}"}}),
+        step('https://shop.example.com/search', {'done': {'text': 'Found it', 'success': True}}),
+    ]
+    return SimpleNamespace(history=items, urls=lambda: [item.state.url for item in items])
+
+
+def test_task_template_splits_out_parameters():
+    assert task_template("Search for 'wireless mouse' on amazon.com and show 3 results.") == (
+        'search for {} on {} and show {} results', ['wireless mouse', 'amazon.com', '3'])
+    assert task_template('Track order "1234" on https://shop.example.com/orders')[0] == 'track order {} on {}'
+    assert task_template('Track order "5678"')[0] == task_template('track order "1234".')[0]
+
+
+def test_parameterize_and_substitute_round_trip():
+    params = ['wireless mouse', 'https://shop.example.com/']
+    recorded = parameterize({'text': 'wireless mouse', 'url': 'https://shop.example.com/search?q=wireless+mouse'}, params)
+    assert recorded == {'text': '{{p0}}', 'url': '{{p1}}search?q={{p0+}}'}
+    assert substitute(recorded, ['usb keyboard', 'https://shop.example.com/']) == {
+        'text': 'usb keyboard', 'url': 'https://shop.example.com/search?q=usb+keyboard'}
+
+
+def test_short_parameters_only_replace_whole_values():
+    assert parameterize({'index': '5', 'url': 'https://example.com/page/5'}, ['5']) == {
+        'index': '{{p0}}', 'url': 'https://example.com/page/5'}
+
+
+def test_same_location_ignores_query_and_trailing_slash():
+    assert same_location('https://shop.example.com/search/?q=1', 'https://shop.example.com/search')
+    assert not same_location('https://shop.example.com/cart', 'https://shop.example.com/search')
+    assert not same_location('https://other.example.com/search', 'https://shop.example.com/search')
+
+
+def test_store_records_and_fills_in_a_new_task(tmp_path):
+    store = MacroStore(str(tmp_path / 'macros.db'))
+    store.complete("Search for 'wireless mouse' on https://shop.example.com/", search_history('wireless mouse'), None, True)
+    macro = store.find("Search for 'usb keyboard' on https://shop.example.com/")
+    assert macro is not None
+    # The failed click is left out and recording stops before 'done'
+    assert [next(iter(step['model_output']['action'][0])) for step in macro.steps] == ['go_to_url', 'input_text', 'go_to_url']
+    assert macro.steps[1]['model_output']['action'][0]['input_text']['text'] == 'usb keyboard'
+    assert macro.steps[1]['elements'][0]['xpath'] == 'html/body/form/input[3]'
+    assert macro.steps[2]['model_output']['action'][0]['go_to_url']['url'] == 'https://shop.example.com/search?q=usb+keyboard'
+    assert macro.recorded_seconds == 6.0
+    assert store.find("Search for 'usb keyboard' on https://other.example.com/") is None
+    assert store.stats()['hit_ratio'] == 0.5
+
+
+def test_failed_runs_are_not_recorded_and_failing_macros_are_dropped(tmp_path):
+    store = MacroStore(str(tmp_path / 'macros.db'), max_failures=2)
+    task = "Search for 'wireless mouse' on https://shop.example.com/"
+    store.complete(task, search_history('wireless mouse'), None, False)
+    assert store.find(task) is None
+    store.complete(task, search_history('wireless mouse'), None, True)
+    macro_id = store.find(task).macro_id
+    replay = {'macro_id': macro_id, 'steps': 3, 'replayed': 1, 'seconds_saved': 1.5, 'step_seconds': [0.5]}
+    for _ in range(2):
+        store.complete(task, search_history('wireless mouse'), replay, False)
+    assert store.find(task) is None
+    assert store.stats()['replays_diverged'] == 2
@@ -0,0 +1,39 @@
+import asyncio
+
+from message_channel import MessageChannel
+
+
+def test_events_get_increasing_ids():
+    channel = MessageChannel()
+    assert [channel.publish(message) for message in ('a', 'b', 'c')] == [1, 2, 3]
+    assert channel.last_event_id == 3
+    assert channel.read_after(1) == ([(2, 'b'), (3, 'c')], 0)
+    assert channel.read_after(3) == ([], 0)
+    assert channel.read_after(0, limit=2) == ([(1, 'a'), (2, 'b')], 0)
+
+
+def test_bounded_buffer_reports_missed_events():
+    channel = MessageChannel(max_buffered=3)
+    for index in range(10):
+        channel.publish(f'm{index}')
+    events, missed = channel.read_after(2)
+    assert [event_id for event_id, _ in events] == [8, 9, 10]
+    assert missed == 5
+
+
+def test_wait_for_wakes_on_publish():
+    async def run():
+        channel = MessageChannel()
+        waiter = asyncio.create_task(channel.wait_for(0, timeout=5))
+        await asyncio.sleep(0)
+        channel.publish('hello')
+        return await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(run()) == ([(1, 'hello')], 0)
+
+
+def test_wait_for_times_out_empty():
+    async def run():
+        return await MessageChannel().wait_for(0, timeout=0.05)
+
+    assert asyncio.run(run()) == ([], 0)
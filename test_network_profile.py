@@ -0,0 +1,62 @@
+import pytest
+
+from network_profile import DEFAULT_BLOCKED_TYPES, NetworkProfile, NetworkStats, get_network_profile, resolve_blocked_types
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in ('BLOCK_RESOURCES', 'BLOCK_RESOURCE_TYPES', 'BLOCKED_DOMAINS'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_block_reason_by_type_and_domain():
+    profile = NetworkProfile(['image', 'font'], ['doubleclick.net'])
+    assert profile.block_reason('image', 'https://example.com/logo.png') == 'type'
+    assert profile.block_reason('script', 'https://ad.doubleclick.net/tag.js') == 'domain'
+    assert profile.block_reason('script', 'https://DoubleClick.net/tag.js') == 'domain'
+    assert profile.block_reason('script', 'https://notdoubleclick.net/tag.js') is None
+    assert profile.block_reason('stylesheet', 'https://example.com/site.css') is None
+
+
+def test_auto_blocks_only_text_only_tasks():
+    assert resolve_blocked_types(None, use_vision=False) == DEFAULT_BLOCKED_TYPES
+    assert resolve_blocked_types(None, use_vision=True) is None
+    assert resolve_blocked_types('true', use_vision=True) == DEFAULT_BLOCKED_TYPES
+    assert resolve_blocked_types('false', use_vision=False) is None
+
+
+def test_server_modes_and_configured_types(monkeypatch):
+    monkeypatch.setenv('BLOCK_RESOURCES', 'off')
+    assert resolve_blocked_types('', use_vision=False) is None
+    assert resolve_blocked_types('true', use_vision=False) == DEFAULT_BLOCKED_TYPES
+    monkeypatch.setenv('BLOCK_RESOURCES', 'on')
+    monkeypatch.setenv('BLOCK_RESOURCE_TYPES', 'image,stylesheet')
+    assert resolve_blocked_types(None, use_vision=True) == ['image', 'stylesheet']
+
+
+def test_explicit_types_are_validated():
+    assert resolve_blocked_types(' Image , media ', use_vision=False) == ['image', 'media']
+    with pytest.raises(ValueError, match='pictures'):
+        resolve_blocked_types('image,pictures', use_vision=False)
+
+
+def test_profile_adds_configured_domains(monkeypatch):
+    monkeypatch.setenv('BLOCKED_DOMAINS', 'ads.example.com, ')
+    assert get_network_profile(None) is None
+    profile = get_network_profile(['image'])
+    assert profile.block_reason('xhr', 'https://ads.example.com/pixel') == 'domain'
+    assert profile.block_reason('xhr', 'https://www.google-analytics.com/collect') == 'domain'
+
+
+def test_stats_summary():
+    stats = NetworkStats()
+    stats.record_loaded('document', 1000)
+    stats.record_blocked('image', by_domain=False)
+    stats.record_blocked('script', by_domain=True)
+    summary = stats.summary()
+    assert summary['blocked'] == 2
+    assert summary['blocked_by_type'] == {'image': 1, 'script': 1}
+    assert summary['blocked_by_domain'] == 1
+    assert summary['bytes_loaded'] == 1000
+    assert summary['bytes_saved_estimate'] > 0
+    assert summary['avg_page_load_seconds'] is None
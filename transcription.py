@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover - older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# (filename, audio bytes) for one self-contained recording segment
+AudioSegment = Tuple[str, bytes]
+
+
+class UploadTooLarge(ValueError):
+    """The upload went past the size limit given to iter_audio_segments()."""
+
+
+class Transcriber:
+    """Turns self-contained audio segments into text.
+
+    Backends only implement transcribe_segment(); transcribe_stream() overlaps upload
+    and transcription by starting each segment as soon as it has fully arrived, while
+    still yielding the texts in recording order.
+    """
+
+    name = 'base'
+
+    async def transcribe_segment(self, audio: bytes, filename: str) -> str:
+        raise NotImplementedError
+
+    async def transcribe_stream(self, segments: AsyncIterator[AudioSegment], max_in_flight: int = 4) -> AsyncIterator[str]:
+        pending = deque()
+        try:
+            async for filename, audio in segments:
+                pending.append(asyncio.create_task(self.transcribe_segment(audio, filename)))
+                # Hand back finished segments early, in order, without waiting for the whole upload
+                while pending and (pending[0].done() or len(pending) >= max_in_flight):
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            # After a failed segment or a bad upload, the segments still in flight are of no use
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+class GroqTranscriber(Transcriber):
+    """Whisper on Groq. The SDK call is blocking, so it runs in a worker thread."""
+
+    name = 'groq'
+
+    def __init__(self, client, model: str = 'whisper-large-v3'):
+        self.client = client
+        self.model = model
+
+    async def transcribe_segment(self, audio: bytes, filename: str) -> str:
+        response = await asyncio.to_thread(
+            self.client.audio.transcriptions.create,
+            file=(filename, audio),
+            model=self.model,
+            response_format="verbose_json"
+        )
+        text = getattr(response, 'text', None)
+        if text is None:
+            raise ValueError("No text returned from Groq API")
+        return text.strip()
+
+
+class StubTranscriber(Transcriber):
+    """Offline backend for tests and benchmarks: returns canned text after a fixed delay."""
+
+    name = 'stub'
+
+    def __init__(self, texts: Optional[List[str]] = None, delay: float = 0.0):
+        self.texts = texts or []
+        self.delay = delay
+        self.calls = 0
+
+    async def transcribe_segment(self, audio: bytes, filename: str) -> str:
+        index = self.calls
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if index < len(self.texts):
+            return self.texts[index]
+        return f"segment {index + 1} ({len(audio)} bytes)"
+
+
+def get_transcriber(groq_client=None) -> Transcriber:
+    """Pick the backend named by TRANSCRIBER (groq by default, or stub)."""
+    backend = os.getenv('TRANSCRIBER', 'groq').lower()
+    if backend == 'stub':
+        texts = [text for text in os.getenv('STUB_TRANSCRIPT', '').split('|') if text]
+        return StubTranscriber(texts=texts, delay=float(os.getenv('STUB_TRANSCRIBER_DELAY', '0')))
+    if backend != 'groq':
+        raise ValueError(f"Unknown TRANSCRIBER backend: {backend}")
+    if groq_client is None:
+        raise ValueError("GROQ_API_KEY is not set.")
+    return GroqTranscriber(groq_client)
+
+
+async def iter_audio_segments(content_type: str, body: AsyncIterator[bytes], fields: Optional[Dict[str, str]] = None,
+                              max_bytes: Optional[int] = None) -> AsyncIterator[AudioSegment]:
+    """Split a streamed upload into audio segments as the bytes arrive.
+
+    A multipart body yields one segment per file part, each as soon as that part
+    ends, so earlier segments can be transcribed while later ones are still being
+    uploaded. Any other content type is treated as a single raw audio segment.
+    Plain multipart text fields are collected into `fields`. UploadTooLarge is
+    raised once more than `max_bytes` have arrived, before they are all buffered.
+    """
+    received = 0
+
+    async def limited():
+        nonlocal received
+        async for chunk in body:
+            received += len(chunk)
+            if max_bytes is not None and received > max_bytes:
+                raise UploadTooLarge(f"Upload is larger than {max_bytes} bytes")
+            yield chunk
+
+    mimetype, options = parse_options_header(content_type)
+    if mimetype != b'multipart/form-data':
+        chunks = [chunk async for chunk in limited()]
+        extension = mimetype.split(b'/')[-1].decode('latin-1') or 'webm'
+        if chunks:
+            yield f"audio.{extension}", b"".join(chunks)
+        return
+
+    boundary = options.get(b'boundary')
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    finished: deque = deque()
+    part = {}
+    header = {'field': b'', 'value': b''}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, chunks=[])
+
+    def on_part_data(data, start, end):
+        part['chunks'].append(data[start:end])
+
+    def on_header_field(data, start, end):
+        header['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        part['headers'][header['field'].lower()] = header['value']
+        header['field'], header['value'] = b'', b''
+
+    def on_part_end():
+        _, disposition = parse_options_header(part['headers'].get(b'content-disposition', b''))
+        payload = b"".join(part['chunks'])
+        filename = disposition.get(b'filename')
+        if filename is not None:
+            finished.append((filename.decode('utf-8', 'replace') or 'audio.webm', payload))
+        elif fields is not None and b'name' in disposition:
+            fields[disposition[b'name'].decode('utf-8', 'replace')] = payload.decode('utf-8', 'replace')
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+    })
+    async for chunk in limited():
+        parser.write(chunk)
+        while finished:
+            yield finished.popleft()
+    parser.finalize()
+    while finished:
+        yield finished.popleft()
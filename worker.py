@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from browser_use import Browser, BrowserConfig
+from browser_use.browser.context import BrowserContextConfig, BrowserContext
+
+import metrics
+from agent_runtime import build_agent, format_result, set_conversation_log, set_login_handler
+from artifacts import get_replay_store
+from conversation_log import get_conversation_log
+from browser_pool import get_browser_pool
+from jobs import CANCELLED, CANCELLING, QUEUED, JobStore, get_job_store
+from llm import get_llm
+from macros import get_macro_store
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoginRequired(Exception):
+    """The site needs a login, which a queued job cannot ask the user for."""
+
+
+class JobCancelled(Exception):
+    """The job was cancelled through the API while it was running."""
+
+
+class RunningJob:
+    def __init__(self, job: dict, agent):
+        self.job = job
+        self.agent = agent
+        self.login_domain: Optional[str] = None
+        self.timed_out = False
+
+
+class JobWorker:
+    """One worker process: claims jobs from the store and runs up to `concurrency` agents at a time.
+
+    Jobs have no chat to pause in, so a job that hits a login stops and fails with
+    'login_required' instead of retrying. Cancellation is noticed by polling the job's
+    status, and the per-job timeout is enforced here; if the whole process dies, the
+    job's lease runs out and another worker picks it up again.
+    """
+
+    def __init__(self, store: JobStore, worker_id: str, concurrency: int = 1, poll_interval: float = 1.0):
+        self.store = store
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.llm = get_llm()
+        self.browser_pool = get_browser_pool()
+        self.replay_store = get_replay_store(os.path.join(BASE_DIR, 'artifacts'))
+        self.conversation_log = get_conversation_log(os.path.join(BASE_DIR, 'conversations'))
+        self.macro_store = get_macro_store(os.path.join(BASE_DIR, 'macros.db'))
+        self.running: Dict[str, RunningJob] = {}
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        set_login_handler(self.on_login)
+        set_conversation_log(self.conversation_log)
+        if self.browser_pool.size > 0:
+            await self.browser_pool.start()
+        logger.info(f"Worker {self.worker_id} started (concurrency {self.concurrency}).")
+        in_flight = set()
+        last_sweep = 0.0
+        try:
+            while not self._stopping.is_set():
+                if time.monotonic() - last_sweep > 30:
+                    await asyncio.to_thread(self.store.requeue_expired)
+                    last_sweep = time.monotonic()
+                job = None
+                if len(in_flight) < self.concurrency:
+                    job = await asyncio.to_thread(self.store.claim, self.worker_id)
+                if job is None:
+                    await self._idle()
+                    continue
+                task = asyncio.create_task(self.run_job(job))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+        finally:
+            # Hand unfinished jobs back to the queue rather than waiting out their lease
+            for running in self.running.values():
+                running.agent.stop()
+            for task in list(in_flight):
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            if self.replay_store:
+                await self.replay_store.close()
+            if self.conversation_log:
+                await asyncio.to_thread(self.conversation_log.close)
+            await self.browser_pool.close()
+            logger.info(f"Worker {self.worker_id} stopped.")
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def emit(self, job_id: str, message: str):
+        await asyncio.to_thread(self.store.add_event, job_id, message)
+
+    async def on_login(self, domain: str, reason: str, browser_context: BrowserContext):
+        for running in self.running.values():
+            if running.agent.browser_context is browser_context:
+                running.login_domain = domain
+                running.agent.stop()
+                return
+        logger.error("No job owns this browser context. Cannot stop for login.")
+
+    async def run_job(self, job: dict):
+        job_id = job['id']
+        params = job['params']
+        timeline = metrics.timelines.start(job_id)
+        metrics.current_timeline.set(timeline)
+        logger.info(f"Worker {self.worker_id} running job {job_id} (attempt {job['attempts']}): {job['task']}")
+        await self.emit(job_id, f"Job started (attempt {job['attempts']} of {job['max_attempts']}).")
+
+        lease = None
+        browser = browser_context = None
+        watchdog = None
+        try:
+            with metrics.span('browser_acquire'):
+                if params.get('headless', True) and self.browser_pool.size > 0:
+                    lease = await self.browser_pool.acquire()
+                    browser, browser_context = lease.browser, lease.context
+                else:
+                    browser = Browser(config=BrowserConfig(headless=params.get('headless', True), disable_security=True))
+                    browser_context = BrowserContext(browser=browser, config=BrowserContextConfig())
+            use_macros = self.macro_store is not None and params.get('use_macros', False)
+            macro = await asyncio.to_thread(self.macro_store.find, job['task']) if use_macros else None
+            agent = build_agent(job['task'], self.llm, browser, browser_context,
+                                use_vision=params.get('use_vision', True), dom_diff=params.get('dom_diff', False), task_id=job_id,
+                                parallel_tabs=params.get('parallel_tabs', 0), block_resources=params.get('block_resources'),
+                                macro=macro)
+            running = self.running[job_id] = RunningJob(job, agent)
+            watchdog = asyncio.create_task(self.watch(running))
+
+            with metrics.span('agent_run'):
+                # The watchdog stops the agent at the deadline; wait_for is only the backstop
+                history = await asyncio.wait_for(agent.run(), timeout=job['timeout'] + 30)
+            if running.timed_out:
+                raise asyncio.TimeoutError()
+            if running.login_domain:
+                raise LoginRequired(running.login_domain)
+            if await asyncio.to_thread(self.store.status, job_id) == CANCELLING:
+                raise JobCancelled()
+
+            final_result = history.final_result() or "No result returned."
+            urls = [url for url in history.urls() if url]
+            timeline.finish('completed' if history.is_done() else 'incomplete')
+            metrics.TASKS_TOTAL.inc(outcome=timeline.outcome)
+            if use_macros:
+                await asyncio.to_thread(self.macro_store.complete, job['task'], history, agent.macro_replay,
+                                        history.is_done() and history.is_successful() is not False)
+            await self.emit(job_id, format_result(final_result, urls))
+            await asyncio.to_thread(self.store.complete, job_id, {
+                'final_result': final_result,
+                'urls': urls,
+                'done': history.is_done(),
+                'success': history.is_successful(),
+                'network': agent.network_stats(),
+                'macro': agent.macro_replay,
+                'timeline': timeline.to_dict(),
+            })
+            if history.is_done() and self.replay_store:
+                self.replay_store.submit(job_id, history, on_ready=self.announce_replay)
+        except LoginRequired as e:
+            await self.finish_failed(job_id, timeline, f"login_required: {e}", retry=False,
+                                     message=f"{e} needs a login. Run this task from the chat to log in interactively.")
+        except asyncio.TimeoutError:
+            await self.finish_failed(job_id, timeline, f"Timed out after {job['timeout']} seconds")
+        except (JobCancelled, asyncio.CancelledError):
+            # Cancelled through the API, or the worker is shutting down and hands the job back
+            await self.finish_failed(job_id, timeline, 'Stopped before finishing')
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            await self.finish_failed(job_id, timeline, str(e))
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            self.running.pop(job_id, None)
+            if self.conversation_log:
+                self.conversation_log.finish(job_id)
+            try:
+                if lease:
+                    await self.browser_pool.release(lease)
+                elif browser_context:
+                    await browser_context.close()
+                    await browser.close()
+            except Exception as e:
+                logger.error(f"Cleanup failed: {str(e)}")
+
+    async def finish_failed(self, job_id: str, timeline: metrics.TaskTimeline, error: str, retry: bool = True,
+                            message: Optional[str] = None):
+        status = await asyncio.to_thread(self.store.fail, job_id, error, retry)
+        timeline.finish(status)
+        metrics.TASKS_TOTAL.inc(outcome='failed' if status != CANCELLED else 'cancelled')
+        if status == CANCELLED:
+            await self.emit(job_id, "Job cancelled.")
+        elif status == QUEUED:
+            await self.emit(job_id, f"Attempt failed ({error}); the job will be retried.")
+        else:
+            await self.emit(job_id, message or f"Error processing task: {error}")
+
+    async def watch(self, running: RunningJob, interval: float = 2.0):
+        """Stop the job's agent once it is cancelled or runs past its timeout."""
+        job_id = running.job['id']
+        deadline = time.monotonic() + running.job['timeout']
+        while True:
+            await asyncio.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+            if time.monotonic() >= deadline:
+                logger.info(f"Job {job_id} hit its timeout; stopping its agent.")
+                running.timed_out = True
+                running.agent.stop()
+                return
+            if await asyncio.to_thread(self.store.status, job_id) == CANCELLING:
+                logger.info(f"Job {job_id} was cancelled; stopping its agent.")
+                running.agent.stop()
+                return
+
+    def announce_replay(self, job_id: str, record: dict):
+        if record.get('status') == 'ready':
+            self.store.add_event(job_id, f"/artifacts/{job_id}")
+
+
+def run_worker_process(worker_id: str, concurrency: int = 1):
+    """Entry point of one worker process."""
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        worker = JobWorker(get_job_store(), worker_id, concurrency=concurrency)
+    except ValueError as e:
+        logger.critical(f"Failed to start worker {worker_id}: {e}")
+        return
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, worker.stop)
+            except NotImplementedError:  # Windows
+                pass
+        await worker.run()
+
+    asyncio.run(main())
+
+
+def start_workers(count: int, concurrency: int = 1) -> List[multiprocessing.Process]:
+    """Spawn `count` worker processes (spawned, not forked, so no browser or loop state is inherited)."""
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(count):
+        process = context.Process(
+            target=run_worker_process, args=(f"{os.getpid()}-{index}", concurrency), name=f"siteguide-worker-{index}", daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = 30.0):
+    """Ask the workers to finish (SIGTERM) and kill any that don't exit in time."""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            process.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run SiteGuide agent workers against the job queue.')
+    parser.add_argument('--processes', type=int, default=int(os.getenv('JOB_WORKERS', '0')) or os.cpu_count() or 1)
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('JOB_WORKER_CONCURRENCY', '1')),
+                        help='agents each process runs at once')
+    args = parser.parse_args()
+    if args.processes == 1:
+        run_worker_process(f"{os.getpid()}-0", args.concurrency)
+    else:
+        workers = start_workers(args.processes, args.concurrency)
+        try:
+            for worker_process in workers:
+                worker_process.join()
+        except KeyboardInterrupt:
+            stop_workers(workers)